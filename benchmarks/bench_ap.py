@@ -0,0 +1,77 @@
+""" Micro-benchmark of the average precision computations of the VOC Pascal evaluator.
+
+Compares calculate_ap_every_point and calculate_ap_11_point_interp with their previous
+loop-based implementations on a long precision x recall curve and checks that both return the
+same values. The previous implementations are reproduced below, except for the slicing of the
+recall list at each step of the every point interpolation, which made it quadratic.
+
+Usage:
+    python benchmarks/bench_ap.py [number of points]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.evaluators.pascal_voc_evaluator import (calculate_ap_11_point_interp,
+                                                 calculate_ap_every_point)
+
+
+def loop_ap_every_point(rec, prec):
+    mrec = [0] + list(rec) + [1]
+    mpre = [0] + list(prec) + [0]
+    for i in range(len(mpre) - 1, 0, -1):
+        mpre[i - 1] = max(mpre[i - 1], mpre[i])
+    ii = []
+    for i in range(len(mrec) - 1):
+        if mrec[i + 1] != mrec[i]:
+            ii.append(i + 1)
+    ap = 0
+    for i in ii:
+        ap = ap + np.sum((mrec[i] - mrec[i - 1]) * mpre[i])
+    return [ap, mpre[0:len(mpre) - 1], mrec[0:len(mpre) - 1], ii]
+
+
+def loop_ap_11_point_interp(rec, prec, recall_vals=11):
+    mrec = list(rec)
+    mpre = list(prec)
+    rhoInterp = []
+    for r in list(np.linspace(0, 1, recall_vals)[::-1]):
+        argGreaterRecalls = np.argwhere(mrec[:] >= r)
+        pmax = 0
+        if argGreaterRecalls.size != 0:
+            pmax = max(mpre[argGreaterRecalls.min():])
+        rhoInterp.append(pmax)
+    return [sum(rhoInterp) / recall_vals, rhoInterp]
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+
+def main(n_points):
+    rng = np.random.RandomState(0)
+    TP = rng.uniform(size=n_points) < 0.3
+    acc_TP = np.cumsum(TP)
+    acc_FP = np.cumsum(~TP)
+    rec = acc_TP / (acc_TP[-1] + 100)
+    prec = acc_TP / (acc_TP + acc_FP)
+
+    new, t_new = _time(calculate_ap_every_point, rec, prec)
+    old, t_old = _time(loop_ap_every_point, rec, prec)
+    assert new[0] == old[0] and new[1] == old[1] and new[2] == old[2] and new[3] == old[3]
+    print(f'calculate_ap_every_point:     {t_old:8.3f}s -> {t_new:8.3f}s ({t_old / t_new:.0f}x)')
+
+    new, t_new = _time(calculate_ap_11_point_interp, rec, prec)
+    old, t_old = _time(loop_ap_11_point_interp, rec, prec)
+    assert new[0] == old[0]
+    print(f'calculate_ap_11_point_interp: {t_old:8.3f}s -> {t_new:8.3f}s ({t_old / t_new:.0f}x)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
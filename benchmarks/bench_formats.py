@@ -0,0 +1,93 @@
+""" Benchmark of the detection of the format of annotation files.
+
+Replicates the annotation files of toyexample (text files with absolute and relative values, pascal
+voc xml files and coco json files) into a temporary directory and compares get_format, which sniffs
+the beginning of each file and reads it only once, with the previous implementation, which tried
+every format in turn (parsing xml and json files twice and reading text files up to six times).
+
+Usage:
+    python benchmarks/bench_formats.py [number of files]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import src.utils.general_utils as general_utils
+import src.utils.validations as validations
+from src.utils.enumerators import FileFormat
+
+TOY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'toyexample')
+SOURCE_DIRS = [
+    'dets_classname_abs_xywh', 'dets_classid_rel_xcycwh', 'gts_vocpascal_format',
+    'gts_coco_format'
+]
+
+
+def previous_is_absolute_text_format(file_path, num_blocks=[6, 5], blocks_abs_values=[4]):
+    if not validations.is_text(file_path):
+        return False
+    if not validations.is_empty_file(file_path):
+        return validations.all_lines_have_blocks(
+            file_path, num_blocks=num_blocks) and validations.all_blocks_have_absolute_values(
+                file_path, blocks_abs_values=blocks_abs_values)
+    return True
+
+
+def previous_is_yolo_format(file_path):
+    return validations.is_text(file_path) and validations.all_lines_have_blocks(
+        file_path, num_blocks=[5, 6]) and validations.all_blocks_have_relative_values(
+            file_path, blocks_rel_values=[4])
+
+
+def previous_get_format(file_path):
+    if os.path.isfile(file_path) is False:
+        return FileFormat.UNKNOWN
+    if validations.is_pascal_format(file_path):
+        return FileFormat.PASCAL
+    if previous_is_absolute_text_format(file_path):
+        return FileFormat.ABSOLUTE_TEXT
+    if validations.is_labelme_format(file_path):
+        return FileFormat.LABEL_ME
+    if validations.is_coco_format(file_path):
+        return FileFormat.COCO
+    if validations.is_cvat_format(file_path):
+        return FileFormat.CVAT
+    if previous_is_yolo_format(file_path):
+        return FileFormat.YOLO
+    return FileFormat.UNKNOWN
+
+
+def _time(func, files):
+    start = time.perf_counter()
+    ret = [func(f) for f in files]
+    return ret, time.perf_counter() - start
+
+
+def main(n_files):
+    sources = []
+    for source_dir in SOURCE_DIRS:
+        sources += general_utils.get_files_recursively(os.path.join(TOY_DIR, source_dir))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(n_files):
+            source = sources[i % len(sources)]
+            name, ext = os.path.splitext(os.path.basename(source))
+            files.append(os.path.join(tmp_dir, f'{name}_{i}{ext}'))
+            shutil.copy(source, files[-1])
+
+        new, t_new = _time(validations.get_format, files)
+        old, t_old = _time(previous_get_format, files)
+        assert new == old
+        print(f'get_format ({n_files} files): '
+              f'{t_old:.3f}s -> {t_new:.3f}s ({t_old / t_new:.1f}x)')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
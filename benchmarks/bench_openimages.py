@@ -0,0 +1,110 @@
+""" Benchmark of the parsing of annotations in the OpenImages csv format.
+
+Writes a csv file with random boxes (coordinates with decimal commas, as in
+data/database/gts/openimages_format) for the images of data/database/images and compares
+openimage2bbset, which converts the columns at once and obtains the resolution of each image once,
+with the previous implementation of openimage2bb, which iterated over the rows and looked for the
+image and read its resolution for every row.
+
+Usage:
+    python benchmarks/bench_openimages.py [number of rows]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import src.utils.converter as converter
+import src.utils.general_utils as general_utils
+import src.utils.validations as validations
+from src.bounding_box import BoundingBox
+from src.utils.enumerators import BBFormat, BBType, CoordinatesType
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'database',
+                          'images')
+
+
+def previous_openimage2bb(annotations_path, images_dir, bb_type=BBType.GROUND_TRUTH):
+    ret = []
+    for file_path in converter._get_annotation_files(annotations_path):
+        if not validations.is_openimage_format(file_path):
+            continue
+        images_shapes = {}
+        csv = pd.read_csv(file_path, sep=',')
+        for i, row in csv.iterrows():
+            # the resolution was stored under the path of the image, but looked up by its id
+            if row['ImageID'] not in images_shapes:
+                img_name = row['ImageID']
+                image_file = general_utils.find_file(images_dir, img_name)
+                images_shapes[image_file] = general_utils.get_image_resolution(image_file)
+            if images_shapes[image_file] is None:
+                continue
+            if pd.isna(row['LabelName']) or pd.isna(row['XMin']) or pd.isna(
+                    row['XMax']) or pd.isna(row['YMin']) or pd.isna(row['YMax']):
+                continue
+            img_size = (images_shapes[image_file]['width'], images_shapes[image_file]['height'])
+            x1, x2, y1, y2 = (row['XMin'], row['XMax'], row['YMin'], row['YMax'])
+            x1 = x1.replace(',', '.') if isinstance(x1, str) else x1
+            x2 = x2.replace(',', '.') if isinstance(x2, str) else x2
+            y1 = y1.replace(',', '.') if isinstance(y1, str) else y1
+            y2 = y2.replace(',', '.') if isinstance(y2, str) else y2
+            x1, x2, y1, y2 = float(x1), float(x2), float(y1), float(y2)
+            confidence = None if pd.isna(row['Confidence']) else float(row['Confidence'])
+            if bb_type == BBType.DETECTED and confidence is None:
+                return ret
+            ret.append(
+                BoundingBox(image_name=general_utils.get_file_name_only(row['ImageID']),
+                            class_id=row['LabelName'],
+                            coordinates=(x1, y1, x2, y2),
+                            img_size=img_size,
+                            confidence=confidence,
+                            type_coordinates=CoordinatesType.RELATIVE,
+                            bb_type=bb_type,
+                            format=BBFormat.XYX2Y2))
+    return ret
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+
+def _write_csv(file_path, n_rows):
+    rng = random.Random(0)
+    images = sorted(os.listdir(IMAGES_DIR))
+    with open(file_path, 'w') as f:
+        f.write('ImageID,Source,LabelName,Confidence,XMin,XMax,YMin,YMax,IsOccluded,IsTruncated,'
+                'IsGroupOf,IsDepiction,IsInside\n')
+        for _ in range(n_rows):
+            x1, y1 = rng.uniform(0, 0.5), rng.uniform(0, 0.5)
+            x2, y2 = x1 + rng.uniform(0.01, 0.5), y1 + rng.uniform(0.01, 0.5)
+            coordinates = ','.join(f'"{v:.6f}"'.replace('.', ',') for v in (x1, x2, y1, y2))
+            f.write(f'{rng.choice(images)},,class_{rng.randrange(20)},,{coordinates},,,,,\n')
+
+
+def main(n_rows):
+    tmp_dir = tempfile.mkdtemp()
+    file_path = os.path.join(tmp_dir, 'annotations.csv')
+    try:
+        _write_csv(file_path, n_rows)
+        # start both runs without memoized image sizes
+        general_utils.image_size_cache.clear()
+        new, t_new = _time(lambda: converter.openimage2bbset(file_path, IMAGES_DIR))
+        general_utils.image_size_cache.clear()
+        old, t_old = _time(previous_openimage2bb, file_path, IMAGES_DIR)
+        assert new.to_bounding_boxes() == old
+        print(f'openimage2bb ({n_rows} rows): '
+              f'{t_old:.3f}s -> {t_new:.3f}s ({t_old / t_new:.1f}x)')
+    finally:
+        os.remove(file_path)
+        os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
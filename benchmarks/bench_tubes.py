@@ -0,0 +1,128 @@
+""" Benchmark of the spatio-temporal IOU between tubes.
+
+Generates random tubes (tracks with one box per frame) of a video and compares
+TubeEvaluator._tube_pairwise_iou, which aligns the tubes on the frames of the video and computes
+the intersections of all pairs with array broadcasting, with the previous implementation, which
+looped over the pairs of tubes and over their common frames.
+
+Then evaluates mAP@[.5:.95] on the tubes with one call of TubeEvaluator.evaluate, which reads the
+files and computes the IOUs once, and with a new evaluator for each threshold, as was needed before.
+
+Usage:
+    python benchmarks/bench_tubes.py [number of tubes] [number of frames]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.evaluators.tube_evaluator import TubeEvaluator
+from src.tube import Tube
+
+
+def previous_tubes_inter(tube1, tube2):
+    inter_frames = set(tube1.get_frames()).intersection(set(tube2.get_frames()))
+    inter = 0
+    for inter_frame in inter_frames:
+        box1 = tube1.get_boxes()[[i for i, e in enumerate(tube1.get_frames()) if e == inter_frame]]
+        box2 = tube2.get_boxes()[[i for i, e in enumerate(tube2.get_frames()) if e == inter_frame]]
+        width_height = np.minimum(box1[:, None, 2:], box2[:, 2:]) - np.maximum(
+            box1[:, None, :2], box2[:, :2])
+        width_height.clip(min=0, out=width_height)
+        inter += width_height.prod(axis=2)
+    return inter
+
+
+def previous_tube_pairwise_iou(preds, gts):
+    inter = np.zeros((len(preds), len(gts)))
+    union = np.zeros((len(preds), len(gts)))
+    for i, pred in enumerate(preds):
+        for j, gt in enumerate(gts):
+            inter[i, j] = previous_tubes_inter(pred, gt)
+            union[i, j] = pred.get_tube_volume() + gt.get_tube_volume()
+    return inter / (union - inter)
+
+
+def _random_tracks(rng, n_tubes, n_frames, confidence):
+    tracks = []
+    for _ in range(n_tubes):
+        start = rng.randrange(n_frames)
+        x, y = rng.uniform(0, 500), rng.uniform(0, 500)
+        track = []
+        for frame in range(start, min(n_frames, start + rng.randrange(1, n_frames // 2))):
+            x, y = x + rng.uniform(-5, 5), y + rng.uniform(-5, 5)
+            box = {'frame': frame, 'bbox': [x, y, rng.uniform(20, 80), rng.uniform(20, 80)]}
+            if confidence:
+                box['confidence'] = rng.random()
+            track.append(box)
+        tracks.append(track)
+    return tracks
+
+
+def _random_tubes(rng, n_tubes, n_frames, confidence):
+    return [
+        Tube(category_id=0, video_id=0, track=track)
+        for track in _random_tracks(rng, n_tubes, n_frames, confidence)
+    ]
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+
+def main(n_tubes, n_frames):
+    rng = random.Random(0)
+    preds = _random_tubes(rng, n_tubes, n_frames, confidence=True)
+    gts = _random_tubes(rng, n_tubes, n_frames, confidence=False)
+    evaluator = TubeEvaluator('anno.json', 'preds.json')
+    new, t_new = _time(evaluator._tube_pairwise_iou, preds, gts)
+    old, t_old = _time(previous_tube_pairwise_iou, preds, gts)
+    assert np.allclose(new, old, rtol=1e-12, atol=0)
+    print(f'tube pairwise iou ({n_tubes}x{n_tubes} tubes, {n_frames} frames): '
+          f'{t_old:.3f}s -> {t_new:.3f}s ({t_old / t_new:.1f}x)')
+
+    tmp_dir = tempfile.mkdtemp()
+    anno_file = os.path.join(tmp_dir, 'anno.json')
+    preds_file = os.path.join(tmp_dir, 'preds.json')
+    try:
+        videos, classes = range(4), range(3)
+        annotations, preds = [], []
+        for video_id in videos:
+            for category_id in classes:
+                for track in _random_tracks(rng, n_tubes, n_frames, confidence=False):
+                    annotations.append(dict(category_id=category_id, video_id=video_id,
+                                            track=track))
+                for track in _random_tracks(rng, n_tubes, n_frames, confidence=True):
+                    preds.append(dict(category_id=category_id, video_id=video_id, track=track))
+        with open(anno_file, 'w') as f:
+            json.dump({'videos': [{'id': v} for v in videos],
+                       'categories': [{'id': c, 'name': str(c)} for c in classes],
+                       'annotations': annotations}, f)
+        with open(preds_file, 'w') as f:
+            json.dump(preds, f)
+
+        thrs = np.linspace(0.5, 0.95, 10)
+        (new, mAP_new), t_new = _time(TubeEvaluator(anno_file, preds_file).evaluate, thrs)
+        start = time.perf_counter()
+        mAPs_old = [TubeEvaluator(anno_file, preds_file).evaluate(thr)[1] for thr in thrs]
+        t_old = time.perf_counter() - start
+        assert [mAP for _, mAP in new.values()] == mAPs_old
+        print(f'tube mAP@[.5:.95] ({len(videos)} videos, {len(classes)} classes): '
+              f'{t_old:.3f}s -> {t_new:.3f}s ({t_old / t_new:.1f}x)')
+    finally:
+        os.remove(anno_file)
+        os.remove(preds_file)
+        os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 400)
@@ -0,0 +1,51 @@
+""" Benchmark of the validation policies of the converters.
+
+Replicates the detections of toyexample (text files with absolute values) into a temporary
+directory and loads them with text2bb validating every file (the default), a sample of the files
+and none of them.
+
+Usage:
+    python benchmarks/bench_validation.py [number of files]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import src.utils.converter as converter
+import src.utils.general_utils as general_utils
+from src.utils.enumerators import BBType
+from src.utils.validations import ValidationPolicy
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'toyexample',
+                          'dets_classname_abs_xywh')
+
+
+def _time(func, *args, **kwargs):
+    start = time.perf_counter()
+    ret = func(*args, **kwargs)
+    return ret, time.perf_counter() - start
+
+
+def main(n_files):
+    sources = general_utils.get_files_recursively(SOURCE_DIR)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for i in range(n_files):
+            name = os.path.splitext(os.path.basename(sources[i % len(sources)]))[0]
+            shutil.copy(sources[i % len(sources)], os.path.join(tmp_dir, f'{name}_{i}.txt'))
+        full, t_full = _time(converter.text2bb, tmp_dir, bb_type=BBType.DETECTED)
+        for policy in [ValidationPolicy.sample(100), ValidationPolicy.none()]:
+            ret, t = _time(converter.text2bb, tmp_dir, bb_type=BBType.DETECTED, validation=policy)
+            assert ret == full
+            print(f'text2bb ({n_files} files), {policy!r}: '
+                  f'{t_full:.3f}s -> {t:.3f}s ({t_full / t:.1f}x)')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
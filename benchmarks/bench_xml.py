@@ -0,0 +1,87 @@
+""" Benchmark of the parsing of annotations in the Pascal VOC (ImageNet) format.
+
+Replicates the files of toyexample/gts_vocpascal_format into a temporary directory and compares
+vocpascal2bb, which parses each xml file once, with the previous implementation, which parsed the
+file twice for each validated tag and once more for each extracted field.
+
+Usage:
+    python benchmarks/bench_xml.py [number of copies of each file]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import src.utils.converter as converter
+import src.utils.general_utils as general_utils
+from src.bounding_box import BoundingBox
+from src.utils.enumerators import BBFormat, BBType, CoordinatesType
+
+TOY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'toyexample',
+                       'gts_vocpascal_format')
+
+
+def previous_vocpascal2bb(annotations_path):
+    ret = []
+    for file_path in converter._get_annotation_files(annotations_path):
+        # validation
+        if os.path.splitext(file_path)[-1].lower() != '.xml':
+            continue
+        total_match = 0
+        tags = ['annotation', './size/width', './size/height']
+        for tag in tags:
+            if ET.parse(file_path)._root.tag == tag:
+                total_match += 1
+            elif ET.parse(file_path).find(tag) not in [[], None]:
+                total_match += 1
+        if total_match != len(tags):
+            continue
+        # extraction
+        img_name = general_utils.get_file_name_only(ET.parse(file_path).find('filename').text)
+        img_width = int(ET.parse(file_path).find('size/width').text)
+        img_height = int(ET.parse(file_path).find('size/height').text)
+        for box_info in ET.parse(file_path).iter('object'):
+            ret.append(
+                BoundingBox(image_name=img_name,
+                            class_id=box_info.find('name').text,
+                            coordinates=(int(float(box_info.find('bndbox/xmin').text)),
+                                         int(float(box_info.find('bndbox/ymin').text)),
+                                         int(float(box_info.find('bndbox/xmax').text)),
+                                         int(float(box_info.find('bndbox/ymax').text))),
+                            img_size=(img_width, img_height),
+                            type_coordinates=CoordinatesType.ABSOLUTE,
+                            bb_type=BBType.GROUND_TRUTH,
+                            format=BBFormat.XYX2Y2))
+    return ret
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+
+def main(n_copies):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for f in os.listdir(TOY_DIR):
+            name, ext = os.path.splitext(f)
+            for i in range(n_copies):
+                shutil.copy(os.path.join(TOY_DIR, f), os.path.join(tmp_dir, f'{name}_{i}{ext}'))
+        n_files = len(os.listdir(tmp_dir))
+
+        new, t_new = _time(converter.vocpascal2bb, tmp_dir)
+        old, t_old = _time(previous_vocpascal2bb, tmp_dir)
+        assert new == old
+        print(f'vocpascal2bb ({n_files} files, {len(new)} boxes): '
+              f'{t_old:.3f}s -> {t_new:.3f}s ({t_old / t_new:.1f}x)')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,413 @@
+import numpy as np
+
+from src.bounding_box import BoundingBox
+from src.utils.enumerators import BBFormat, BBType, CoordinatesType
+
+
+class BoundingBoxSet:
+    """ Columnar container of bounding boxes.
+
+    Coordinates, confidences, classes and images are kept in contiguous NumPy arrays. Classes and
+    image names are interned into tables, so each box only stores an index into them. The
+    container converts losslessly to and from lists of BoundingBox objects and can be passed to
+    the evaluators in place of such lists.
+    """
+    def __init__(self,
+                 boxes,
+                 image_indices,
+                 images,
+                 class_indices,
+                 classes,
+                 confidences=None,
+                 img_sizes=None,
+                 bb_type=BBType.GROUND_TRUTH,
+                 format=BBFormat.XYX2Y2,
+                 type_coordinates=CoordinatesType.ABSOLUTE):
+        """ Constructor.
+
+        Parameters
+        ----------
+            boxes : array-like
+                Array (N, 4) with the absolute coordinates of the bounding boxes. See parameter
+                `format`.
+            image_indices : array-like
+                Array (N,) of integers indexing `images`.
+            images : list
+                Table with the names of the images.
+            class_indices : array-like
+                Array (N,) of integers indexing `classes`.
+            classes : list
+                Table with the class ids.
+            confidences : array-like (optional)
+                Array (N,) with the confidences of the boxes. NaN represents a box without
+                confidence. If bb_type is BBType.DETECTED, confidences must be informed.
+            img_sizes : array-like (optional)
+                Array (N, 2) with the sizes (width, height) of the images of the boxes. Negative
+                values represent an unknown size.
+            bb_type : Enum (optional)
+                Enum identifying if the bounding boxes are ground truths or detections.
+            format : Enum (optional)
+                Enum (BBFormat.XYWH or BBFormat.XYX2Y2) indicating the format of `boxes`.
+            type_coordinates : Enum (optional)
+                Enum recording if the coordinates were originally given as absolute or relative
+                values. `boxes` must always contain absolute coordinates.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        if format == BBFormat.XYWH:
+            wh = boxes[:, 2:].copy()
+            boxes = np.concatenate([boxes[:, :2], boxes[:, :2] + wh], axis=1)
+        elif format == BBFormat.XYX2Y2:
+            wh = boxes[:, 2:] - boxes[:, :2]
+        else:
+            raise IOError('The format of the boxes must be either XYWH or XYX2Y2.')
+        if confidences is None:
+            if bb_type == BBType.DETECTED:
+                raise IOError(
+                    'For bb_type=\'Detected\', it is necessary to inform the confidence values.')
+            confidences = np.full(n, np.nan)
+        if img_sizes is None:
+            img_sizes = np.full((n, 2), -1)
+        self._boxes = boxes
+        self._wh = wh
+        self._confidences = np.asarray(confidences, dtype=np.float64).reshape(n)
+        self._image_indices = np.asarray(image_indices, dtype=np.int64).reshape(n)
+        self._images = list(images)
+        self._class_indices = np.asarray(class_indices, dtype=np.int64).reshape(n)
+        self._classes = list(classes)
+        self._img_sizes = np.asarray(img_sizes, dtype=np.int64).reshape(n, 2)
+        self._bb_types = np.full(n, bb_type.value, dtype=np.int8)
+        self._coordinates_types = np.full(n, type_coordinates.value, dtype=np.int8)
+        self._formats = np.full(n, format.value, dtype=np.int8)
+        self._class_lookup = None
+        self._image_lookup = None
+
+    @classmethod
+    def _from_columns(cls, **columns):
+        ret = cls.__new__(cls)
+        for name, value in columns.items():
+            setattr(ret, name, value)
+        ret._class_lookup = None
+        ret._image_lookup = None
+        return ret
+
+    @classmethod
+    def empty(cls, bb_type=BBType.GROUND_TRUTH):
+        """ Create a set without bounding boxes. """
+        return cls(np.zeros((0, 4)), [], [], [], [],
+                   confidences=np.zeros(0),
+                   bb_type=bb_type)
+
+    @classmethod
+    def from_arrays(cls,
+                    boxes,
+                    image_names,
+                    class_ids,
+                    confidences=None,
+                    img_sizes=None,
+                    bb_type=BBType.GROUND_TRUTH,
+                    format=BBFormat.XYWH):
+        """ Create a set interning per-box image names and class ids.
+
+        Parameters
+        ----------
+            boxes : array-like
+                Array (N, 4) with the absolute coordinates of the bounding boxes.
+            image_names : sequence
+                Name of the image of each bounding box.
+            class_ids : sequence
+                Class id of each bounding box.
+            confidences, img_sizes, bb_type, format :
+                See the constructor.
+
+        Returns
+        -------
+        BoundingBoxSet
+            The created set.
+        """
+        images, image_indices = _intern(image_names)
+        classes, class_indices = _intern(class_ids)
+        return cls(boxes,
+                   image_indices,
+                   images,
+                   class_indices,
+                   classes,
+                   confidences=confidences,
+                   img_sizes=img_sizes,
+                   bb_type=bb_type,
+                   format=format)
+
+    @classmethod
+    def from_bounding_boxes(cls, bounding_boxes):
+        """ Create a set from a list of BoundingBox objects.
+
+        Parameters
+        ----------
+            bounding_boxes : list
+                List of BoundingBox objects.
+
+        Returns
+        -------
+        BoundingBoxSet
+            The created set.
+        """
+        n = len(bounding_boxes)
+        boxes = np.empty((n, 4))
+        wh = np.empty((n, 2))
+        confidences = np.full(n, np.nan)
+        img_sizes = np.full((n, 2), -1, dtype=np.int64)
+        bb_types = np.empty(n, dtype=np.int8)
+        coordinates_types = np.empty(n, dtype=np.int8)
+        formats = np.empty(n, dtype=np.int8)
+        for i, bb in enumerate(bounding_boxes):
+            boxes[i] = bb.get_absolute_bounding_box(format=BBFormat.XYX2Y2)
+            wh[i] = bb.get_absolute_bounding_box(format=BBFormat.XYWH)[2:]
+            if bb.get_confidence() is not None:
+                confidences[i] = bb.get_confidence()
+            w_img, h_img = bb.get_image_size()
+            if w_img is not None and h_img is not None:
+                img_sizes[i] = w_img, h_img
+            bb_types[i] = bb.get_bb_type().value
+            coordinates_types[i] = bb.get_coordinates_type().value
+            formats[i] = bb.get_format().value
+        images, image_indices = _intern([bb.get_image_name() for bb in bounding_boxes])
+        classes, class_indices = _intern([bb.get_class_id() for bb in bounding_boxes])
+        return cls._from_columns(_boxes=boxes,
+                                 _wh=wh,
+                                 _confidences=confidences,
+                                 _image_indices=image_indices,
+                                 _images=images,
+                                 _class_indices=class_indices,
+                                 _classes=classes,
+                                 _img_sizes=img_sizes,
+                                 _bb_types=bb_types,
+                                 _coordinates_types=coordinates_types,
+                                 _formats=formats)
+
+    @staticmethod
+    def concatenate(bb_sets):
+        """ Concatenate multiple sets into a single one, merging their tables.
+
+        Parameters
+        ----------
+            bb_sets : list
+                List of BoundingBoxSet objects.
+
+        Returns
+        -------
+        BoundingBoxSet
+            Set with the bounding boxes of all sets, in the given order.
+        """
+        bb_sets = list(bb_sets)
+        if len(bb_sets) == 0:
+            return BoundingBoxSet.empty()
+        images, image_lookup, image_indices = [], {}, []
+        classes, class_lookup, class_indices = [], {}, []
+        for bb_set in bb_sets:
+            image_map = np.array([image_lookup.setdefault(i, len(image_lookup))
+                                  for i in bb_set._images],
+                                 dtype=np.int64)
+            class_map = np.array([class_lookup.setdefault(c, len(class_lookup))
+                                  for c in bb_set._classes],
+                                 dtype=np.int64)
+            image_indices.append(image_map[bb_set._image_indices])
+            class_indices.append(class_map[bb_set._class_indices])
+        images = list(image_lookup)
+        classes = list(class_lookup)
+        columns = {
+            name: np.concatenate([getattr(s, name) for s in bb_sets])
+            for name in ('_boxes', '_wh', '_confidences', '_img_sizes', '_bb_types',
+                         '_coordinates_types', '_formats')
+        }
+        return BoundingBoxSet._from_columns(_image_indices=np.concatenate(image_indices),
+                                            _images=images,
+                                            _class_indices=np.concatenate(class_indices),
+                                            _classes=classes,
+                                            **columns)
+
+    def to_bounding_boxes(self):
+        """ Convert the set into a list of BoundingBox objects.
+
+        Returns
+        -------
+        list
+            List of BoundingBox objects.
+        """
+        return [self._get_bounding_box(i) for i in range(len(self))]
+
+    def _get_bounding_box(self, i):
+        w_img, h_img = self._img_sizes[i]
+        img_size = None if w_img < 0 or h_img < 0 else (int(w_img), int(h_img))
+        confidence = self._confidences[i]
+        bb = BoundingBox(image_name=self._images[self._image_indices[i]],
+                         class_id=self._classes[self._class_indices[i]],
+                         coordinates=tuple(float(v) for v in self._boxes[i]),
+                         type_coordinates=CoordinatesType.ABSOLUTE,
+                         img_size=img_size,
+                         bb_type=BBType(self._bb_types[i]),
+                         confidence=None if np.isnan(confidence) else float(confidence),
+                         format=BBFormat.XYX2Y2)
+        # Restore the attributes that may not be derived from the absolute coordinates
+        bb._w, bb._h = float(self._wh[i, 0]), float(self._wh[i, 1])
+        bb._type_coordinates = CoordinatesType(self._coordinates_types[i])
+        bb._format = BBFormat(self._formats[i])
+        return bb
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get_bounding_box(i)
+
+    def __getitem__(self, key):
+        """ Get a BoundingBox (integer key) or a subset sharing the same tables (slice, boolean
+        mask or array of indices). """
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('BoundingBoxSet index out of range')
+            return self._get_bounding_box(key)
+        ret = BoundingBoxSet._from_columns(_boxes=self._boxes[key],
+                                           _wh=self._wh[key],
+                                           _confidences=self._confidences[key],
+                                           _image_indices=self._image_indices[key],
+                                           _images=self._images,
+                                           _class_indices=self._class_indices[key],
+                                           _classes=self._classes,
+                                           _img_sizes=self._img_sizes[key],
+                                           _bb_types=self._bb_types[key],
+                                           _coordinates_types=self._coordinates_types[key],
+                                           _formats=self._formats[key])
+        ret._class_lookup = self._class_lookup
+        ret._image_lookup = self._image_lookup
+        return ret
+
+    def __str__(self):
+        return f'BoundingBoxSet(num_boxes={len(self)}, num_images={len(self._images)}, ' \
+            f'num_classes={len(self._classes)})'
+
+    __repr__ = __str__
+
+    def get_boxes(self, format=BBFormat.XYX2Y2):
+        """ Get the absolute coordinates of the bounding boxes.
+
+        Parameters
+        ----------
+        format : Enum
+            Format of the bounding boxes (BBFormat.XYWH or BBFormat.XYX2Y2) to be retrieved.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array (N, 4) with the coordinates of the bounding boxes.
+        """
+        if format == BBFormat.XYWH:
+            return np.concatenate([self._boxes[:, :2], self._wh], axis=1)
+        return self._boxes
+
+    def get_confidences(self):
+        """ Get the confidences of the bounding boxes (NaN for ground truths). """
+        return self._confidences
+
+    def get_img_sizes(self):
+        """ Get the image sizes (width, height) of the bounding boxes (-1 if unknown). """
+        return self._img_sizes
+
+    def set_bb_type(self, bb_type):
+        """ Set the type (ground truth or detection) of all bounding boxes. """
+        self._bb_types = np.full(len(self), bb_type.value, dtype=np.int8)
+
+    def get_classes(self):
+        """ Get the table of class ids. """
+        return self._classes
+
+    def get_class_indices(self):
+        """ Get the index, in the table of classes, of the class of each bounding box. """
+        return self._class_indices
+
+    def get_class_ids(self):
+        """ Get the class id of each bounding box. """
+        return _lookup(self._classes, self._class_indices)
+
+    def get_images(self):
+        """ Get the table of image names. """
+        return self._images
+
+    def get_image_indices(self):
+        """ Get the index, in the table of images, of the image of each bounding box. """
+        return self._image_indices
+
+    def get_image_names(self):
+        """ Get the image name of each bounding box. """
+        return _lookup(self._images, self._image_indices)
+
+    def get_class_index(self, class_id):
+        """ Get the index of a class id in the table of classes (None if not in the table). """
+        if self._class_lookup is None:
+            self._class_lookup = {c: i for i, c in enumerate(self._classes)}
+        return self._class_lookup.get(class_id)
+
+    def get_image_index(self, image_name):
+        """ Get the index of an image name in the table of images (None if not in the table). """
+        if self._image_lookup is None:
+            self._image_lookup = {img: i for i, img in enumerate(self._images)}
+        return self._image_lookup.get(image_name)
+
+    def unique_classes(self):
+        """ Get the class ids present in the set, in order of first appearance. """
+        _, first = np.unique(self._class_indices, return_index=True)
+        return [self._classes[self._class_indices[i]] for i in np.sort(first)]
+
+    def filter_class(self, class_id):
+        """ Get the subset of bounding boxes of a given class. """
+        idx = self.get_class_index(class_id)
+        if idx is None:
+            return self[np.zeros(0, dtype=np.int64)]
+        return self[self._class_indices == idx]
+
+    def group_by_image_and_class(self):
+        """ Group the bounding boxes by image and class.
+
+        Returns
+        -------
+        dict
+            Dictionary whose keys are (image name, class id) tuples, in order of first
+            appearance, and whose values are arrays with the indices of the bounding boxes of the
+            group, in their original order.
+        """
+        if len(self) == 0:
+            return {}
+        codes = self._image_indices * max(len(self._classes), 1) + self._class_indices
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        groups = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+        ret = {}
+        for g in np.argsort(first, kind='stable'):
+            i = groups[g][0]
+            key = (self._images[self._image_indices[i]], self._classes[self._class_indices[i]])
+            ret[key] = groups[g]
+        return ret
+
+
+def as_bounding_box_set(bounding_boxes):
+    """ Return `bounding_boxes` as a BoundingBoxSet, converting lists of BoundingBox objects. """
+    if isinstance(bounding_boxes, BoundingBoxSet):
+        return bounding_boxes
+    return BoundingBoxSet.from_bounding_boxes(list(bounding_boxes))
+
+
+def _intern(values):
+    lookup = {}
+    indices = np.fromiter((lookup.setdefault(v, len(lookup)) for v in values),
+                          dtype=np.int64,
+                          count=len(values))
+    return list(lookup), indices
+
+
+def _lookup(table, indices):
+    arr = np.empty(len(table), dtype=object)
+    for i, value in enumerate(table):
+        arr[i] = value
+    return arr[indices]
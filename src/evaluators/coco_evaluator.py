@@ -19,13 +19,22 @@
         convention for area calculation.
 """
 
+import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from src.bounding_box import BBFormat
+from src.bounding_box_set import BoundingBoxSet, as_bounding_box_set
+from src.utils.enumerators import BBType
 
+# 10 iou thresholds (.5:.05:.95)
+_IOU_THRESHOLDS = np.linspace(0.5, 0.95, int(np.round((0.95 - 0.5) / 0.05)) + 1, endpoint=True)
+# all, small, medium and large areas
+_AREA_RANGES = [(0, np.inf), (0, 32**2), (32**2, 96**2), (96**2, np.inf)]
+_MAX_DETS = [1, 10, 100]
 
-def get_coco_summary(groundtruth_bbs, detected_bbs):
+
+def get_coco_summary(groundtruth_bbs, detected_bbs, workers=None, executor=None):
     """Calculate the 12 standard metrics used in COCOEval,
         AP, AP50, AP75,
         AR1, AR10, AR100,
@@ -38,10 +47,18 @@ def get_coco_summary(groundtruth_bbs, detected_bbs):
 
     Parameters
         ----------
-            groundtruth_bbs : list
-                A list containing objects of type BoundingBox representing the ground-truth bounding boxes.
-            detected_bbs : list
-                A list containing objects of type BoundingBox representing the detected bounding boxes.
+            groundtruth_bbs : list or BoundingBoxSet
+                A list containing objects of type BoundingBox (or a BoundingBoxSet) representing
+                the ground-truth bounding boxes.
+            detected_bbs : list or BoundingBoxSet
+                A list containing objects of type BoundingBox (or a BoundingBoxSet) representing
+                the detected bounding boxes.
+            workers : int (optional)
+                Number of processes used to evaluate the image X class pairs. By default, they are
+                evaluated serially. The results are the same in both cases.
+            executor : concurrent.futures.Executor (optional)
+                Executor used to evaluate the image X class pairs, instead of creating a process
+                pool with `workers` processes.
     Returns:
             A dictionary with one entry for each metric.
     """
@@ -49,50 +66,30 @@ def get_coco_summary(groundtruth_bbs, detected_bbs):
     # separate bbs per image X class
     _bbs = _group_detections(detected_bbs, groundtruth_bbs)
 
-    # pairwise ious
-    _ious = {k: _compute_ious(**v) for k, v in _bbs.items()}
-
-    def _evaluate(iou_threshold, max_dets, area_range):
-        # accumulate evaluations on a per-class basis
-        _evals = defaultdict(lambda: {"scores": [], "matched": [], "NP": []})
-        for img_id, class_id in _bbs:
-            ev = _evaluate_image(
-                _bbs[img_id, class_id]["dt"],
-                _bbs[img_id, class_id]["gt"],
-                _ious[img_id, class_id],
-                iou_threshold,
-                max_dets,
-                area_range,
-            )
-            acc = _evals[class_id]
-            acc["scores"].append(ev["scores"])
-            acc["matched"].append(ev["matched"])
-            acc["NP"].append(ev["NP"])
-
-        # now reduce accumulations
-        for class_id in _evals:
-            acc = _evals[class_id]
-            acc["scores"] = np.concatenate(acc["scores"])
-            acc["matched"] = np.concatenate(acc["matched"]).astype(np.bool)
-            acc["NP"] = np.sum(acc["NP"])
-
-        res = []
-        # run ap calculation per-class
-        for class_id in _evals:
-            ev = _evals[class_id]
-            res.append({
+    # match each image X class pair once for all thresholds and area ranges
+    _evals = _evaluate_images(_bbs,
+                              _IOU_THRESHOLDS,
+                              max(_MAX_DETS),
+                              _AREA_RANGES,
+                              workers=workers,
+                              executor=executor)
+
+    return _summarize(_accumulate(_evals))
+
+
+def _summarize(accumulated):
+    """ compute the 12 COCO metrics from per-class accumulations (see _accumulate) """
+    def _evaluate(area_idx, max_dets):
+        res = {}
+        for t_idx, iou_threshold in enumerate(_IOU_THRESHOLDS):
+            res[iou_threshold] = [{
                 "class": class_id,
-                **_compute_ap_recall(ev["scores"], ev["matched"], ev["NP"]),
-            })
+                **_compute_accumulated_ap_recall(acc, area_idx, t_idx, max_dets),
+            } for class_id, acc in accumulated.items()]
         return res
 
-    iou_thresholds = np.linspace(0.5, 0.95, int(np.round((0.95 - 0.5) / 0.05)) + 1, endpoint=True)
-
     # compute simple AP with all thresholds, using up to 100 dets, and all areas
-    full = {
-        i: _evaluate(iou_threshold=i, max_dets=100, area_range=(0, np.inf))
-        for i in iou_thresholds
-    }
+    full = _evaluate(area_idx=0, max_dets=100)
 
     AP50 = np.mean([x['AP'] for x in full[0.50] if x['AP'] is not None])
     AP75 = np.mean([x['AP'] for x in full[0.75] if x['AP'] is not None])
@@ -102,10 +99,7 @@ def get_coco_summary(groundtruth_bbs, detected_bbs):
     AR100 = np.mean(
         [x['TP'] / x['total positives'] for k in full for x in full[k] if x['TP'] is not None])
 
-    small = {
-        i: _evaluate(iou_threshold=i, max_dets=100, area_range=(0, 32**2))
-        for i in iou_thresholds
-    }
+    small = _evaluate(area_idx=1, max_dets=100)
     APsmall = [x['AP'] for k in small for x in small[k] if x['AP'] is not None]
     APsmall = np.nan if APsmall == [] else np.mean(APsmall)
     ARsmall = [
@@ -113,10 +107,7 @@ def get_coco_summary(groundtruth_bbs, detected_bbs):
     ]
     ARsmall = np.nan if ARsmall == [] else np.mean(ARsmall)
 
-    medium = {
-        i: _evaluate(iou_threshold=i, max_dets=100, area_range=(32**2, 96**2))
-        for i in iou_thresholds
-    }
+    medium = _evaluate(area_idx=2, max_dets=100)
     APmedium = [x['AP'] for k in medium for x in medium[k] if x['AP'] is not None]
     APmedium = np.nan if APmedium == [] else np.mean(APmedium)
     ARmedium = [
@@ -124,10 +115,7 @@ def get_coco_summary(groundtruth_bbs, detected_bbs):
     ]
     ARmedium = np.nan if ARmedium == [] else np.mean(ARmedium)
 
-    large = {
-        i: _evaluate(iou_threshold=i, max_dets=100, area_range=(96**2, np.inf))
-        for i in iou_thresholds
-    }
+    large = _evaluate(area_idx=3, max_dets=100)
     APlarge = [x['AP'] for k in large for x in large[k] if x['AP'] is not None]
     APlarge = np.nan if APlarge == [] else np.mean(APlarge)
     ARlarge = [
@@ -135,18 +123,12 @@ def get_coco_summary(groundtruth_bbs, detected_bbs):
     ]
     ARlarge = np.nan if ARlarge == [] else np.mean(ARlarge)
 
-    max_det1 = {
-        i: _evaluate(iou_threshold=i, max_dets=1, area_range=(0, np.inf))
-        for i in iou_thresholds
-    }
+    max_det1 = _evaluate(area_idx=0, max_dets=1)
     AR1 = np.mean([
         x['TP'] / x['total positives'] for k in max_det1 for x in max_det1[k] if x['TP'] is not None
     ])
 
-    max_det10 = {
-        i: _evaluate(iou_threshold=i, max_dets=10, area_range=(0, np.inf))
-        for i in iou_thresholds
-    }
+    max_det10 = _evaluate(area_idx=0, max_dets=10)
     AR10 = np.mean([
         x['TP'] / x['total positives'] for k in max_det10 for x in max_det10[k]
         if x['TP'] is not None
@@ -174,21 +156,31 @@ def get_coco_metrics(
         iou_threshold=0.5,
         area_range=(0, np.inf),
         max_dets=100,
+        workers=None,
+        executor=None,
 ):
     """ Calculate the Average Precision and Recall metrics as in COCO's official implementation
         given an IOU threshold, area range and maximum number of detections.
     Parameters
         ----------
-            groundtruth_bbs : list
-                A list containing objects of type BoundingBox representing the ground-truth bounding boxes.
-            detected_bbs : list
-                A list containing objects of type BoundingBox representing the detected bounding boxes.
+            groundtruth_bbs : list or BoundingBoxSet
+                A list containing objects of type BoundingBox (or a BoundingBoxSet) representing
+                the ground-truth bounding boxes.
+            detected_bbs : list or BoundingBoxSet
+                A list containing objects of type BoundingBox (or a BoundingBoxSet) representing
+                the detected bounding boxes.
             iou_threshold : float
                 Intersection Over Union (IOU) value used to consider a TP detection.
             area_range : (numerical x numerical)
                 Lower and upper bounds on annotation areas that should be considered.
             max_dets : int
                 Upper bound on the number of detections to be considered for each class in an image.
+            workers : int (optional)
+                Number of processes used to evaluate the image X class pairs. By default, they are
+                evaluated serially. The results are the same in both cases.
+            executor : concurrent.futures.Executor (optional)
+                Executor used to evaluate the image X class pairs, instead of creating a process
+                pool with `workers` processes.
 
     Returns:
             A list of dictionaries. One dictionary for each class.
@@ -210,67 +202,223 @@ def get_coco_metrics(
     # separate bbs per image X class
     _bbs = _group_detections(detected_bbs, groundtruth_bbs)
 
-    # pairwise ious
-    _ious = {k: _compute_ious(**v) for k, v in _bbs.items()}
-
     # accumulate evaluations on a per-class basis
-    _evals = defaultdict(lambda: {"scores": [], "matched": [], "NP": []})
-
-    for img_id, class_id in _bbs:
-        ev = _evaluate_image(
-            _bbs[img_id, class_id]["dt"],
-            _bbs[img_id, class_id]["gt"],
-            _ious[img_id, class_id],
-            iou_threshold,
-            max_dets,
-            area_range,
-        )
-        acc = _evals[class_id]
-        acc["scores"].append(ev["scores"])
-        acc["matched"].append(ev["matched"])
-        acc["NP"].append(ev["NP"])
-
-    # now reduce accumulations
-    for class_id in _evals:
-        acc = _evals[class_id]
-        acc["scores"] = np.concatenate(acc["scores"])
-        acc["matched"] = np.concatenate(acc["matched"]).astype(np.bool)
-        acc["NP"] = np.sum(acc["NP"])
+    _evals = _evaluate_images(_bbs, [iou_threshold],
+                              max_dets, [area_range],
+                              workers=workers,
+                              executor=executor)
+    accumulated = _accumulate(_evals)
 
     res = {}
     # run ap calculation per-class
-    for class_id in _evals:
-        ev = _evals[class_id]
+    for class_id, acc in accumulated.items():
         res[class_id] = {
             "class": class_id,
-            **_compute_ap_recall(ev["scores"], ev["matched"], ev["NP"])
+            **_compute_accumulated_ap_recall(acc, 0, 0, max_dets)
         }
     return res
 
 
+class CocoAccumulator:
+    """ Incremental version of get_coco_summary.
+
+    Images are matched as soon as they are added, and only the per-class scores, matches and
+    number of positives needed by the AP/AR computation are kept. This allows evaluating while
+    the detections are being produced, without holding all bounding boxes in memory.
+
+    When the images are added in the order in which they appear in a detection list whose boxes
+    are grouped by image, `summarize` returns exactly the same values as get_coco_summary on that
+    list. In any other order, results may only differ by floating point rounding or by the order
+    of detections with tied scores.
+    """
+    # number of arrays of a class kept before concatenating them
+    _COMPACT_EVERY = 256
+
+    def __init__(self):
+        self._accumulations = {}
+        self._image_ids = set()
+        # classes in the order get_coco_summary sees them: first those with detections
+        self._det_classes = {}
+        self._gt_classes = {}
+
+    def __len__(self):
+        """ Number of images added so far """
+        return len(self._image_ids)
+
+    def add_image(self, image_id, gts, dets):
+        """ Match the detections of an image to its ground truths and accumulate the results.
+
+        Parameters
+            ----------
+                image_id : hashable
+                    Identifier of the image. Each image can only be added once.
+                gts : list or BoundingBoxSet
+                    Ground-truth bounding boxes of the image.
+                dets : list or BoundingBoxSet
+                    Detected bounding boxes of the image.
+        """
+        if image_id in self._image_ids:
+            raise ValueError(f'Image {image_id} was already added.')
+        self._image_ids.add(image_id)
+        self._add(_group_detections(dets, gts))
+
+    def _add(self, bbs, workers=None, executor=None):
+        """ evaluate and accumulate image X class pairs grouped by _group_detections """
+        for (img_id, class_id), v in bbs.items():
+            if len(v["dt"]) > 0:
+                self._det_classes.setdefault(class_id)
+            else:
+                self._gt_classes.setdefault(class_id)
+        _evals = _evaluate_images(bbs,
+                                  _IOU_THRESHOLDS,
+                                  max(_MAX_DETS),
+                                  _AREA_RANGES,
+                                  workers=workers,
+                                  executor=executor)
+        _append_evaluations(self._accumulations, _evals)
+        self._compact()
+
+    def _compact(self):
+        """ keep a bounded number of small arrays per class """
+        for class_id, acc in self._accumulations.items():
+            if len(acc["scores"]) >= self._COMPACT_EVERY:
+                reduced = _reduce_accumulation(acc)
+                for k in ("scores", "rank", "matched", "ignore"):
+                    acc[k] = [reduced[k]]
+
+    def get_state(self):
+        """ Get the partial state of the images added so far, to be merged with the states of
+        other images (see merge_state and merge_coco_states).
+
+        The state only contains plain lists and numpy arrays, so it can be pickled and sent to the
+        machine computing the final metrics instead of the bounding boxes.
+
+        Returns:
+                A dictionary with the ids of the images, the classes in order of appearance and,
+                for each class, the sorted scores, matches, ignore flags and number of positives.
+        """
+        return {
+            "images": list(self._image_ids),
+            "det_classes": list(self._det_classes),
+            "gt_classes": list(self._gt_classes),
+            "accumulations": {
+                class_id: _reduce_accumulation(acc)
+                for class_id, acc in self._accumulations.items()
+            }
+        }
+
+    def merge_state(self, state):
+        """ Merge the state of other images (see get_state) into this accumulator.
+
+        States merged in the order in which their images appear in the full detection list give
+        exactly the same metrics as evaluating all bounding boxes at once.
+
+        Parameters
+            ----------
+                state : dict
+                    State obtained with get_state or get_coco_state. Its images must not have
+                    been added to this accumulator.
+        """
+        if not self._image_ids.isdisjoint(state["images"]):
+            raise ValueError('States must be obtained from disjoint sets of images.')
+        self._image_ids.update(state["images"])
+        self._det_classes.update(dict.fromkeys(state["det_classes"]))
+        self._gt_classes.update(dict.fromkeys(state["gt_classes"]))
+        for class_id, other in state["accumulations"].items():
+            acc = self._accumulations.setdefault(class_id, {
+                "scores": [],
+                "rank": [],
+                "matched": [],
+                "ignore": [],
+                "NP": 0
+            })
+            for k in ("scores", "rank", "matched", "ignore"):
+                acc[k].append(other[k])
+            acc["NP"] = acc["NP"] + other["NP"]
+        self._compact()
+
+    def summarize(self):
+        """ Calculate the 12 standard metrics used in COCOEval with the images added so far.
+
+        Returns:
+                A dictionary with one entry for each metric (see get_coco_summary).
+        """
+        classes = list(self._det_classes)
+        classes += [c for c in self._gt_classes if c not in self._det_classes]
+        return _summarize(
+            {class_id: _reduce_accumulation(self._accumulations[class_id])
+             for class_id in classes})
+
+
+def get_coco_state(groundtruth_bbs, detected_bbs, workers=None, executor=None):
+    """ Evaluate the bounding boxes of a set of images and get the partial state used to compute
+        the COCO metrics together with the states of other images (see merge_coco_states).
+
+    Parameters
+        ----------
+            groundtruth_bbs : list or BoundingBoxSet
+                A list containing objects of type BoundingBox (or a BoundingBoxSet) representing
+                the ground-truth bounding boxes.
+            detected_bbs : list or BoundingBoxSet
+                A list containing objects of type BoundingBox (or a BoundingBoxSet) representing
+                the detected bounding boxes.
+            workers : int (optional)
+                Number of processes used to evaluate the image X class pairs.
+            executor : concurrent.futures.Executor (optional)
+                Executor used to evaluate the image X class pairs.
+    Returns:
+            A picklable dictionary (see CocoAccumulator.get_state).
+    """
+    _bbs = _group_detections(detected_bbs, groundtruth_bbs)
+    accumulator = CocoAccumulator()
+    accumulator._image_ids.update(img_id for img_id, _ in _bbs)
+    accumulator._add(_bbs, workers=workers, executor=executor)
+    return accumulator.get_state()
+
+
+def merge_coco_states(states):
+    """ Calculate the 12 standard metrics used in COCOEval from the states of disjoint sets of
+        images (see get_coco_state and CocoAccumulator.get_state).
+
+        The results are exactly the same as get_coco_summary on all bounding boxes when the
+        states are given in the order in which their images appear in the detection list.
+
+    Parameters
+        ----------
+            states : list
+                States of disjoint sets of images.
+    Returns:
+            A dictionary with one entry for each metric (see get_coco_summary).
+    """
+    accumulator = CocoAccumulator()
+    for state in states:
+        accumulator.merge_state(state)
+    return accumulator.summarize()
+
+
 def _group_detections(dt, gt):
     """ simply group gts and dts on a imageXclass basis """
-    bb_info = defaultdict(lambda: {"dt": [], "gt": []})
-    for d in dt:
-        i_id = d.get_image_name()
-        c_id = d.get_class_id()
-        bb_info[i_id, c_id]["dt"].append(d)
-    for g in gt:
-        i_id = g.get_image_name()
-        c_id = g.get_class_id()
-        bb_info[i_id, c_id]["gt"].append(g)
+    dt = as_bounding_box_set(dt)
+    gt = as_bounding_box_set(gt)
+    bb_info = defaultdict(lambda: {
+        "dt": BoundingBoxSet.empty(BBType.DETECTED),
+        "gt": BoundingBoxSet.empty()
+    })
+    for key, idx in dt.group_by_image_and_class().items():
+        bb_info[key]["dt"] = dt[idx]
+    for key, idx in gt.group_by_image_and_class().items():
+        bb_info[key]["gt"] = gt[idx]
     return bb_info
 
 
-def _get_area(a):
+def _get_areas(boxes):
     """ COCO does not consider the outer edge as included in the bbox """
-    x, y, x2, y2 = a.get_absolute_bounding_box(format=BBFormat.XYX2Y2)
-    return (x2 - x) * (y2 - y)
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
 
 
 def _jaccard(a, b):
-    xa, ya, x2a, y2a = a.get_absolute_bounding_box(format=BBFormat.XYX2Y2)
-    xb, yb, x2b, y2b = b.get_absolute_bounding_box(format=BBFormat.XYX2Y2)
+    xa, ya, x2a, y2a = a
+    xb, yb, x2b, y2b = b
 
     # innermost left x
     xi = max(xa, xb)
@@ -287,76 +435,220 @@ def _jaccard(a, b):
     return Ai / (Aa + Ab - Ai)
 
 
-def _compute_ious(dt, gt):
-    """ compute pairwise ious """
+def pairwise_iou(boxes_a, boxes_b):
+    """ Compute the IOUs between all pairs of boxes of two arrays.
 
-    ious = np.zeros((len(dt), len(gt)))
-    for g_idx, g in enumerate(gt):
-        for d_idx, d in enumerate(dt):
-            ious[d_idx, g_idx] = _jaccard(d, g)
-    return ious
+    The result is bit-identical to applying `_jaccard` to each pair.
 
+    Parameters
+        ----------
+            boxes_a : numpy.ndarray
+                Array (N, 4) of boxes in the (x1, y1, x2, y2) format.
+            boxes_b : numpy.ndarray
+                Array (M, 4) of boxes in the (x1, y1, x2, y2) format.
+    Returns:
+            An array (N, M) where the element (i, j) is the IOU between boxes_a[i] and boxes_b[j].
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)[None, :, :]
 
-def _evaluate_image(dt, gt, ious, iou_threshold, max_dets=None, area_range=None):
-    """ use COCO's method to associate detections to ground truths """
-    # sort dts by increasing confidence
-    dt_sort = np.argsort([-d.get_confidence() for d in dt], kind="stable")
+    # innermost left/top and right/bottom coordinates
+    xy = np.maximum(a[..., :2], b[..., :2])
+    x2y2 = np.minimum(a[..., 2:], b[..., 2:])
 
-    # sort list of dts and chop by max dets
-    dt = [dt[idx] for idx in dt_sort[:max_dets]]
-    ious = ious[dt_sort[:max_dets]]
+    # calculate areas
+    Aa = np.maximum(a[..., 2] - a[..., 0], 0) * np.maximum(a[..., 3] - a[..., 1], 0)
+    Ab = np.maximum(b[..., 2] - b[..., 0], 0) * np.maximum(b[..., 3] - b[..., 1], 0)
+    Ai = np.maximum(x2y2[..., 0] - xy[..., 0], 0) * np.maximum(x2y2[..., 1] - xy[..., 1], 0)
+    return Ai / (Aa + Ab - Ai)
 
-    # generate ignored gt list by area_range
-    def _is_ignore(bb):
-        if area_range is None:
-            return False
-        return not (area_range[0] <= _get_area(bb) <= area_range[1])
 
-    gt_ignore = [_is_ignore(g) for g in gt]
+def _evaluate_images(bbs, iou_thresholds, max_dets, area_ranges, workers=None, executor=None):
+    """ evaluate all image X class pairs (see _evaluate_image), serially or in parallel
 
-    # sort gts by ignore last
-    gt_sort = np.argsort(gt_ignore, kind="stable")
-    gt = [gt[idx] for idx in gt_sort]
-    gt_ignore = [gt_ignore[idx] for idx in gt_sort]
-    ious = ious[:, gt_sort]
+    For the parallel evaluation, the pairs are split into contiguous chunks of plain arrays that
+    are evaluated by the executor. Results are gathered back in the original order of the pairs.
+    """
+    keys = list(bbs)
+    pairs = [(v["dt"].get_boxes(), v["dt"].get_confidences(), v["gt"].get_boxes())
+             for v in bbs.values()]
+
+    if executor is None and (workers is None or workers <= 1):
+        return dict(zip(keys, _evaluate_pairs(pairs, iou_thresholds, max_dets, area_ranges)))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # a few chunks per worker to balance images with many detections
+        n_chunks = 4 * (workers or os.cpu_count() or 1)
+        chunk_size = max(1, int(np.ceil(len(pairs) / n_chunks)))
+        futures = [
+            executor.submit(_evaluate_pairs, pairs[i:i + chunk_size], iou_thresholds, max_dets,
+                            area_ranges) for i in range(0, len(pairs), chunk_size)
+        ]
+        evals = [ev for future in futures for ev in future.result()]
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return dict(zip(keys, evals))
+
+
+def _evaluate_pairs(pairs, iou_thresholds, max_dets, area_ranges):
+    """ compute the ious and evaluate a list of (dt boxes, dt scores, gt boxes) pairs """
+    return [
+        _evaluate_image(dt_boxes, dt_scores, gt_boxes, pairwise_iou(dt_boxes, gt_boxes),
+                        iou_thresholds, max_dets, area_ranges)
+        for dt_boxes, dt_scores, gt_boxes in pairs
+    ]
 
-    gtm = {}
-    dtm = {}
 
-    for d_idx, d in enumerate(dt):
-        # information about best match so far (m=-1 -> unmatched)
-        iou = min(iou_threshold, 1 - 1e-10)
-        m = -1
-        for g_idx, g in enumerate(gt):
-            # if this gt already matched, and not a crowd, continue
-            if g_idx in gtm:
-                continue
-            # if dt matched to reg gt, and on ignore gt, stop
-            if m > -1 and gt_ignore[m] == False and gt_ignore[g_idx] == True:
-                break
-            # continue to next gt unless better match made
-            if ious[d_idx, g_idx] < iou:
+def _evaluate_image(dt_boxes,
+                    dt_scores,
+                    gt_boxes,
+                    ious,
+                    iou_thresholds,
+                    max_dets=None,
+                    area_ranges=None):
+    """ use COCO's method to associate detections to ground truths
+
+    Detections are sorted and chopped by max dets once, and areas are computed once. The matching
+    is then run for every area range and every iou threshold, as pycocotools does for its
+    `evalImgs`. Because the matching is greedy in decreasing confidence, the result for a smaller
+    number of max dets is a prefix of the result computed here.
+
+    Returns a dictionary with:
+        "scores": (D,) scores of the sorted detections;
+        "matched": (A, T, D) whether each detection matched a ground truth;
+        "ignore": (A, T, D) whether each detection must be ignored;
+        "NP": (A,) number of ground truths not ignored;
+    where A is the number of area ranges and T the number of iou thresholds.
+    """
+    iou_thresholds = np.atleast_1d(np.asarray(iou_thresholds, dtype=np.float64))
+    if area_ranges is None:
+        area_ranges = [None]
+
+    # sort dts by decreasing confidence and chop by max dets
+    dt_sort = np.argsort(-dt_scores, kind="stable")[:max_dets]
+    scores = dt_scores[dt_sort]
+    dt_areas = _get_areas(dt_boxes[dt_sort])
+    gt_areas = _get_areas(gt_boxes)
+    ious = ious[dt_sort]
+
+    n_dts = len(dt_sort)
+    matched = np.zeros((len(area_ranges), len(iou_thresholds), n_dts), dtype=bool)
+    ignore = np.zeros((len(area_ranges), len(iou_thresholds), n_dts), dtype=bool)
+    n_gts = np.zeros(len(area_ranges), dtype=np.int64)
+
+    for a_idx, area_range in enumerate(area_ranges):
+        # generate ignored gt list by area_range
+        gt_ignore = _is_ignore(gt_areas, area_range)
+
+        # sort gts by ignore last
+        gt_sort = np.argsort(gt_ignore, kind="stable")
+        gt_ignore = gt_ignore[gt_sort]
+        n_gts[a_idx] = np.count_nonzero(~gt_ignore)
+
+        dtm = _match(ious[:, gt_sort], n_gts[a_idx], iou_thresholds)
+
+        # generate ignore list for dts
+        matched[a_idx] = dtm > -1
+        ignore[a_idx] = _is_ignore(dt_areas, area_range)
+        if len(gt_ignore) > 0:
+            ignore[a_idx] = np.where(matched[a_idx], gt_ignore[dtm], ignore[a_idx])
+
+    return {"scores": scores, "matched": matched, "ignore": ignore, "NP": n_gts}
+
+
+def _is_ignore(areas, area_range):
+    if area_range is None:
+        return np.zeros(len(areas), dtype=bool)
+    return ~((area_range[0] <= areas) & (areas <= area_range[1]))
+
+
+def _match(ious, n_valid_gts, iou_thresholds):
+    """ greedily match sorted detections to gts for all iou thresholds at once
+
+    The gts must be sorted with the ignored ones last, the first `n_valid_gts` being regular.
+    Returns a (T, D) array with the index of the gt matched by each detection (-1 if unmatched).
+    """
+    n_dts, n_gts = ious.shape
+    dtm = np.full((len(iou_thresholds), n_dts), -1, dtype=np.int64)
+    if n_gts == 0:
+        return dtm
+    thresholds = np.minimum(iou_thresholds, 1 - 1e-10)
+    gt_matched = np.zeros((len(iou_thresholds), n_gts), dtype=bool)
+    rows = np.arange(len(iou_thresholds))
+    # detections that do not reach the lowest threshold can never be matched
+    for d_idx in np.flatnonzero(ious.max(axis=1) >= thresholds.min()):
+        # gts already matched can not be matched again (no crowd regions)
+        candidates = np.where(gt_matched, -1, ious[d_idx])
+        m = np.full(len(iou_thresholds), -1, dtype=np.int64)
+        # if dt matched to reg gt, ignored gts are not considered
+        for start, end in ((0, n_valid_gts), (n_valid_gts, n_gts)):
+            if start == end or (m > -1).all():
                 continue
-            # if match successful and best so far, store appropriately
-            iou = ious[d_idx, g_idx]
-            m = g_idx
-        # if match made store id of match for both dt and gt
-        if m == -1:
-            continue
-        dtm[d_idx] = m
-        gtm[m] = d_idx
-
-    # generate ignore list for dts
-    dt_ignore = [
-        gt_ignore[dtm[d_idx]] if d_idx in dtm else _is_ignore(d) for d_idx, d in enumerate(dt)
-    ]
+            # COCO keeps the last gt with the best iou
+            best = end - 1 - np.argmax(candidates[:, start:end][:, ::-1], axis=1)
+            found = (m == -1) & (candidates[rows, best] >= thresholds)
+            m[found] = best[found]
+        found = m > -1
+        gt_matched[rows[found], m[found]] = True
+        dtm[:, d_idx] = m
+    return dtm
+
+
+def _accumulate(evals):
+    """ accumulate the per image X class evaluations (see _evaluate_image) on a per-class basis
+
+    Returns a dictionary whose keys are the classes and values are dictionaries with:
+        "scores": (N,) concatenated scores;
+        "rank": (N,) position of each detection in the sorted detections of its image;
+        "matched": (A, T, N) concatenated matches;
+        "ignore": (A, T, N) concatenated ignore flags;
+        "NP": (A,) total number of ground truths not ignored.
+    """
+    _evals = {}
+    _append_evaluations(_evals, evals)
+    # now reduce accumulations
+    return {class_id: _reduce_accumulation(acc) for class_id, acc in _evals.items()}
+
+
+def _append_evaluations(accumulations, evals):
+    """ append per image X class evaluations to per-class lists of arrays """
+    for (img_id, class_id), ev in evals.items():
+        acc = accumulations.setdefault(class_id, {
+            "scores": [],
+            "rank": [],
+            "matched": [],
+            "ignore": [],
+            "NP": 0
+        })
+        acc["scores"].append(ev["scores"])
+        acc["rank"].append(np.arange(len(ev["scores"])))
+        acc["matched"].append(ev["matched"])
+        acc["ignore"].append(ev["ignore"])
+        acc["NP"] = acc["NP"] + ev["NP"]
+
+
+def _reduce_accumulation(acc):
+    """ concatenate the lists of arrays of a per-class accumulation """
+    return {
+        "scores": np.concatenate(acc["scores"]),
+        "rank": np.concatenate(acc["rank"]),
+        "matched": np.concatenate(acc["matched"], axis=-1),
+        "ignore": np.concatenate(acc["ignore"], axis=-1),
+        "NP": acc["NP"]
+    }
 
-    # get score for non-ignored dts
-    scores = [dt[d_idx].get_confidence() for d_idx in range(len(dt)) if not dt_ignore[d_idx]]
-    matched = [d_idx in dtm for d_idx in range(len(dt)) if not dt_ignore[d_idx]]
 
-    n_gts = len([g_idx for g_idx in range(len(gt)) if not gt_ignore[g_idx]])
-    return {"scores": scores, "matched": matched, "NP": n_gts}
+def _compute_accumulated_ap_recall(acc, area_idx, t_idx, max_dets=None):
+    """ run _compute_ap_recall for an area range, iou threshold and max dets of an accumulation """
+    keep = ~acc["ignore"][area_idx, t_idx]
+    if max_dets is not None:
+        keep &= acc["rank"] < max_dets
+    return _compute_ap_recall(acc["scores"][keep], acc["matched"][area_idx, t_idx, keep],
+                              acc["NP"][area_idx])
 
 
 def _compute_ap_recall(scores, matched, NP, recall_thresholds=None):
@@ -1,59 +1,39 @@
 import os
 import sys
-from collections import Counter
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from src.bounding_box import BoundingBox
+from src.bounding_box_set import as_bounding_box_set
 from src.utils.enumerators import (BBFormat, CoordinatesType,
                                    MethodAveragePrecision)
 
 
 def calculate_ap_every_point(rec, prec):
-    mrec = []
-    mrec.append(0)
-    [mrec.append(e) for e in rec]
-    mrec.append(1)
-    mpre = []
-    mpre.append(0)
-    [mpre.append(e) for e in prec]
-    mpre.append(0)
-    for i in range(len(mpre) - 1, 0, -1):
-        mpre[i - 1] = max(mpre[i - 1], mpre[i])
-    ii = []
-    for i in range(len(mrec) - 1):
-        if mrec[1:][i] != mrec[0:-1][i]:
-            ii.append(i + 1)
-    ap = 0
-    for i in ii:
-        ap = ap + np.sum((mrec[i] - mrec[i - 1]) * mpre[i])
-    return [ap, mpre[0:len(mpre) - 1], mrec[0:len(mpre) - 1], ii]
+    mrec = np.concatenate([[0], np.asarray(rec, dtype=np.float64), [1]])
+    mpre = np.concatenate([[0], np.asarray(prec, dtype=np.float64), [0]])
+    # make the precision monotonically decreasing
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    # indices where the recall changes
+    ii = np.flatnonzero(mrec[1:] != mrec[:-1]) + 1
+    # sum the areas of the rectangles in order, as a running sum does
+    areas = np.cumsum((mrec[ii] - mrec[ii - 1]) * mpre[ii])
+    ap = areas[-1] if len(areas) > 0 else 0
+    return [ap, mpre[:-1].tolist(), mrec[:-1].tolist(), ii.tolist()]
 
 
 def calculate_ap_11_point_interp(rec, prec, recall_vals=11):
-    mrec = []
-    # mrec.append(0)
-    [mrec.append(e) for e in rec]
-    # mrec.append(1)
-    mpre = []
-    # mpre.append(0)
-    [mpre.append(e) for e in prec]
-    # mpre.append(0)
+    mrec = np.asarray(rec, dtype=np.float64)
+    mpre = np.asarray(prec, dtype=np.float64)
     recallValues = np.linspace(0, 1, recall_vals)
     recallValues = list(recallValues[::-1])
-    rhoInterp = []
-    recallValid = []
-    # For each recallValues (0, 0.1, 0.2, ... , 1)
-    for r in recallValues:
-        # Obtain all recall values higher or equal than r
-        argGreaterRecalls = np.argwhere(mrec[:] >= r)
-        pmax = 0
-        # If there are recalls above r
-        if argGreaterRecalls.size != 0:
-            pmax = max(mpre[argGreaterRecalls.min():])
-        recallValid.append(r)
-        rhoInterp.append(pmax)
+    # maximum precision from each point to the end of the curve
+    max_pre = np.maximum.accumulate(mpre[::-1])[::-1]
+    # first point whose recall is higher or equal than each recall value (0, 0.1, 0.2, ... , 1)
+    arg_greater_recalls = np.searchsorted(np.maximum.accumulate(mrec), recallValues, side='left')
+    rhoInterp = [max_pre[i] if i < len(max_pre) else 0 for i in arg_greater_recalls]
+    recallValid = recallValues
     # By definition AP = sum(max(precision whose recall is above r))/11
     ap = sum(rhoInterp) / len(recallValues)
     # Generating values for the plot
@@ -79,18 +59,145 @@ def calculate_ap_11_point_interp(rec, prec, recall_vals=11):
     return [ap, rhoInterp, recallValues, None]
 
 
+def _pairwise_iou(boxes_a, boxes_b):
+    """ IOUs between all pairs of (x1, y1, x2, y2) boxes of two arrays, as computed by
+    BoundingBox.iou (the outer edge is included in the areas) """
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    # if boxes do not intersect
+    intersect = ~((a[..., 0] > b[..., 2]) | (b[..., 0] > a[..., 2]) | (a[..., 3] < b[..., 1]) |
+                  (a[..., 1] > b[..., 3]))
+    inter_area = (np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]) + 1) * (
+        np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]) + 1)
+    area_a = (a[..., 2] - a[..., 0] + 1) * (a[..., 3] - a[..., 1] + 1)
+    area_b = (b[..., 2] - b[..., 0] + 1) * (b[..., 3] - b[..., 1] + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(intersect, inter_area / (area_a + area_b - inter_area), 0)
+
+
+def _match_image(ious, iou_thresholds):
+    """ Assign the detections of a class in an image, sorted by decreasing confidence, as TP or FP
+    for each IOU threshold.
+
+    Each detection is compared with the ground truth with which it has the highest IOU. It is a
+    TP if that IOU reaches the threshold and no previous detection was already assigned to that
+    ground truth. Returns an array (T, D) with 1 for the TP detections and 0 for the FP ones.
+    """
+    TP = np.zeros((len(iou_thresholds), len(ious)))
+    # first ground truth with the highest iou, the same for all thresholds
+    best = np.argmax(ious, axis=1)
+    iou_max = ious[np.arange(len(ious)), best]
+    for t_idx, iou_threshold in enumerate(iou_thresholds):
+        candidates = np.flatnonzero((iou_max > sys.float_info.min) & (iou_max >= iou_threshold))
+        # only the first detection assigned to a ground truth matches it
+        _, first = np.unique(best[candidates], return_index=True)
+        TP[t_idx, candidates[first]] = 1
+    return TP
+
+
+class DetectionTable:
+    """ Evaluation of each detection of a class, sorted by decreasing confidence.
+
+    Only the arrays computed by the evaluation are kept. The rows are converted into a DataFrame
+    when they are accessed, either all at once (to_dataframe), in pages (iter_pages), or
+    streamed to a file (to_csv, to_parquet).
+    """
+    columns = ['image', 'confidence', 'TP', 'FP', 'acc TP', 'acc FP', 'precision', 'recall']
+
+    def __init__(self, images, confidences, TP, FP, acc_TP, acc_FP, precision, recall):
+        """ Constructor.
+
+        Args:
+            images: array with the image name of each detection;
+            confidences: array with the confidence of each detection;
+            TP, FP: arrays with 1 for the True Positive (False Positive) detections, 0 otherwise;
+            acc_TP, acc_FP: accumulated TP and FP;
+            precision, recall: precision and recall at each detection.
+        """
+        self._arrays = [images, confidences, TP, FP, acc_TP, acc_FP, precision, recall]
+
+    def __len__(self):
+        return len(self._arrays[0])
+
+    def __repr__(self):
+        return f'<DetectionTable: {len(self)} detections>'
+
+    def to_dataframe(self, start=0, stop=None):
+        """ Get the rows [start, stop) of the table.
+
+        Returns:
+            A DataFrame with the image names, the confidences (between 0 and 1), the TP and FP
+            flags and accumulated counts as integers, and the precision and recall values.
+        """
+        images, confidences, TP, FP, acc_TP, acc_FP, precision, recall = [
+            a[start:stop] for a in self._arrays
+        ]
+        return pd.DataFrame({
+            'image': pd.Series(images, dtype=object),
+            'confidence': confidences.astype(np.float64),
+            'TP': TP.astype(np.int64),
+            'FP': FP.astype(np.int64),
+            'acc TP': acc_TP.astype(np.int64),
+            'acc FP': acc_FP.astype(np.int64),
+            'precision': precision.astype(np.float64),
+            'recall': recall.astype(np.float64)
+        }, columns=self.columns)
+
+    def iter_pages(self, page_size=100000):
+        """ Iterate over the table in DataFrames of at most `page_size` rows. An empty table
+        yields a single empty DataFrame. """
+        for start in range(0, max(len(self), 1), page_size):
+            yield self.to_dataframe(start, start + page_size)
+
+    def to_csv(self, path, page_size=100000, **kwargs):
+        """ Write the table to a csv file, one page at a time. Extra arguments are passed to
+        DataFrame.to_csv. """
+        kwargs.setdefault('index', False)
+        with open(path, 'w', newline='') as f:
+            for i, page in enumerate(self.iter_pages(page_size)):
+                page.to_csv(f, header=(i == 0), **kwargs)
+
+    def to_parquet(self, path, page_size=100000):
+        """ Write the table to a parquet file, one page at a time (requires pyarrow). """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for page in self.iter_pages(page_size):
+                table = pa.Table.from_pandas(page, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
 def get_pascalvoc_metrics(gt_boxes,
                           det_boxes,
                           iou_threshold=0.5,
                           method=MethodAveragePrecision.EVERY_POINT_INTERPOLATION,
-                          generate_table=False):
+                          generate_table=False,
+                          generate_detection_table=False):
     """Get the metrics used by the VOC Pascal 2012 challenge.
     Args:
-        boundingboxes: Object of the class BoundingBoxes representing ground truth and detected
+        gt_boxes: List of BoundingBox objects (or a BoundingBoxSet) representing the ground truth
+        bounding boxes;
+        det_boxes: List of BoundingBox objects (or a BoundingBoxSet) representing the detected
         bounding boxes;
         iou_threshold: IOU threshold indicating which detections will be considered TP or FP
-        (dget_pascalvoc_metricsns:
-        A dictioanry contains information and metrics of each class.
+        (default value = 0.5). A sequence of thresholds can be given to evaluate all of them
+        with a single matching of the detections;
+        method: MethodAveragePrecision used to compute the average precision;
+        generate_table: whether the table with the detections of each class is generated, as a
+        pandas DataFrame;
+        generate_detection_table: whether the detections of each class are kept in a
+        DetectionTable, which builds its rows only when they are accessed (e.g. in pages or
+        streamed to a file).
+    Returns:
+        A dictionary with the metrics of each class ('per_class') and the mAP ('mAP'). If
+        iou_threshold is a sequence, a dictionary with the results of each threshold.
+        The per class results are a dictioanry contains information and metrics of each class.
         The key represents the class and the values are:
         dict['class']: class representing the current dictionary;
         dict['precision']: array with the precision values;
@@ -100,111 +207,180 @@ def get_pascalvoc_metrics(gt_boxes,
         dict['interpolated recall']: interpolated recall values;
         dict['total positives']: total number of ground truth positives;
         dict['total TP']: total number of True Positive detections;
-        dict['total FP']: total number of False Positive detections;"""
-    ret = {}
-    # Get classes of all bounding boxes separating them by classes
-    gt_classes_only = []
-    classes_bbs = {}
-    for bb in gt_boxes:
-        c = bb.get_class_id()
-        gt_classes_only.append(c)
-        classes_bbs.setdefault(c, {'gt': [], 'det': []})
-        classes_bbs[c]['gt'].append(bb)
-    gt_classes_only = list(set(gt_classes_only))
-    for bb in det_boxes:
-        c = bb.get_class_id()
-        classes_bbs.setdefault(c, {'gt': [], 'det': []})
-        classes_bbs[c]['det'].append(bb)
-
-    # Precision x Recall is obtained individually by each class
-    for c, v in classes_bbs.items():
-        # Report results only in the classes that are in the GT
-        if c not in gt_classes_only:
+        dict['total FP']: total number of False Positive detections;
+        dict['table']: DataFrame with the detections if generate_table is True (confidences
+        as percentage strings), None otherwise;
+        dict['detection table']: DetectionTable with the detections if generate_detection_table
+        is True (confidences as floats), None otherwise;"""
+    state = get_pascalvoc_state(gt_boxes, det_boxes, iou_threshold)
+    tables = dict(generate_table=generate_table,
+                  generate_detection_table=generate_detection_table)
+    if np.isscalar(iou_threshold):
+        return merge_pascalvoc_states([state], method=method, **tables)
+    return {
+        iou: merge_pascalvoc_states([s], method=method, **tables)
+        for iou, s in state.items()
+    }
+
+
+def get_pascalvoc_state(gt_boxes, det_boxes, iou_threshold=0.5):
+    """Match the detections to the ground truths and get the per-class state needed to compute
+    the VOC Pascal metrics (see merge_pascalvoc_states).
+
+    The state only contains plain lists and numpy arrays, so it can be pickled and sent to the
+    machine computing the final metrics instead of the bounding boxes.
+    Args:
+        gt_boxes: List of BoundingBox objects (or a BoundingBoxSet) representing the ground truth
+        bounding boxes;
+        det_boxes: List of BoundingBox objects (or a BoundingBoxSet) representing the detected
+        bounding boxes;
+        iou_threshold: IOU threshold indicating which detections will be considered TP or FP,
+        or a sequence of thresholds.
+    Returns:
+        A dictionary with the following keys. If iou_threshold is a sequence, a dictionary with
+        the state of each threshold:
+        dict['iou']: the IOU threshold;
+        dict['images']: names of the images with ground truths or detections;
+        dict['gt classes']: classes of the ground truths, in order of appearance;
+        dict['per_class']: for each class of the ground truths or detections, a dictionary with
+        the 'confidence', 'image', 'TP' and 'FP' arrays of the detections sorted by decreasing
+        confidence and the number of ground truth positives ('total positives')."""
+    gt_boxes = as_bounding_box_set(gt_boxes)
+    det_boxes = as_bounding_box_set(det_boxes)
+    # Get classes of all bounding boxes, those of the gt first
+    gt_classes_only = gt_boxes.unique_classes()
+    classes = list(dict.fromkeys(gt_classes_only + det_boxes.unique_classes()))
+
+    # Index the ground truths by image and class once, and match the detections of each
+    # image X class pair independently, as the gts of other images can not be matched
+    gt_index = gt_boxes.group_by_image_and_class()
+    gt_coords = gt_boxes.get_boxes()
+    det_coords = det_boxes.get_boxes()
+    det_confidences = det_boxes.get_confidences()
+    iou_thresholds = [iou_threshold] if np.isscalar(iou_threshold) else list(iou_threshold)
+    det_TP = np.zeros((len(iou_thresholds), len(det_boxes)))
+    for key, idx in det_boxes.group_by_image_and_class().items():
+        gt_idx = gt_index.get(key)
+        if gt_idx is None:
             continue
-        npos = len(v['gt'])
         # sort detections by decreasing confidence
-        dects = [a for a in sorted(v['det'], key=lambda bb: bb.get_confidence(), reverse=True)]
-        TP = np.zeros(len(dects))
-        FP = np.zeros(len(dects))
-        # create dictionary with amount of expected detections for each image
-        detected_gt_per_image = Counter([bb.get_image_name() for bb in gt_boxes])
-        for key, val in detected_gt_per_image.items():
-            detected_gt_per_image[key] = np.zeros(val)
-        # print(f'Evaluating class: {c}')
-        dict_table = {
-            'image': [],
-            'confidence': [],
-            'TP': [],
-            'FP': [],
-            'acc TP': [],
-            'acc FP': [],
-            'precision': [],
-            'recall': []
+        idx = idx[np.argsort(-det_confidences[idx], kind='stable')]
+        det_TP[:, idx] = _match_image(_pairwise_iou(det_coords[idx], gt_coords[gt_idx]),
+                                      iou_thresholds)
+
+    # sort detections by class and decreasing confidence
+    det_class_indices = det_boxes.get_class_indices()
+    det_order = np.lexsort((-det_confidences, det_class_indices))
+    det_sorted_classes = det_class_indices[det_order]
+    det_images = np.asarray(det_boxes.get_image_names(), dtype=object)
+    npos = dict(zip(gt_boxes.get_classes(), np.bincount(gt_boxes.get_class_indices(),
+                                                        minlength=len(gt_boxes.get_classes()))))
+
+    class_indices = {}
+    for c in classes:
+        class_idx = det_boxes.get_class_index(c)
+        if class_idx is None:
+            class_indices[c] = det_order[:0]
+        else:
+            class_indices[c] = det_order[
+                np.searchsorted(det_sorted_classes, class_idx, side='left'):
+                np.searchsorted(det_sorted_classes, class_idx, side='right')]
+    images = list(dict.fromkeys(list(gt_boxes.get_image_names()) + list(det_images)))
+
+    states = {}
+    for t_idx, iou in enumerate(iou_thresholds):
+        per_class = {}
+        for c, idx in class_indices.items():
+            TP = det_TP[t_idx, idx]
+            per_class[c] = {
+                'confidence': det_confidences[idx],
+                'image': det_images[idx],
+                'TP': TP,
+                'FP': 1 - TP,
+                'total positives': int(npos.get(c, 0))
+            }
+        states[iou] = {
+            'iou': iou,
+            'images': images,
+            'gt classes': gt_classes_only,
+            'per_class': per_class
         }
-        # Loop through detections
-        for idx_det, det in enumerate(dects):
-            img_det = det.get_image_name()
-
-            if generate_table:
-                dict_table['image'].append(img_det)
-                dict_table['confidence'].append(f'{100*det.get_confidence():.2f}%')
-
-            # Find ground truth image
-            gt = [gt for gt in classes_bbs[c]['gt'] if gt.get_image_name() == img_det]
-            # Get the maximum iou among all detectins in the image
-            iouMax = sys.float_info.min
-            # Given the detection det, find ground-truth with the highest iou
-            for j, g in enumerate(gt):
-                # print('Ground truth gt => %s' %
-                #       str(g.get_absolute_bounding_box(format=BBFormat.XYX2Y2)))
-                iou = BoundingBox.iou(det, g)
-                if iou > iouMax:
-                    iouMax = iou
-                    id_match_gt = j
-            # Assign detection as TP or FP
-            if iouMax >= iou_threshold:
-                # gt was not matched with any detection
-                if detected_gt_per_image[img_det][id_match_gt] == 0:
-                    TP[idx_det] = 1  # detection is set as true positive
-                    detected_gt_per_image[img_det][
-                        id_match_gt] = 1  # set flag to identify gt as already 'matched'
-                    # print("TP")
-                    if generate_table:
-                        dict_table['TP'].append(1)
-                        dict_table['FP'].append(0)
-                else:
-                    FP[idx_det] = 1  # detection is set as false positive
-                    if generate_table:
-                        dict_table['FP'].append(1)
-                        dict_table['TP'].append(0)
-                    # print("FP")
-            # - A detected "cat" is overlaped with a GT "cat" with IOU >= iou_threshold.
-            else:
-                FP[idx_det] = 1  # detection is set as false positive
-                if generate_table:
-                    dict_table['FP'].append(1)
-                    dict_table['TP'].append(0)
-                # print("FP")
+    return states[iou_threshold] if np.isscalar(iou_threshold) else states
+
+
+def merge_pascalvoc_states(states,
+                           method=MethodAveragePrecision.EVERY_POINT_INTERPOLATION,
+                           generate_table=False,
+                           generate_detection_table=False):
+    """Get the metrics used by the VOC Pascal 2012 challenge from the states of disjoint sets of
+    images (see get_pascalvoc_state), as if all bounding boxes had been evaluated at once.
+
+    The detections of all states are sorted again by decreasing confidence. The metrics are
+    exactly the same as those of get_pascalvoc_metrics when the states are given in the order in
+    which their images appear in the full lists of bounding boxes.
+    Args:
+        states: List of states obtained with get_pascalvoc_state using the same IOU threshold.
+        Each image must be in a single state;
+        method: MethodAveragePrecision used to compute the average precision;
+        generate_table: whether the table with the detections of each class is generated;
+        generate_detection_table: whether the DetectionTable of each class is generated.
+    Returns:
+        The same dictionary returned by get_pascalvoc_metrics."""
+    if len(states) == 0:
+        raise ValueError('At least one state is required.')
+    iou_threshold = states[0]['iou']
+    images = set()
+    gt_classes_only = {}
+    per_class = {}
+    for state in states:
+        if state['iou'] != iou_threshold:
+            raise ValueError('All states must be obtained with the same IOU threshold.')
+        if not images.isdisjoint(state['images']):
+            raise ValueError('States must be obtained from disjoint sets of images.')
+        images.update(state['images'])
+        gt_classes_only.update(dict.fromkeys(state['gt classes']))
+        for c, v in state['per_class'].items():
+            per_class.setdefault(c, []).append(v)
+
+    ret = {}
+    for c in gt_classes_only:
+        parts = per_class[c]
+        npos = sum(v['total positives'] for v in parts)
+        # sort detections of all states by decreasing confidence
+        confidences = np.concatenate([v['confidence'] for v in parts])
+        order = np.argsort(-confidences, kind='stable')
+        confidences = confidences[order]
+        TP = np.concatenate([v['TP'] for v in parts])[order]
+        FP = np.concatenate([v['FP'] for v in parts])[order]
         # compute precision, recall and average precision
         acc_FP = np.cumsum(FP)
         acc_TP = np.cumsum(TP)
         rec = acc_TP / npos
         prec = np.divide(acc_TP, (acc_FP + acc_TP))
+        table, detection_table = None, None
+        if generate_table or generate_detection_table:
+            det_images = np.concatenate([v['image'] for v in parts])[order]
         if generate_table:
-            dict_table['acc TP'] = list(acc_TP)
-            dict_table['acc FP'] = list(acc_FP)
-            dict_table['precision'] = list(prec)
-            dict_table['recall'] = list(rec)
-            table = pd.DataFrame(dict_table)
-        else:
-            table = None
+            table = pd.DataFrame({
+                'image': list(det_images),
+                'confidence': [f'{100*conf:.2f}%' for conf in confidences],
+                'TP': TP.astype(int).tolist(),
+                'FP': FP.astype(int).tolist(),
+                'acc TP': list(acc_TP),
+                'acc FP': list(acc_FP),
+                'precision': list(prec),
+                'recall': list(rec)
+            })
+        if generate_detection_table:
+            detection_table = DetectionTable(det_images, confidences, TP, FP, acc_TP, acc_FP, prec,
+                                             rec)
         # Depending on the method, call the right implementation
         if method == MethodAveragePrecision.EVERY_POINT_INTERPOLATION:
             [ap, mpre, mrec, ii] = calculate_ap_every_point(rec, prec)
         elif method == MethodAveragePrecision.ELEVEN_POINT_INTERPOLATION:
             [ap, mpre, mrec, _] = calculate_ap_11_point_interp(rec, prec)
         else:
-            Exception('method not defined')
+            raise ValueError(f'Invalid interpolation method: {method}')
         # add class result in the dictionary to be returned
         ret[c] = {
             'precision': prec,
@@ -217,7 +393,8 @@ def get_pascalvoc_metrics(gt_boxes,
             'total FP': np.sum(FP),
             'method': method,
             'iou': iou_threshold,
-            'table': table
+            'table': table,
+            'detection table': detection_table
         }
     # For mAP, only the classes in the gt set should be considered
     mAP = sum([v['AP'] for k, v in ret.items() if k in gt_classes_only]) / len(gt_classes_only)
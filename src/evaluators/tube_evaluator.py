@@ -1,9 +1,12 @@
+import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
 from src.evaluators.pascal_voc_evaluator import (calculate_ap_11_point_interp,
                                                  calculate_ap_every_point)
-from src.tube import Tube
+from src.tube import DenseTubes, Tube
 from src.utils.enumerators import MethodAveragePrecision
 from src.utils.read_files import File
 
@@ -14,13 +17,19 @@ class TubeEvaluator():
     def __init__(self,
                  anno_filepath,
                  preds_filepath,
-                 method=MethodAveragePrecision.EVERY_POINT_INTERPOLATION):
+                 method=MethodAveragePrecision.EVERY_POINT_INTERPOLATION,
+                 workers=None,
+                 executor=None):
         """Class constructor
 
         Args:
             anno_filepath (str): annotation filepath
             preds_filepath (str): prediction filepath in json extension
             method (MethodAveragePrecision, optional): Recall interpolation method (see src.utils.enumerators). Defaults to MethodAveragePrecision.EVERY_POINT_INTERPOLATION.
+            workers (int, optional): number of processes matching the tubes of different videos
+                in parallel. Defaults to None (serial).
+            executor (Executor, optional): executor (Ex: a ProcessPoolExecutor) used instead of
+                creating a pool of `workers` processes. Defaults to None.
         """
 
         if not anno_filepath.endswith('.json'):
@@ -31,6 +40,8 @@ class TubeEvaluator():
         self._anno_filepath = anno_filepath
         self._preds_filepath = preds_filepath
         self._method = method
+        self._workers = workers
+        self._executor = executor
 
     def __reset(self):
         """reset object
@@ -42,11 +53,24 @@ class TubeEvaluator():
         self.nb_fn = 0
         self.nb_tn = -1
         self._res = dict()
+        # STT-IOU matrices of each class and video, computed once for all thresholds
+        self._ious = dict()
+        self._matches = dict()
         # self._video_id = 0
 
+    def __files_signature(self) -> tuple:
+        """modification time and size of the annotation and prediction files
+        """
+        stats = [os.stat(f) for f in (self._anno_filepath, self._preds_filepath)]
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
     def __process(self):
-        """process the files and prepare to evaluate
+        """process the files and prepare to evaluate. The files are read only once, unless they
+        are modified between evaluations.
         """
+        signature = self.__files_signature()
+        if getattr(self, '_signature', None) == signature:
+            return
         self.__reset()
 
         annot_data = File(self._anno_filepath).read()
@@ -60,45 +84,151 @@ class TubeEvaluator():
         self._videos = annot_data['videos']
         self._classes = annot_data['categories']
 
+        # group the tubes by class and video once (Ex: {0: {1: [Tube(...), Tube(...)]}})
+        self._gt_groups = self._group_tubes(self._gt)
+        # predictions are sorted by decreasing confidence, within each class and video
+        preds = sorted(self._predictions, key=lambda tube: tube.confidence, reverse=True)
+        self._pred_groups = self._group_tubes(preds)
+        self._preds_per_class = {}
+        for pred in preds:
+            self._preds_per_class.setdefault(pred.category_id, []).append(pred)
+        # index of each prediction of a video in the sorted predictions of its class
+        self._pred_indices = {}
+        for category_id, preds_cls in self._preds_per_class.items():
+            for index, pred in enumerate(preds_cls):
+                self._pred_indices.setdefault(category_id, {}).setdefault(pred.video_id,
+                                                                          []).append(index)
+        self._signature = signature
+
+    def _group_tubes(self, tubes: list) -> dict:
+        """Group tubes by class and video, keeping their order.
+
+        Args:
+            tubes (list): list of Tube objects
+
+        Returns:
+            dict: dictionary {category_id: {video_id: list of tubes}}
+        """
+        groups = {}
+        for tube in tubes:
+            groups.setdefault(tube.category_id, {}).setdefault(tube.video_id, []).append(tube)
+        return groups
+
     def evaluate(self, thr=0.5):
-        """Evaluate the predictions according to the chosen IOU threshold
+        """Evaluate the predictions according to the chosen IOU threshold(s)
+
+        The files are read and the STT-IOUs are computed at the first evaluation, and reused by
+        the following ones (e.g. with other thresholds).
 
         Args:
-            thr (float, optional): IOU threshold 0 < thr < 1. Defaults to 0.5.
+            thr (float or list, optional): IOU threshold 0 < thr <= 1, or a list of thresholds
+                (Ex: np.linspace(0.5, 0.95, 10) for mAP@[.5:.95]). Defaults to 0.5.
 
         Returns:
-            res, mAP: return a dictionary (res) with results per class. Also, returns the mAP.
+            res, mAP: for a single threshold, return a dictionary (res) with results per class and
+                the mAP. For a list of thresholds, return a dictionary (res) with the results
+                (res, mAP) of each threshold and the mAP averaged over the thresholds.
         """
-        if not 0 < thr <= 1:
-            raise ValueError("IOU threshold must be 0 < thr <= 1: ", thr)
+        thrs = np.atleast_1d(thr)
+        for t in thrs:
+            if not 0 < t <= 1:
+                raise ValueError("IOU threshold must be 0 < thr <= 1: ", t)
 
         self.__process()
+        matches = self._match_videos(thrs.tolist())
+        # TP and FN flags of the tubes of each class and video, for each threshold
+        self._matches = dict(zip(thrs.tolist(), matches))
 
-        # loop over classes
-        # TODO: group detection on videos and classes basis to avoid loop multiple times
-        for obj_cls in self._classes:
-            gt_cls = [gt for gt in self._gt if gt.category_id == obj_cls['id']]
-            preds_cls = [pred for pred in self._predictions if pred.category_id == obj_cls['id']]
+        if np.ndim(thr) == 0:
+            self._res, mAP = self._evaluate_threshold(matches[0])
+            return self._res, mAP
+
+        self._res = {t: self._evaluate_threshold(m) for t, m in zip(thrs.tolist(), matches)}
+        mAP = float(np.mean([mAP_thr for _, mAP_thr in self._res.values()]))
+        return self._res, mAP
+
+    def _match_videos(self, thrs: list) -> list:
+        """Match the predicted and annotated tubes of each class in each video, according to each
+        threshold. Videos are matched in parallel if the evaluator has `workers` or `executor`.
 
-            # sort detections by decreasing confidence
-            preds_cls = sorted(preds_cls, key=lambda tube: tube.confidence, reverse=True)
+        Args:
+            thrs (list): IOU thresholds
 
-            # initialize true positive as zeros of length of predictions of a giving class
+        Returns:
+            list: for each threshold, a dictionary {category_id: {video_id: (TP flags, FN flags,
+                number of TP, FP and FN)}}, with the flags of the tubes in their order in the video.
+        """
+        # shard the (class, video) groups by video
+        videos = {}
+        for obj_cls in self._classes:
+            gt_videos = self._gt_groups.get(obj_cls['id'], {})
+            pred_videos = self._pred_groups.get(obj_cls['id'], {})
+            for vid_id in dict.fromkeys(list(gt_videos) + list(pred_videos)):
+                key = (obj_cls['id'], vid_id)
+                videos.setdefault(vid_id, []).append(
+                    (key, pred_videos.get(vid_id, []), gt_videos.get(vid_id, []),
+                     self._ious.get(key)))
+        match_video = partial(_match_video, thrs=thrs)
+
+        if self._executor is None and (self._workers is None or self._workers <= 1):
+            results = list(map(match_video, videos.values()))
+        else:
+            executor = self._executor
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=self._workers)
+            try:
+                # a few chunks per worker to balance the load
+                n_chunks = 4 * (self._workers or os.cpu_count() or 1)
+                chunk_size = max(1, int(math.ceil(len(videos) / n_chunks)))
+                results = list(executor.map(match_video, videos.values(), chunksize=chunk_size))
+            finally:
+                if self._executor is None:
+                    executor.shutdown(cancel_futures=True)
+
+        # merge the results in the order of the videos
+        matches = [dict() for _ in thrs]
+        for result in results:
+            for key, ious, video_matches in result:
+                self._ious[key] = ious
+                for i, video_match in enumerate(video_matches):
+                    matches[i].setdefault(key[0], {})[key[1]] = video_match
+        return matches
+
+    def _evaluate_threshold(self, matches: dict) -> tuple:
+        """Evaluate the predictions matched according to one IOU threshold
 
-            # loop over videos
-            for vid_id in self._videos:
-                gts = [gt for gt in gt_cls if gt.video_id == vid_id['id']]
-                preds = [pred for pred in preds_cls if pred.video_id == vid_id['id']]
+        Args:
+            matches (dict): {category_id: {video_id: (TP flags, FN flags, number of TP, FP and
+                FN)}}, as returned by `_match_videos`.
 
-                n_tp, n_fp, n_fn = self._classify_tubes(preds, gts, thr)
+        Returns:
+            res, mAP: return a dictionary (res) with results per class. Also, returns the mAP.
+        """
+        res = dict()
+        # loop over classes
+        for obj_cls in self._classes:
+            gt_videos = self._gt_groups.get(obj_cls['id'], {})
+            pred_indices = self._pred_indices.get(obj_cls['id'], {})
+            # detections sorted by decreasing confidence
+            preds_cls = self._preds_per_class.get(obj_cls['id'], [])
+            n_gts = sum(len(gts) for gts in gt_videos.values())
+
+            # merge the flags of the videos by the indices of the predictions in the class
+            TP = np.zeros(len(preds_cls), dtype=int)
+            n_tp, n_fp, n_fn = 0, 0, 0
+            for vid_id, video_match in matches.get(obj_cls['id'], {}).items():
+                is_tp, _, n_tp_vid, n_fp_vid, n_fn_vid = video_match
+                TP[pred_indices.get(vid_id, [])] = is_tp
+                n_tp += n_tp_vid
+                n_fp += n_fp_vid
+                n_fn += n_fn_vid
 
-            TP = np.array([int(tube.isTP) for tube in preds_cls])
             FP = np.logical_not(TP).astype(int)
 
             # compute precision, recall and average precision
             acc_TP = np.cumsum(TP)
             acc_FP = np.cumsum(FP)
-            rec = acc_TP / len(gt_cls)
+            rec = acc_TP / n_gts
             prec = np.divide(acc_TP, (acc_FP + acc_TP))
 
             # Depending on the method, call the right implementation
@@ -110,7 +240,7 @@ class TubeEvaluator():
                 raise ValueError(f'Invalid interpolation method: {self._method}')
 
             # add class result in the dictionary to be returned
-            self._res[obj_cls['name']] = {
+            res[obj_cls['name']] = {
                 'precision': prec,
                 'recall': rec,
                 'AP': ap,
@@ -122,32 +252,40 @@ class TubeEvaluator():
             }
         # For mAP, only the classes in the gt set should be considered
         mAP = 0.0
-        for c, r in self._res.items():
+        for c, r in res.items():
             if any(cat['name'] == c for cat in self._classes):
                 mAP += r['AP']
         mAP /= len(self._classes)
 
-        return self._res, mAP
+        return res, mAP
 
-    def _classify_tubes(self, preds: list, gts: list, thr: float) -> tuple:
-        """This method classify the `preds` in TP or !TP and the `gts` in FN or !FN, by setting an attribute in each tube in the lists.
+    @staticmethod
+    def _classify_tubes(preds: list, gts: list, thr: float, overlaps: np.array = None) -> tuple:
+        """This method classify the `preds` in TP or !TP and the `gts` in FN or !FN, returning a
+        flag for each tube in the lists.
         This is done according to the threshold chosen. Detections with higher confidences have priority.
 
         Args:
             preds (list): list of  predicted Tube objects
             gts (list): list of  annotation Tube objects
             thr (float): threshold to consider a tube correctly detected. It compares the Spatio-temporal IOU (STT-IOU).
+            overlaps (np.array, optional): pairwise STT-IOU of `preds` and `gts`, which is not
+                modified. Computed if not given.
 
         Returns:
-            tuple: return the number of TP, FP and FN.
+            tuple: return the number of TP, FP and FN, and the TP flags of `preds` and the FN
+                flags of `gts`.
         """
 
         gt_overlaps = np.zeros(len(gts))
-        overlaps = self._tube_pairwise_iou(preds, gts)
+        if overlaps is None:
+            overlaps = TubeEvaluator._tube_pairwise_iou(preds, gts)
+        else:
+            overlaps = overlaps.copy()
 
         # consider no detections at first
-        [gt.__setattr__('isFN', True) for gt in gts]
-        [pred.__setattr__('isTP', False) for pred in preds]
+        is_fn = np.ones(len(gts), dtype=bool)
+        is_tp = np.zeros(len(preds), dtype=bool)
 
         for j in range(min(len(preds), len(gts))):
             max_overlaps = overlaps.max(axis=0)
@@ -164,8 +302,8 @@ class TubeEvaluator():
             # in case the ovr greater than threshold,
             # set the gt tube to detected and pred as TP
             if gt_ovr >= thr:
-                gts[gt_ind].__setattr__('isFN', False)
-                preds[box_ind].__setattr__('isTP', True)
+                is_fn[gt_ind] = False
+                is_tp[box_ind] = True
 
             # record the iou coverage of this gt tube
             gt_overlaps[j] = overlaps[box_ind, gt_ind]
@@ -184,9 +322,10 @@ class TubeEvaluator():
         nb_fn = len(gts) - nb_tp
         assert nb_fn >= 0
 
-        return nb_tp, nb_fp, nb_fn
+        return nb_tp, nb_fp, nb_fn, is_tp, is_fn
 
-    def _tube_pairwise_iou(self, preds: list, gts: list) -> np.array:
+    @staticmethod
+    def _tube_pairwise_iou(preds: list, gts: list) -> np.array:
         """compute the pairwise spatio-temporal tube iou (STT-IOU)
 
         Args:
@@ -196,6 +335,16 @@ class TubeEvaluator():
         Returns:
             np.array: pairwise STT-IOU
         """
+        # align the tubes on the frames of the video to compute all intersections at once
+        frames = DenseTubes.get_frames([preds, gts])
+        if all(tube.has_unique_frames() for tube in preds + gts):
+            dense_preds = DenseTubes(preds, frames)
+            dense_gts = DenseTubes(gts, frames)
+            inter = dense_preds.pairwise_inter(dense_gts)
+            union = dense_preds.volumes[:, None] + dense_gts.volumes
+            return inter / (union - inter)
+
+        # tubes with more than one box in a frame are compared pair by pair
         # initialize matrices that will keep the intersection and union of the tubes
         inter = np.zeros((len(preds), len(gts)))
         union = np.zeros((len(preds), len(gts)))
@@ -206,9 +355,9 @@ class TubeEvaluator():
 
             for gt in gts:
                 # compute the pairwise intersection
-                inter[pred_idx, gt_idx] = self._tubes_inter(pred, gt)
+                inter[pred_idx, gt_idx] = TubeEvaluator._tubes_inter(pred, gt)
                 # compute the pairwise union
-                union[pred_idx, gt_idx] = self._tubes_union(pred, gt)
+                union[pred_idx, gt_idx] = TubeEvaluator._tubes_union(pred, gt)
 
                 gt_idx += 1
 
@@ -218,7 +367,8 @@ class TubeEvaluator():
 
         return iou
 
-    def _tubes_inter(self, tube1: Tube, tube2: Tube) -> np.array:
+    @staticmethod
+    def _tubes_inter(tube1: Tube, tube2: Tube) -> np.array:
         """Give two tubes of track size N and M,
         compute de intersection volume between __all__ N x M pairs of boxes.
         The boxes in track must be (xmin, ymin, xmax, ymax)
@@ -230,7 +380,7 @@ class TubeEvaluator():
             np.array: intersection volume.
         """
 
-        inter_frames = self._get_intersection_frames(tube1, tube2)
+        inter_frames = TubeEvaluator._get_intersection_frames(tube1, tube2)
 
         inter = 0
 
@@ -248,7 +398,8 @@ class TubeEvaluator():
 
         return inter
 
-    def _tubes_union(self, tube1: Tube, tube2: Tube) -> np.array:
+    @staticmethod
+    def _tubes_union(tube1: Tube, tube2: Tube) -> np.array:
         """Give two tubes of track size N and M,
         compute de union volume between __all__ N x M pairs of boxes.
 
@@ -262,7 +413,8 @@ class TubeEvaluator():
         vol2 = tube2.get_tube_volume()
         return vol1 + vol2
 
-    def _get_intersection_frames(self, tube1: Tube, tube2: Tube) -> list:
+    @staticmethod
+    def _get_intersection_frames(tube1: Tube, tube2: Tube) -> list:
         """Get the frames that are commom to tube1 and tube2.
 
         Args:
@@ -280,3 +432,27 @@ class TubeEvaluator():
             return frames_inter
 
         return None
+
+
+def _match_video(groups: list, thrs: list) -> list:
+    """Match the predicted and annotated tubes of the classes of a video. Run by the worker
+    processes of TubeEvaluator, so it only depends on its arguments.
+
+    Args:
+        groups (list): list of (key, preds, gts, STT-IOU of preds and gts or None) of each class
+        thrs (list): IOU thresholds
+
+    Returns:
+        list: list of (key, STT-IOU, list with (TP flags, FN flags, number of TP, FP and FN) of
+            each threshold) of each class
+    """
+    results = []
+    for key, preds, gts, ious in groups:
+        if ious is None:
+            ious = TubeEvaluator._tube_pairwise_iou(preds, gts)
+        video_matches = []
+        for thr in thrs:
+            n_tp, n_fp, n_fn, is_tp, is_fn = TubeEvaluator._classify_tubes(preds, gts, thr, ious)
+            video_matches.append((is_tp, is_fn, n_tp, n_fp, n_fn))
+        results.append((key, ious, video_matches))
+    return results
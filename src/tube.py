@@ -7,7 +7,13 @@ from src.utils.general_utils import convert_box_xywh2xyxy
 
 class Tube(object):
     """Tube object
+
+    The track is kept sorted by frame, with the boxes of the i-th distinct frame in
+    `boxes[offsets[i]:offsets[i + 1]]`, so the boxes of a frame are found by a binary search.
     """
+    __slots__ = ('category_id', 'video_id', 'confidence', 'volume', 'frames', 'boxes',
+                 'attributes', 'frame_values', 'offsets', '_kwargs')
+
     def __init__(self, category_id: int, video_id: int, track: list, **kwargs: Any) -> None:
         """class constructor
 
@@ -20,23 +26,35 @@ class Tube(object):
         self.video_id = video_id
         self.confidence = None
 
-        self.track = {attr: np.array([det[attr] for det in track]) for attr in track[0]}
+        track = {attr: np.array([det[attr] for det in track]) for attr in track[0]}
 
-        if 'confidence' in self.track.keys():
-            self.confidence = self.__compute_tube_confidence(self.track['confidence'])
+        if 'confidence' in track.keys():
+            self.confidence = self.__compute_tube_confidence(track['confidence'])
 
-        self.volume = self.__compute_tube_volume()
+        # the volume is computed in the order of the track, before sorting it
+        self.volume = self.__compute_tube_volume(track['bbox'])
 
-        self.__kwargs = kwargs
-        for k, v in kwargs.items():
-            super().__setattr__(k, v)
+        # extra attributes of the tube (Ex: id), available as tube.<name>
+        self._kwargs = kwargs
 
+        # sort the track by frame (boxes of the same frame keep their order)
+        order = np.argsort(track['frame'], kind='stable')
+        self.frames = track.pop('frame')[order]
         # convert tube boxes from xywh to xyxy format
-        boxes = convert_box_xywh2xyxy(self.get_boxes())
-        self.track['bbox'] = boxes
+        self.boxes = convert_box_xywh2xyxy(track.pop('bbox')[order])
+        # other attributes of each box (Ex: confidence, occluded)
+        self.attributes = {attr: values[order] for attr, values in track.items()}
+        self.frame_values, starts = np.unique(self.frames, return_index=True)
+        self.offsets = np.append(starts, len(self.frames))
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return object.__getattribute__(self, '_kwargs')[name]
+        except (AttributeError, KeyError):
+            raise AttributeError(name) from None
 
     def __len__(self) -> int:
-        return len(self.track)
+        return len(self.frames)
 
     def __str__(self) -> str:
         s = self.__class__.__name__ + "("
@@ -44,12 +62,21 @@ class Tube(object):
         s += "video_id={}, ".format(self.video_id)
         s += "category_id={}, ".format(self.category_id)
         s += "tube_confidence={:.2f}, ".format(self.confidence)
-        s += "{}, ".format("".join(f"{k}={v}" for k, v in self.__kwargs.items()))
+        s += "{}, ".format("".join(f"{k}={v}" for k, v in self._kwargs.items()))
         s += "track=[{}]".format(", ".join(f"{k}: {v}" for k, v in self.track.items()))
         s += ")"
 
         return s
 
+    @property
+    def track(self) -> dict:
+        """Return the track as a dictionary with an array for each attribute of the boxes.
+
+        Returns:
+            dict: dictionary with keys "frame", "bbox" and the other attributes of the boxes.
+        """
+        return {'frame': self.frames, 'bbox': self.boxes, **self.attributes}
+
     def __compute_tube_confidence(self, frames_confidences: list) -> float:
         """Compute tube confidence. It is the mean of individual bboxes along the frames.
 
@@ -67,7 +94,7 @@ class Tube(object):
         Returns:
             list: list of frames of tube.
         """
-        return self.track['frame']
+        return self.frames
 
     def get_boxes(self) -> list:
         """Return a list of bboxes of a given track.
@@ -75,7 +102,7 @@ class Tube(object):
         Returns:
             list: list of bboxes of tube.
         """
-        return self.track['bbox']
+        return self.boxes
 
     def get_frame_boxes(self, frame_idx):
         """return the boxes of frame `frame_idx`
@@ -86,20 +113,28 @@ class Tube(object):
         Returns:
             list: list of bounding boxes of the `frame_idx` frame
         """
-        frames = self.get_frames()
-        indexes = [i for i, e in enumerate(frames) if e == frame_idx]
+        i = np.searchsorted(self.frame_values, frame_idx)
+        if i == len(self.frame_values) or self.frame_values[i] != frame_idx:
+            return self.boxes[:0]
+        return self.boxes[self.offsets[i]:self.offsets[i + 1]]
 
-        boxes = self.get_boxes()[indexes]
+    def has_unique_frames(self) -> bool:
+        """Verify if the tube has at most one box in each frame.
 
-        return boxes
+        Returns:
+            bool: True if no frame is repeated in the track of the tube.
+        """
+        return len(self.frame_values) == len(self.frames)
 
-    def __compute_tube_volume(self) -> float:
+    def __compute_tube_volume(self, boxes: np.ndarray) -> float:
         """Compute tube volume. It is the summation of pixels of all bouding boxes that the tube contains.
 
+        Args:
+            boxes (np.ndarray): boxes of the tube in xywh format
+
         Returns:
             float: tube volume
         """
-        boxes = self.get_boxes()
         areas = np.prod(boxes[:, 2:], axis=1)
         vol = areas.sum()
         return vol
@@ -113,3 +148,84 @@ class Tube(object):
         return self.volume
 
     __repr__ = __str__
+
+
+class DenseTubes(object):
+    """Tubes aligned on a common frame axis, so that operations between all pairs of tubes can be
+    computed with array broadcasting.
+    """
+    def __init__(self, tubes: list, frames: np.ndarray = None) -> None:
+        """class constructor
+
+        Args:
+            tubes (list): list of Tube objects. A tube can not have more than one box in a frame.
+            frames (np.ndarray, optional): sorted frame indexes of the axis. It must contain the
+                frames of all tubes. Defaults to the frames of the tubes.
+        """
+        if frames is None:
+            frames = DenseTubes.get_frames([tubes])
+        self.frames = frames
+        # boxes (xmin, ymin, xmax, ymax) of each tube in each frame and the frames each tube is in
+        self.boxes = np.zeros((len(tubes), len(frames), 4))
+        self.mask = np.zeros((len(tubes), len(frames)), dtype=bool)
+        for i, tube in enumerate(tubes):
+            if not tube.has_unique_frames():
+                raise ValueError("Tube with more than one box in a frame: ", tube)
+            idx = np.searchsorted(frames, tube.get_frames())
+            self.boxes[i, idx] = tube.get_boxes()
+            self.mask[i, idx] = True
+        self.volumes = np.array([tube.get_tube_volume() for tube in tubes], dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @staticmethod
+    def get_frames(tubes_lists: list) -> np.ndarray:
+        """return the sorted frame indexes of the tubes of some lists of tubes
+
+        Args:
+            tubes_lists (list): lists of Tube objects
+
+        Returns:
+            np.ndarray: sorted frame indexes
+        """
+        frames = [tube.get_frames() for tubes in tubes_lists for tube in tubes]
+        if len(frames) == 0:
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate(frames))
+
+    def pairwise_inter(self, other: 'DenseTubes', max_elements: int = 1 << 22) -> np.ndarray:
+        """compute the intersection volumes between all pairs of tubes of `self` and `other`,
+        which must be aligned on the same frames.
+
+        The frame axis is split in blocks, and only the tubes present in a block take part in
+        its broadcast, so that at most about `max_elements` box pairs are computed at once.
+
+        Args:
+            other (DenseTubes): tubes aligned on the same frames
+            max_elements (int, optional): maximum number of box pairs computed at once.
+
+        Returns:
+            np.ndarray: [N,M] intersection volumes
+        """
+        inter = np.zeros((len(self), len(other)))
+        n_frames = len(self.frames)
+        if inter.size == 0 or n_frames == 0:
+            return inter
+        block = max(1, max_elements // inter.size)
+        for start in range(0, n_frames, block):
+            frames = slice(start, start + block)
+            rows1 = np.flatnonzero(self.mask[:, frames].any(axis=1))
+            rows2 = np.flatnonzero(other.mask[:, frames].any(axis=1))
+            if len(rows1) == 0 or len(rows2) == 0:
+                continue
+            box1 = self.boxes[rows1, frames]  # [N,T,4]
+            box2 = other.boxes[rows2, frames]  # [M,T,4]
+            width_height = np.minimum(box1[:, None, :, 2:], box2[:, :, 2:]) - np.maximum(
+                box1[:, None, :, :2], box2[:, :, :2])  # [N,M,T,2]
+            width_height.clip(min=0, out=width_height)
+            areas = width_height.prod(axis=3)  # [N,M,T]
+            # only the frames common to both tubes count
+            areas *= self.mask[rows1, None, frames] & other.mask[rows2, frames]
+            inter[np.ix_(rows1, rows2)] += areas.sum(axis=2)
+        return inter
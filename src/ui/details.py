@@ -8,9 +8,9 @@ from src.bounding_box import BoundingBox
 from src.ui.details_ui import Ui_Dialog as Details_UI
 from src.utils import general_utils
 from src.utils.enumerators import BBType
-from src.utils.general_utils import (add_bb_into_image, get_files_dir,
-                                     remove_file_extension,
+from src.utils.general_utils import (add_bb_into_image, remove_file_extension,
                                      show_image_in_qt_component)
+from src.utils.image_index import get_image_index
 
 
 class Details_Dialog(QMainWindow, Details_UI):
@@ -70,8 +70,8 @@ class Details_Dialog(QMainWindow, Details_UI):
 
         # get first image file and show it
         if os.path.isdir(self.dir_images):
-            self.image_files = get_files_dir(
-                self.dir_images, extensions=['jpg', 'jpge', 'png', 'bmp', 'tiff', 'tif'])
+            self.image_files = get_image_index(self.dir_images, refresh=True).get_files(
+                extensions=['jpg', 'jpge', 'png', 'bmp', 'tiff', 'tif'])
             if len(self.image_files) > 0:
                 self.selected_image_index = 0
             else:
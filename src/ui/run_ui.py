@@ -7,10 +7,12 @@ from PyQt5.QtWidgets import QFileDialog, QMainWindow, QMessageBox
 from src.evaluators.coco_evaluator import get_coco_summary
 from src.evaluators.pascal_voc_evaluator import (get_pascalvoc_metrics, plot_precision_recall_curve,
                                                  plot_precision_recall_curves)
+from src.bounding_box_set import BoundingBoxSet
 from src.ui.details import Details_Dialog
 from src.ui.main_ui import Ui_Dialog as Main_UI
 from src.ui.results import Results_Dialog
 from src.ui.splash import Splash_Dialog
+from src.utils.annotation_cache import AnnotationCache
 from src.utils.enumerators import BBFormat, BBType, CoordinatesType
 
 
@@ -25,6 +27,19 @@ class Main_Dialog(QMainWindow, Main_UI):
         self.dialog_statistics = Details_Dialog()
         # Define results dialog
         self.dialog_results = Results_Dialog()
+        # Parsed ground truths are cached, so unchanged directories are not parsed again
+        self.annotation_cache = AnnotationCache()
+        # Sizes of the images are kept with the cache, so images are not read again in the next
+        # sessions
+        self.image_size_cache = general_utils.image_size_cache
+        self.image_size_cache.file_path = os.path.join(self.annotation_cache.cache_dir,
+                                                       'image_sizes.json')
+        if os.path.isfile(self.image_size_cache.file_path):
+            try:
+                self.image_size_cache.load(self.image_size_cache.file_path)
+            except (OSError, ValueError):
+                print(f'Warning: Could not load the image sizes from '
+                      f'{self.image_size_cache.file_path}.')
 
         # Default values
         self.dir_annotations_gt = None
@@ -64,31 +79,51 @@ class Main_Dialog(QMainWindow, Main_UI):
         self.msgBox.setStandardButtons(buttons)
         return self.msgBox.exec()
 
-    def load_annotations_gt(self):
-        ret = []
+    def save_image_sizes(self):
+        """ Save the sizes of the images resolved while loading annotations, if any. """
+        if not self.image_size_cache.modified:
+            return
+        try:
+            self.image_size_cache.save()
+        except OSError:
+            print(f'Warning: Could not save the image sizes to {self.image_size_cache.file_path}.')
+
+    def load_annotations_gt(self, as_set=False):
+        """ Load the ground truths, as a BoundingBoxSet if `as_set` is True (the evaluators take
+        it directly) or as a list of BoundingBox objects. """
+        def load(converter_func, path, *args, **kwargs):
+            if path is None:
+                return BoundingBoxSet.empty()
+            return self.annotation_cache.load(converter_func, path, *args, **kwargs)
+
+        ret = BoundingBoxSet.empty()
         if self.rad_gt_format_coco_json.isChecked():
-            ret = converter.coco2bb(self.dir_annotations_gt)
+            ret = load(converter.coco2bb, self.dir_annotations_gt)
         elif self.rad_gt_format_cvat_xml.isChecked():
-            ret = converter.cvat2bb(self.dir_annotations_gt)
+            ret = load(converter.cvat2bb, self.dir_annotations_gt)
         elif self.rad_gt_format_openimages_csv.isChecked():
-            ret = converter.openimage2bb(self.dir_annotations_gt, self.dir_images_gt,
-                                         BBType.GROUND_TRUTH)
+            ret = load(converter.openimage2bbset, self.dir_annotations_gt, self.dir_images_gt,
+                       BBType.GROUND_TRUTH)
         elif self.rad_gt_format_labelme_xml.isChecked():
-            ret = converter.labelme2bb(self.dir_annotations_gt)
+            ret = load(converter.labelme2bb, self.dir_annotations_gt)
         elif self.rad_gt_format_pascalvoc_xml.isChecked():
-            ret = converter.vocpascal2bb(self.dir_annotations_gt)
+            ret = load(converter.vocpascal2bb, self.dir_annotations_gt)
         elif self.rad_gt_format_imagenet_xml.isChecked():
-            ret = converter.imagenet2bb(self.dir_annotations_gt)
+            ret = load(converter.imagenet2bb, self.dir_annotations_gt)
         elif self.rad_gt_format_abs_values_text.isChecked():
-            ret = converter.text2bb(self.dir_annotations_gt, bb_type=BBType.GROUND_TRUTH)
+            ret = load(converter.text2bb, self.dir_annotations_gt, bb_type=BBType.GROUND_TRUTH)
         elif self.rad_gt_format_yolo_text.isChecked():
-            ret = converter.yolo2bb(self.dir_annotations_gt,
-                                    self.dir_images_gt,
-                                    self.filepath_classes_gt,
-                                    bb_type=BBType.GROUND_TRUTH)
+            ret = load(converter.yolo2bb,
+                       self.dir_annotations_gt,
+                       self.dir_images_gt,
+                       self.filepath_classes_gt,
+                       bb_type=BBType.GROUND_TRUTH)
+        self.save_image_sizes()
         # Make all types as GT
-        [bb.set_bb_type(BBType.GROUND_TRUTH) for bb in ret]
-        return ret
+        ret.set_bb_type(BBType.GROUND_TRUTH)
+        if as_set:
+            return ret
+        return ret.to_bounding_boxes()
 
     def validate_det_choices(self):
         # If relative format was required, directory with images have to be valid
@@ -155,6 +190,7 @@ class Main_Dialog(QMainWindow, Main_UI):
                                     bb_format=BBFormat.XYWH,
                                     type_coordinates=CoordinatesType.ABSOLUTE,
                                     img_dir=self.dir_images_gt)
+        self.save_image_sizes()
         # Verify if for the selected format, detections were found
         if len(ret) == 0:
             self.show_popup(
@@ -315,7 +351,8 @@ class Main_Dialog(QMainWindow, Main_UI):
                 icon=QMessageBox.Information)
             return
 
-        gt_annotations = self.load_annotations_gt()
+        # the evaluators take the cached set of ground truths without converting it
+        gt_annotations = self.load_annotations_gt(as_set=True)
         if gt_annotations is None or len(gt_annotations) == 0:
             self.show_popup(
                 'No ground-truth bounding box of the selected type was found in the folder.\nCheck if the selected type corresponds to the files in the folder and try again.',
@@ -364,8 +401,7 @@ class Main_Dialog(QMainWindow, Main_UI):
             iou_threshold = self.dsb_IOU_pascal.value()
             pascal_res = get_pascalvoc_metrics(gt_annotations,
                                                det_annotations,
-                                               iou_threshold=iou_threshold,
-                                               generate_table=True)
+                                               iou_threshold=iou_threshold)
             mAP = pascal_res['mAP']
 
             if not self.chb_metric_AP_pascal.isChecked():
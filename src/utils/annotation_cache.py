@@ -0,0 +1,213 @@
+""" On-disk cache of parsed annotations.
+
+The bounding boxes returned by a converter (see src.utils.converter) are stored as the arrays of
+a BoundingBoxSet in a .npz file, with the tables of image names and class ids serialized as json.
+Entries are keyed by the converter and its arguments, and are valid while the annotation files
+they were parsed from keep the same paths, sizes and modification times. If only the modification
+times changed, the content of the files is hashed and compared with that of the cached entry.
+Other arguments that are paths (e.g. directories of images) are only checked with os.stat, so
+their contents are never read. The total size of the cache is bounded, the least recently used
+entries being removed first.
+"""
+
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+from src.bounding_box_set import BoundingBoxSet, as_bounding_box_set
+
+_COLUMNS = ('_boxes', '_wh', '_confidences', '_image_indices', '_class_indices', '_img_sizes',
+            '_bb_types', '_coordinates_types', '_formats')
+
+
+class AnnotationCache:
+    """ Cache of the bounding boxes parsed by the converters. """
+    def __init__(self, cache_dir=None, max_size=1 << 30):
+        """ Constructor.
+
+        Parameters
+        ----------
+            cache_dir : str (optional)
+                Directory where the entries are stored. By default, the directory
+                review_object_detection_metrics in the user's cache directory (~/.cache).
+            max_size : int (optional)
+                Maximum total size, in bytes, of the entries.
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'review_object_detection_metrics')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def load(self, converter, path, *args, **kwargs):
+        """ Get the bounding boxes returned by `converter(path, *args, **kwargs)`, parsing the
+        files only if they are not in the cache or changed since they were cached.
+
+        The annotation files in `path` are used to validate the entry. The other arguments that
+        are paths of files or directories (e.g. directories of images or files with classes) are
+        only checked by their sizes and modification times, without listing the directories.
+
+        Parameters
+        ----------
+            converter : function
+                Converter returning a list of BoundingBox objects or a BoundingBoxSet.
+            path : str
+                Path of the annotations passed to the converter.
+            args, kwargs :
+                Other arguments passed to the converter.
+
+        Returns
+        -------
+        BoundingBoxSet
+            The bounding boxes.
+        """
+        key = _get_key(converter, (path, ) + args, kwargs)
+        entry_path = os.path.join(self.cache_dir, f'{key}.npz')
+        files = _list_files(path)
+        fingerprint = {
+            'files': _get_fingerprint(files),
+            'args': _get_fingerprint(_list_paths(list(args) + list(kwargs.values())))
+        }
+
+        cached = _read_entry(entry_path)
+        if cached is not None:
+            bb_set, meta = cached
+            if meta['fingerprint'] == fingerprint:
+                # mark entry as recently used
+                os.utime(entry_path)
+                return bb_set
+            # annotation files were only touched: compare their contents
+            cached_fingerprint = meta['fingerprint']
+            if isinstance(cached_fingerprint, dict) and \
+                    cached_fingerprint.get('args') == fingerprint['args'] and \
+                    [f[:2] for f in cached_fingerprint['files']] == \
+                    [f[:2] for f in fingerprint['files']] and \
+                    meta['digest'] == _get_digest(files):
+                self._write_entry(entry_path, bb_set, fingerprint, meta['digest'])
+                return bb_set
+
+        bb_set = as_bounding_box_set(converter(path, *args, **kwargs))
+        self._write_entry(entry_path, bb_set, fingerprint, _get_digest(files))
+        self._evict()
+        return bb_set
+
+    def clear(self):
+        """ Remove all entries of the cache. """
+        for entry_path in self._get_entries():
+            os.remove(entry_path)
+
+    def _get_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [
+            os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir)
+            if f.endswith('.npz')
+        ]
+
+    def _write_entry(self, entry_path, bb_set, fingerprint, digest):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = {
+            'fingerprint': fingerprint,
+            'digest': digest,
+            'images': bb_set.get_images(),
+            'classes': bb_set.get_classes()
+        }
+        tmp_path = f'{entry_path[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path,
+                 meta=np.array(json.dumps(meta)),
+                 **{name: getattr(bb_set, name)
+                    for name in _COLUMNS})
+        os.replace(tmp_path, entry_path)
+
+    def _evict(self):
+        """ remove the least recently used entries until the cache fits in max_size """
+        entries = []
+        for entry_path in self._get_entries():
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total -= size
+
+
+def _get_key(converter, args, kwargs):
+    """ identify the converter and its arguments """
+    description = [
+        converter.__module__, converter.__qualname__,
+        [_describe(a) for a in args], {k: _describe(v)
+                                       for k, v in sorted(kwargs.items())}
+    ]
+    return hashlib.sha1(json.dumps(description).encode()).hexdigest()
+
+
+def _describe(value):
+    if isinstance(value, str) and os.path.exists(value):
+        return os.path.abspath(value)
+    return repr(value)
+
+
+def _list_files(path):
+    """ annotation files in a file or directory path """
+    if not isinstance(path, str):
+        return []
+    if os.path.isfile(path):
+        return [os.path.abspath(path)]
+    files = []
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            files.extend(os.path.abspath(os.path.join(dirpath, f)) for f in sorted(filenames))
+    return files
+
+
+def _list_paths(values):
+    """ arguments that are paths of files or directories (not listed) """
+    return [
+        os.path.abspath(value) for value in values
+        if isinstance(value, str) and os.path.exists(value)
+    ]
+
+
+def _get_fingerprint(paths):
+    fingerprint = []
+    for f in paths:
+        stat = os.stat(f)
+        fingerprint.append([f, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def _get_digest(files):
+    """ hash of the contents of the files """
+    digest = hashlib.sha1()
+    for f in files:
+        with open(f, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_entry(entry_path):
+    """ read a cached BoundingBoxSet and its metadata (None if it can not be read) """
+    if not os.path.isfile(entry_path):
+        return None
+    try:
+        with np.load(entry_path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            columns = {name: data[name] for name in _COLUMNS}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    bb_set = BoundingBoxSet._from_columns(_images=meta['images'],
+                                          _classes=meta['classes'],
+                                          **columns)
+    return bb_set, meta
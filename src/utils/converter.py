@@ -1,13 +1,31 @@
 import base64
+import itertools
 import json
+import math
 import os
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 
+import numpy as np
 import pandas as pd
 import src.utils.general_utils as general_utils
+import src.utils.json_stream as json_stream
 import src.utils.validations as validations
 from src.bounding_box import BoundingBox
-from src.utils.enumerators import BBFormat, BBType, CoordinatesType
+from src.bounding_box_set import BoundingBoxSet
+from src.utils.enumerators import BBFormat, BBType, CoordinatesType, FileFormat
+
+# optional faster json parsers
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
 
 
 def _get_annotation_files(file_path):
@@ -22,214 +40,588 @@ def _get_annotation_files(file_path):
     return sorted(annotation_files)
 
 
-def coco2bb(path, bb_type=BBType.GROUND_TRUTH):
+def _get_validation_flags(annotation_files, validation):
+    """ Flag, for each file, whether it is validated according to the ValidationPolicy (all files
+    are validated if it is None). """
+    if validation is None:
+        validation = validations.ValidationPolicy.full()
+    return validation.select(annotation_files)
+
+
+# errors raised when a file that was not validated is not in the expected format
+_LOADING_ERRORS = (KeyError, IndexError, TypeError, ValueError, AttributeError, SyntaxError)
+
+
+@contextmanager
+def _loading(file_path, file_format, validated):
+    """ Raise an AnnotationFileError if a file that was not validated can not be loaded. Errors
+    in files that were validated are raised as they are. """
+    if validated:
+        yield
+        return
+    try:
+        yield
+    except validations.AnnotationFileError:
+        raise
+    except _LOADING_ERRORS as e:
+        raise validations.AnnotationFileError(file_path, file_format, e) from e
+
+
+def coco2bb(path, bb_type=BBType.GROUND_TRUTH, validation=None):
     ret = []
     # Get annotation files in the path
     annotation_files = _get_annotation_files(path)
+    validate = _get_validation_flags(annotation_files, validation)
     # Loop through each file
-    for file_path in annotation_files:
-        if not validations.is_coco_format(file_path):
+    for file_path, validated in zip(annotation_files, validate):
+        if validated and not validations.is_coco_format(file_path):
+            continue
+        if not validated and not validations.is_json(file_path):
             continue
 
-        with open(file_path, "r") as f:
-            json_object = json.load(f)
-
-        # COCO json file contains basically 3 lists:
-        # categories: containing the classes
-        # images: containing information of the images (width, height and filename)
-        # annotations: containing information of the bounding boxes (x1, y1, bb_width, bb_height)
-        classes = {}
-        if 'categories' in json_object:
-            classes = json_object['categories']
+        with _loading(file_path, FileFormat.COCO, validated):
+            with open(file_path, "r") as f:
+                json_object = json.load(f)
+
+            # COCO json file contains basically 3 lists:
+            # categories: containing the classes
+            # images: containing information of the images (width, height and filename)
+            # annotations: containing information of the bounding boxes (x1, y1, bb_width, bb_height)
+            classes = {}
+            if 'categories' in json_object:
+                classes = json_object['categories']
+                # into dictionary
+                classes = {c['id']: c['name'] for c in classes}
+            images = {}
             # into dictionary
-            classes = {c['id']: c['name'] for c in classes}
-        images = {}
-        # into dictionary
-        for i in json_object['images']:
-            images[i['id']] = {
-                'file_name': i['file_name'],
-                'img_size': (int(i['width']), int(i['height']))
-            }
-        annotations = []
-        if 'annotations' in json_object:
-            annotations = json_object['annotations']
-
-        for annotation in annotations:
-            img_id = annotation['image_id']
-            x1, y1, bb_width, bb_height = annotation['bbox']
-            if bb_type == BBType.DETECTED and 'score' not in annotation.keys():
-                print('Warning: Confidence not found in the JSON file!')
-                return ret
-            confidence = annotation['score'] if bb_type == BBType.DETECTED else None
-            # Make image name only the filename, without extension
-            img_name = images[img_id]['file_name']
-            img_name = general_utils.get_file_name_only(img_name)
-            # create BoundingBox object
-            bb = BoundingBox(image_name=img_name,
-                             class_id=classes[annotation['category_id']],
-                             coordinates=(x1, y1, bb_width, bb_height),
-                             type_coordinates=CoordinatesType.ABSOLUTE,
-                             img_size=images[img_id]['img_size'],
-                             confidence=confidence,
-                             bb_type=bb_type,
-                             format=BBFormat.XYWH)
-            ret.append(bb)
+            for i in json_object['images']:
+                images[i['id']] = {
+                    'file_name': i['file_name'],
+                    'img_size': (int(i['width']), int(i['height']))
+                }
+            annotations = []
+            if 'annotations' in json_object:
+                annotations = json_object['annotations']
+
+            for annotation in annotations:
+                img_id = annotation['image_id']
+                x1, y1, bb_width, bb_height = annotation['bbox']
+                if bb_type == BBType.DETECTED and 'score' not in annotation.keys():
+                    print('Warning: Confidence not found in the JSON file!')
+                    return ret
+                confidence = annotation['score'] if bb_type == BBType.DETECTED else None
+                # Make image name only the filename, without extension
+                img_name = images[img_id]['file_name']
+                img_name = general_utils.get_file_name_only(img_name)
+                # create BoundingBox object
+                bb = BoundingBox(image_name=img_name,
+                                 class_id=classes[annotation['category_id']],
+                                 coordinates=(x1, y1, bb_width, bb_height),
+                                 type_coordinates=CoordinatesType.ABSOLUTE,
+                                 img_size=images[img_id]['img_size'],
+                                 confidence=confidence,
+                                 bb_type=bb_type,
+                                 format=BBFormat.XYWH)
+                ret.append(bb)
     return ret
 
 
-def cvat2bb(path):
-    '''This format supports ground-truth only'''
+def _load_json(file_path):
+    """ Parse a json file with the fastest parser available (orjson, simdjson or json) """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    if simdjson is not None:
+        return simdjson.loads(data)
+    return json.loads(data)
+
+
+def _first_appearance(indices, table):
+    """ Restrict a table to the values referenced by `indices`, in order of first appearance.
+    Returns the new table and the indices into it. """
+    values, first, inverse = np.unique(indices, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return [table[values[i]] for i in order], rank[inverse]
+
+
+def coco2bbset(path, bb_type=BBType.GROUND_TRUTH):
+    """ Load annotations in the coco format into a BoundingBoxSet.
+
+    Gives the same bounding boxes as coco2bb, but each file is parsed only once (with orjson or
+    simdjson if installed) and the boxes are stored directly in arrays, without creating a
+    BoundingBox object per annotation.
+
+    Parameters
+    ----------
+    path : str
+        Path of a json file or of a directory containing json files.
+    bb_type : Enum (optional)
+        Enum identifying if the bounding boxes are ground truths or detections.
+
+    Returns
+    -------
+    BoundingBoxSet
+        The loaded bounding boxes.
+    """
     ret = []
     # Get annotation files in the path
     annotation_files = _get_annotation_files(path)
     # Loop through each file
     for file_path in annotation_files:
-        if not validations.is_cvat_format(file_path):
+        if not validations.is_json(file_path):
+            continue
+        json_object = _load_json(file_path)
+        annotations = json_object.get('annotations', []) if isinstance(json_object, dict) else []
+        # same verification of validations.is_coco_format, on the parsed object
+        annotation_keys = set()
+        for annotation in annotations if isinstance(annotations, list) else []:
+            if isinstance(annotation, dict):
+                annotation_keys.update(annotation.keys())
+        if 'bbox' not in annotation_keys or 'image_id' not in annotation_keys:
             continue
 
-        # Loop through the images
-        for image_info in ET.parse(file_path).iter('image'):
-            img_size = (int(image_info.attrib['width']), int(image_info.attrib['height']))
-            img_name = image_info.attrib['name']
-            img_name = general_utils.get_file_name_only(img_name)
-
-            # Loop through the boxes
-            for box_info in image_info.iter('box'):
-                x1, y1, x2, y2 = float(box_info.attrib['xtl']), float(
-                    box_info.attrib['ytl']), float(box_info.attrib['xbr']), float(
-                        box_info.attrib['ybr'])
-                x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        # tables of classes and images, with the position of each id in them
+        class_names = {c['id']: c['name'] for c in json_object.get('categories', [])}
+        classes = list(dict.fromkeys(class_names.values()))
+        class_positions = {name: i for i, name in enumerate(classes)}
+        class_positions = {c_id: class_positions[name] for c_id, name in class_names.items()}
+        images = [general_utils.get_file_name_only(i['file_name']) for i in json_object['images']]
+        image_positions = {i['id']: idx for idx, i in enumerate(json_object['images'])}
+        image_sizes = np.array([(int(i['width']), int(i['height']))
+                                for i in json_object['images']],
+                               dtype=np.int64).reshape(-1, 2)
+
+        confidences = None
+        missing = []
+        if bb_type == BBType.DETECTED:
+            missing = [i for i, a in enumerate(annotations) if 'score' not in a]
+            stop = len(annotations) if len(missing) == 0 else missing[0]
+            annotations = annotations[:stop]
+            confidences = np.array([a['score'] for a in annotations], dtype=np.float64)
+
+        n = len(annotations)
+        boxes = np.array([a['bbox'] for a in annotations], dtype=np.float64).reshape(n, 4)
+        image_indices = np.fromiter((image_positions[a['image_id']] for a in annotations),
+                                    dtype=np.int64,
+                                    count=n)
+        class_indices = np.fromiter((class_positions[a['category_id']] for a in annotations),
+                                    dtype=np.int64,
+                                    count=n)
+        img_sizes = image_sizes[image_indices]
+        images, image_indices = _first_appearance(image_indices, images)
+        classes, class_indices = _first_appearance(class_indices, classes)
+        ret.append(
+            BoundingBoxSet(boxes,
+                           image_indices,
+                           images,
+                           class_indices,
+                           classes,
+                           confidences=confidences,
+                           img_sizes=img_sizes,
+                           bb_type=bb_type,
+                           format=BBFormat.XYWH))
+        if len(missing) > 0:
+            print('Warning: Confidence not found in the JSON file!')
+            break
+    if len(ret) == 0:
+        return BoundingBoxSet.empty(bb_type)
+    return BoundingBoxSet.concatenate(ret)
+
+
+def iter_coco2bbset(path, bb_type=BBType.GROUND_TRUTH, gt_path=None, chunk_size=None):
+    """ Load annotations in the coco format incrementally, yielding them in BoundingBoxSet objects
+    with the annotations of one image or of a chunk of images.
+
+    The files are parsed incrementally (see src.utils.json_stream), so only the annotations of
+    the current image or chunk and the tables of images and categories are kept in memory. Besides
+    coco files (with images, categories and annotations), coco results files (arrays of
+    annotations with image_id, category_id, bbox and score) are supported. Their images and
+    categories are read from the coco file of the ground truth `gt_path`.
+
+    The annotations of each image must be contiguous, as in the files written by the detectors,
+    so the sets can be evaluated incrementally (e.g. with CocoAccumulator or get_coco_state).
+
+    Parameters
+    ----------
+    path : str
+        Path of a json file or of a directory containing json files.
+    bb_type : Enum (optional)
+        Enum identifying if the bounding boxes are ground truths or detections.
+    gt_path : str (optional)
+        Path of the coco file with the images and categories of coco results files.
+    chunk_size : int (optional)
+        If None, a set is yielded for each image. Otherwise, each set has the annotations of
+        consecutive images, adding images until it reaches chunk_size bounding boxes.
+
+    Yields
+    ------
+    BoundingBoxSet
+        The bounding boxes of an image or of a chunk of images.
+    """
+    gt_tables = None if gt_path is None else _get_coco_tables(_load_json(gt_path))
+    pending = []
+    current_image = None
+    yielded_images = set()
+    for file_path in _get_annotation_files(path):
+        if not validations.is_json(file_path):
+            continue
+        (images, classes), annotations = _open_coco_annotations(file_path, gt_tables)
+        for annotation in annotations:
+            if bb_type == BBType.DETECTED and 'score' not in annotation:
+                print('Warning: Confidence not found in the JSON file!')
+                if len(pending) > 0:
+                    yield _pending2bbset(pending, bb_type)
+                return
+            img_name, img_size = images[annotation['image_id']]
+            if img_name != current_image:
+                if img_name in yielded_images:
+                    raise ValueError(
+                        f'The annotations of the image {img_name} are not contiguous in {path}.')
+                if len(pending) > 0 and (chunk_size is None or len(pending) >= chunk_size):
+                    yield _pending2bbset(pending, bb_type)
+                    pending = []
+                yielded_images.add(img_name)
+                current_image = img_name
+            pending.append((img_name, classes[annotation['category_id']], annotation['bbox'],
+                            annotation.get('score'), img_size))
+    if len(pending) > 0:
+        yield _pending2bbset(pending, bb_type)
+
+
+def _get_coco_tables(json_object):
+    """ names and sizes of the images and names of the categories of a coco object, by id """
+    images = {
+        i['id']: (general_utils.get_file_name_only(i['file_name']), (int(i['width']),
+                                                                    int(i['height'])))
+        for i in json_object['images']
+    }
+    classes = {c['id']: c['name'] for c in json_object.get('categories', [])}
+    return images, classes
+
+
+def _open_coco_annotations(file_path, gt_tables):
+    """ Get the tables of a coco file and an iterator over its annotations, parsed incrementally.
+    Results files (arrays of annotations) use the tables of the ground truth. """
+    items = json_stream.iter_json(file_path, stream_keys=['annotations'])
+    members = {}
+    for key, value in items:
+        if key is None:
+            if gt_tables is None:
+                raise IOError(f'The file {file_path} has coco results: the coco file with its '
+                              'images and categories (gt_path) must be informed.')
+            return gt_tables, itertools.chain([value], (v for _, v in items))
+        if key == 'annotations':
+            if 'images' in members and 'categories' in members:
+                return _get_coco_tables(members), itertools.chain(
+                    [value], (v for k, v in items if k == 'annotations'))
+            # the tables come after the annotations: get them and parse the file again
+            members.update((k, v) for k, v in items if k != 'annotations')
+            return _get_coco_tables(members), (v for k, v in json_stream.iter_json(
+                file_path, stream_keys=['annotations']) if k == 'annotations')
+        members[key] = value
+    # file without annotations
+    return ({}, {}), iter([])
+
+
+def _pending2bbset(pending, bb_type):
+    """ BoundingBoxSet with the (image, class, XYWH box, confidence, image size) tuples """
+    image_names, class_ids, boxes, confidences, img_sizes = zip(*pending)
+    return BoundingBoxSet.from_arrays(
+        np.array(boxes, dtype=np.float64).reshape(-1, 4),
+        image_names,
+        class_ids,
+        confidences=np.array(confidences, dtype=np.float64)
+        if bb_type == BBType.DETECTED else None,
+        img_sizes=img_sizes,
+        bb_type=bb_type,
+        format=BBFormat.XYWH)
+
+
+def cvat2bb(path, validation=None):
+    '''This format supports ground-truth only'''
+    ret = []
+    # Get annotation files in the path
+    annotation_files = _get_annotation_files(path)
+    validate = _get_validation_flags(annotation_files, validation)
+    # Loop through each file
+    for file_path, validated in zip(annotation_files, validate):
+        if validated and not validations.is_cvat_format(file_path):
+            continue
+        if not validated and not validations.is_xml(file_path):
+            continue
 
-                bb = BoundingBox(image_name=img_name,
-                                 class_id=box_info.attrib['label'],
-                                 coordinates=(x1, y1, x2, y2),
-                                 img_size=img_size,
-                                 type_coordinates=CoordinatesType.ABSOLUTE,
-                                 bb_type=BBType.GROUND_TRUTH,
-                                 format=BBFormat.XYX2Y2)
-                ret.append(bb)
+        with _loading(file_path, FileFormat.CVAT, validated):
+            # Loop through the images
+            for image_info in ET.parse(file_path).iter('image'):
+                img_size = (int(image_info.attrib['width']), int(image_info.attrib['height']))
+                img_name = image_info.attrib['name']
+                img_name = general_utils.get_file_name_only(img_name)
+
+                # Loop through the boxes
+                for box_info in image_info.iter('box'):
+                    x1, y1, x2, y2 = float(box_info.attrib['xtl']), float(
+                        box_info.attrib['ytl']), float(box_info.attrib['xbr']), float(
+                            box_info.attrib['ybr'])
+                    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+
+                    bb = BoundingBox(image_name=img_name,
+                                     class_id=box_info.attrib['label'],
+                                     coordinates=(x1, y1, x2, y2),
+                                     img_size=img_size,
+                                     type_coordinates=CoordinatesType.ABSOLUTE,
+                                     bb_type=BBType.GROUND_TRUTH,
+                                     format=BBFormat.XYX2Y2)
+                    ret.append(bb)
     return ret
 
 
-def openimage2bb(annotations_path, images_dir, bb_type=BBType.GROUND_TRUTH):
+# columns of the openimage csv files used by the converter
+_OPENIMAGE_COLUMNS = ['ImageID', 'LabelName', 'Confidence', 'XMin', 'YMin', 'XMax', 'YMax']
+_OPENIMAGE_DTYPES = {'ImageID': str, 'LabelName': str}
+
+
+def _parse_decimals(column):
+    """ Convert a column of numbers, which may be written with decimal commas, into floats. """
+    if column.dtype == object:
+        column = column.str.replace(',', '.', regex=False)
+    return column.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def openimage2bb(annotations_path, images_dir, bb_type=BBType.GROUND_TRUTH, validation=None):
+    return openimage2bbset(annotations_path, images_dir, bb_type, validation).to_bounding_boxes()
+
+
+def openimage2bbset(annotations_path, images_dir, bb_type=BBType.GROUND_TRUTH, validation=None):
+    """ Load annotations in the openimage format into a BoundingBoxSet.
+
+    Gives the same bounding boxes as openimage2bb. The columns of each csv file are converted at
+    once and the resolution of each image is obtained only once, however many boxes it has.
+
+    Parameters
+    ----------
+    annotations_path : str
+        Path of a csv file or of a directory containing csv files.
+    images_dir : str
+        Directory with the images, whose resolutions are needed to convert the relative
+        coordinates.
+    bb_type : Enum (optional)
+        Enum identifying if the bounding boxes are ground truths or detections.
+    validation : ValidationPolicy (optional)
+        Files validated before being loaded. By default, all files are validated.
+
+    Returns
+    -------
+    BoundingBoxSet
+        The loaded bounding boxes.
+    """
     ret = []
+    general_utils.refresh_image_index(images_dir)
     # Get annotation files in the path
     annotation_files = _get_annotation_files(annotations_path)
+    validate = _get_validation_flags(annotation_files, validation)
     # Loop through each file
-    for file_path in annotation_files:
-        if not validations.is_openimage_format(file_path):
+    for file_path, validated in zip(annotation_files, validate):
+        if validated and not validations.is_openimage_format(file_path):
             continue
-        images_shapes = {}
-        # Open csv
-        csv = pd.read_csv(file_path, sep=',')
-        for i, row in csv.iterrows():
-            # Get image resolution if it was not loaded yet
-            if row['ImageID'] not in images_shapes:
-                img_name = row['ImageID']
-                image_file = general_utils.find_file(images_dir, img_name)
-                images_shapes[image_file] = general_utils.get_image_resolution(image_file)
-            if images_shapes[image_file] is None:
+        if not validated and not validations.is_csv(file_path):
+            continue
+        with _loading(file_path, FileFormat.OPENIMAGE, validated):
+            csv = pd.read_csv(file_path,
+                              sep=',',
+                              usecols=_OPENIMAGE_COLUMNS,
+                              dtype=_OPENIMAGE_DTYPES)
+            coordinates = np.column_stack(
+                [_parse_decimals(csv[c]) for c in ['XMin', 'YMin', 'XMax', 'YMax']])
+            confidences = _parse_decimals(csv['Confidence'])
+        # Get the resolution of each image (the last row is kept for rows without image)
+        image_codes, image_ids = pd.factorize(csv['ImageID'])
+        image_sizes = np.full((len(image_ids) + 1, 2), -1, dtype=np.int64)
+        for i, img_name in enumerate(image_ids):
+            image_file = general_utils.find_file(images_dir, img_name)
+            resolution = general_utils.get_image_resolution(image_file)
+            if resolution is None:
                 print(f'Warning: It was not possible to find the resolution of image {img_name}')
                 continue
-            # Three is no bounding box for the given image
-            if pd.isna(row['LabelName']) or pd.isna(row['XMin']) or pd.isna(row['XMax']) or pd.isna(
-                    row['YMin']) or pd.isna(row['YMax']):
-                continue
-                # images_shapes[image_file] = general_utils.get_image_resolution(image_file)
-            img_size = (images_shapes[image_file]['width'], images_shapes[image_file]['height'])
-            x1, x2, y1, y2 = (row['XMin'], row['XMax'], row['YMin'], row['YMax'])
-            x1 = x1.replace(',', '.') if isinstance(x1, str) else x1
-            x2 = x2.replace(',', '.') if isinstance(x2, str) else x2
-            y1 = y1.replace(',', '.') if isinstance(y1, str) else y1
-            y2 = y2.replace(',', '.') if isinstance(y2, str) else y2
-            x1, x2, y1, y2 = float(x1), float(x2), float(y1), float(y2)
-            confidence = None if pd.isna(row['Confidence']) else float(row['Confidence'])
-            if bb_type == BBType.DETECTED and confidence is None:
-                print(f'Warning: Confidence value found in the CSV file for the image {img_name}')
-                return ret
-            bb = BoundingBox(image_name=general_utils.get_file_name_only(row['ImageID']),
-                             class_id=row['LabelName'],
-                             coordinates=(x1, y1, x2, y2),
-                             img_size=img_size,
-                             confidence=confidence,
-                             type_coordinates=CoordinatesType.RELATIVE,
-                             bb_type=bb_type,
-                             format=BBFormat.XYX2Y2)
-            ret.append(bb)
-    return ret
+            image_sizes[i] = resolution['width'], resolution['height']
+        img_sizes = image_sizes[image_codes]
+        # Ignore rows of images without resolution and rows without bounding box
+        valid = (img_sizes >= 0).all(axis=1) & csv['LabelName'].notna().to_numpy()
+        valid &= ~np.isnan(coordinates).any(axis=1)
+        # Detections are loaded until the first one without confidence
+        missing = []
+        if bb_type == BBType.DETECTED:
+            missing = np.flatnonzero(valid & np.isnan(confidences))
+            if len(missing) > 0:
+                valid[missing[0]:] = False
+        rows = np.flatnonzero(valid)
+        img_sizes = img_sizes[rows]
+        # Converting to absolute values (adding 0 turns rounded -0.0 into 0.0)
+        boxes = np.round(coordinates[rows] * np.concatenate([img_sizes, img_sizes], axis=1)) + 0.0
+        names = {}
+        image_names = np.array(
+            [names.setdefault(general_utils.get_file_name_only(i), len(names)) for i in image_ids],
+            dtype=np.int64)
+        images, image_indices = _first_appearance(image_names[image_codes[rows]], list(names))
+        class_indices, classes = pd.factorize(csv['LabelName'].to_numpy()[rows])
+        ret.append(
+            BoundingBoxSet(boxes,
+                           image_indices,
+                           images,
+                           class_indices,
+                           list(classes),
+                           confidences=confidences[rows],
+                           img_sizes=img_sizes,
+                           bb_type=bb_type,
+                           format=BBFormat.XYX2Y2,
+                           type_coordinates=CoordinatesType.RELATIVE))
+        if len(missing) > 0:
+            img_name = csv['ImageID'].iloc[missing[0]]
+            print(f'Warning: Confidence value found in the CSV file for the image {img_name}')
+            break
+    if len(ret) == 0:
+        return BoundingBoxSet.empty(bb_type)
+    return BoundingBoxSet.concatenate(ret)
+
+
+class _StopParsing(Exception):
+    """ Raised by a file parser to stop parsing the remaining files. The bounding boxes of the
+    previous files are returned, unless `discard` is True. """
+    def __init__(self, discard=False):
+        super().__init__(discard)
+        self.discard = discard
+
+
+def _parse_file(parse_file, file_path, validate):
+    return parse_file(file_path, validate=validate)
+
+
+def _parse_files(parse_file, annotation_files, workers=None, executor=None, validation=None):
+    """ Apply `parse_file` to each annotation file and concatenate the bounding boxes in the order
+    of the files.
+
+    By default, files are parsed serially. If `workers` or `executor` is given, they are parsed in
+    chunks by a pool of `workers` processes or by the executor (e.g. a ThreadPoolExecutor).
+    `parse_file` is told by its `validate` argument whether to validate each file, according to
+    the ValidationPolicy `validation`.
+    """
+    validate = _get_validation_flags(annotation_files, validation)
+    parse_file = partial(_parse_file, parse_file)
+    if executor is None and (workers is None or workers <= 1):
+        results = map(parse_file, annotation_files, validate)
+        return _concatenate_results(results)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # a few chunks per worker to balance the load
+        n_chunks = 4 * (workers or os.cpu_count() or 1)
+        chunk_size = max(1, int(math.ceil(len(annotation_files) / n_chunks)))
+        results = executor.map(parse_file, annotation_files, validate, chunksize=chunk_size)
+        return _concatenate_results(results)
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
 
 
-def imagenet2bb(annotations_path):
+def _concatenate_results(results):
     ret = []
+    try:
+        for bbs in results:
+            ret.extend(bbs)
+    except _StopParsing as e:
+        return [] if e.discard else ret
+    return ret
+
+
+def imagenet2bb(annotations_path, workers=None, executor=None):
     # Get annotation files in the path
     annotation_files = _get_annotation_files(annotations_path)
-    # Loop through each file
-    for file_path in annotation_files:
-        if not validations.is_imagenet_format(file_path):
-            continue
-        # Open XML
-        img_name = ET.parse(file_path).find('filename').text
-        img_name = general_utils.get_file_name_only(img_name)
-        img_width = int(ET.parse(file_path).find('size/width').text)
-        img_height = int(ET.parse(file_path).find('size/height').text)
-        img_size = (img_width, img_height)
-        # Loop through the detections
-        for box_info in ET.parse(file_path).iter('object'):
-            obj_class = box_info.find('name').text
-            x1 = int(float(box_info.find('bndbox/xmin').text))
-            y1 = int(float(box_info.find('bndbox/ymin').text))
-            x2 = int(float(box_info.find('bndbox/xmax').text))
-            y2 = int(float(box_info.find('bndbox/ymax').text))
-            bb = BoundingBox(image_name=img_name,
-                             class_id=obj_class,
-                             coordinates=(x1, y1, x2, y2),
-                             img_size=img_size,
-                             type_coordinates=CoordinatesType.ABSOLUTE,
-                             bb_type=BBType.GROUND_TRUTH,
-                             format=BBFormat.XYX2Y2)
-            ret.append(bb)
+    return _parse_files(_imagenet_file2bb, annotation_files, workers, executor)
+
+
+def _imagenet_file2bb(file_path, validate=True):
+    # the tags are verified in the parsed tree, so the file is always validated
+    ret = []
+    if not validations.is_xml(file_path):
+        return ret
+    # Parse the XML once to validate it and get the bounding boxes
+    root = validations.parse_xml(file_path)
+    if not validations.xml_root_contains_tags(root, validations.PASCAL_TAGS):
+        return ret
+    img_name = root.find('filename').text
+    img_name = general_utils.get_file_name_only(img_name)
+    img_width = int(root.find('size/width').text)
+    img_height = int(root.find('size/height').text)
+    img_size = (img_width, img_height)
+    # Loop through the detections
+    for box_info in root.iter('object'):
+        obj_class = box_info.find('name').text
+        x1 = int(float(box_info.find('bndbox/xmin').text))
+        y1 = int(float(box_info.find('bndbox/ymin').text))
+        x2 = int(float(box_info.find('bndbox/xmax').text))
+        y2 = int(float(box_info.find('bndbox/ymax').text))
+        bb = BoundingBox(image_name=img_name,
+                         class_id=obj_class,
+                         coordinates=(x1, y1, x2, y2),
+                         img_size=img_size,
+                         type_coordinates=CoordinatesType.ABSOLUTE,
+                         bb_type=BBType.GROUND_TRUTH,
+                         format=BBFormat.XYX2Y2)
+        ret.append(bb)
     return ret
 
 
-def vocpascal2bb(annotations_path):
-    return imagenet2bb(annotations_path)
+def vocpascal2bb(annotations_path, workers=None, executor=None):
+    return imagenet2bb(annotations_path, workers, executor)
 
 
-def labelme2bb(annotations_path):
-    ret = []
+def labelme2bb(annotations_path, workers=None, executor=None, validation=None):
     # Get annotation files in the path
     annotation_files = _get_annotation_files(annotations_path)
-    # Loop through each file
-    for file_path in annotation_files:
-        if not validations.is_labelme_format(file_path):
-            continue
-        # Parse the JSON file
-        with open(file_path, "r") as f:
-            json_object = json.load(f)
-        img_path = json_object['imagePath']
-        img_path = os.path.basename(img_path)
-        img_path = general_utils.get_file_name_only(img_path)
-        img_size = (int(json_object['imageWidth']), int(json_object['imageHeight']))
-        # If there are annotated objects
-        if 'shapes' in json_object:
-            # Loop through bounding boxes
-            for obj in json_object['shapes']:
-                obj_label = obj['label']
-                ((x1, y1), (x2, y2)) = obj['points']
-                # If there is no bounding box annotations, bb coordinates could have been set to None
-                if x1 is None and y1 is None and x2 is None and y2 is None:
-                    continue
-                x1, y1, x2, y2 = int(float(x1)), int(float(y1)), int(float(x2)), int(float(y2))
-
-                bb = BoundingBox(image_name=img_path,
-                                 class_id=obj_label,
-                                 coordinates=(x1, y1, x2, y2),
-                                 img_size=img_size,
-                                 confidence=None,
-                                 type_coordinates=CoordinatesType.ABSOLUTE,
-                                 bb_type=BBType.GROUND_TRUTH,
-                                 format=BBFormat.XYX2Y2)
-                ret.append(bb)
+    return _parse_files(_labelme_file2bb, annotation_files, workers, executor, validation)
+
+
+def _labelme_file2bb(file_path, validate=True):
+    if validate and not validations.is_labelme_format(file_path):
+        return []
+    if not validate and not validations.is_json(file_path):
+        return []
+    with _loading(file_path, FileFormat.LABEL_ME, validate):
+        return _load_labelme_file(file_path)
+
+
+def _load_labelme_file(file_path):
+    ret = []
+    # Parse the JSON file
+    with open(file_path, "r") as f:
+        json_object = json.load(f)
+    img_path = json_object['imagePath']
+    img_path = os.path.basename(img_path)
+    img_path = general_utils.get_file_name_only(img_path)
+    img_size = (int(json_object['imageWidth']), int(json_object['imageHeight']))
+    # If there are annotated objects
+    if 'shapes' in json_object:
+        # Loop through bounding boxes
+        for obj in json_object['shapes']:
+            obj_label = obj['label']
+            ((x1, y1), (x2, y2)) = obj['points']
+            # If there is no bounding box annotations, bb coordinates could have been set to None
+            if x1 is None and y1 is None and x2 is None and y2 is None:
+                continue
+            x1, y1, x2, y2 = int(float(x1)), int(float(y1)), int(float(x2)), int(float(y2))
+
+            bb = BoundingBox(image_name=img_path,
+                             class_id=obj_label,
+                             coordinates=(x1, y1, x2, y2),
+                             img_size=img_size,
+                             confidence=None,
+                             type_coordinates=CoordinatesType.ABSOLUTE,
+                             bb_type=BBType.GROUND_TRUTH,
+                             format=BBFormat.XYX2Y2)
+            ret.append(bb)
     return ret
 
 
@@ -237,78 +629,148 @@ def text2bb(annotations_path,
             bb_type=BBType.GROUND_TRUTH,
             bb_format=BBFormat.XYWH,
             type_coordinates=CoordinatesType.ABSOLUTE,
-            img_dir=None):
-    ret = []
-
+            img_dir=None,
+            workers=None,
+            executor=None,
+            validation=None):
+    general_utils.refresh_image_index(img_dir)
     # Get annotation files in the path
     annotation_files = _get_annotation_files(annotations_path)
-    for file_path in annotation_files:
-        if type_coordinates == CoordinatesType.ABSOLUTE:
-            if bb_type == BBType.GROUND_TRUTH and not validations.is_absolute_text_format(
-                    file_path, num_blocks=[5], blocks_abs_values=[4]):
-                continue
-            if bb_type == BBType.DETECTED and not validations.is_absolute_text_format(
-                    file_path, num_blocks=[6], blocks_abs_values=[4]):
-                continue
-        elif type_coordinates == CoordinatesType.RELATIVE:
-            if bb_type == BBType.GROUND_TRUTH and not validations.is_relative_text_format(
-                    file_path, num_blocks=[5], blocks_rel_values=[4]):
+    parse_file = partial(_text_file2bb,
+                         bb_type=bb_type,
+                         bb_format=bb_format,
+                         type_coordinates=type_coordinates,
+                         img_dir=img_dir)
+    return _parse_files(parse_file, annotation_files, workers, executor, validation)
+
+
+def iter_text2bbset(annotations_path,
+                    bb_type=BBType.GROUND_TRUTH,
+                    bb_format=BBFormat.XYWH,
+                    type_coordinates=CoordinatesType.ABSOLUTE,
+                    img_dir=None,
+                    chunk_size=None):
+    """ Load annotations in text files (one file per image, see text2bb) incrementally, yielding
+    them in BoundingBoxSet objects with the annotations of one image or of a chunk of images.
+
+    The files are read one at a time, each one whole: only the annotations of the current image
+    or chunk are kept in memory, so the sets can be evaluated incrementally (e.g. with
+    CocoAccumulator or get_coco_state). A single file is not split across sets.
+
+    Parameters
+    ----------
+    annotations_path : str
+        Path of a text file or of a directory containing text files.
+    bb_type, bb_format, type_coordinates, img_dir :
+        See text2bb.
+    chunk_size : int (optional)
+        If None, a set is yielded for each image. Otherwise, each set has the annotations of
+        consecutive images, adding images until it reaches chunk_size bounding boxes.
+
+    Yields
+    ------
+    BoundingBoxSet
+        The bounding boxes of an image or of a chunk of images.
+    """
+    general_utils.refresh_image_index(img_dir)
+    pending = []
+    for file_path in _get_annotation_files(annotations_path):
+        try:
+            bbs = _text_file2bb(file_path, bb_type, bb_format, type_coordinates, img_dir)
+        except _StopParsing:
+            break
+        pending.extend(bbs)
+        if len(pending) > 0 and (chunk_size is None or len(pending) >= chunk_size):
+            yield BoundingBoxSet.from_bounding_boxes(pending)
+            pending = []
+    if len(pending) > 0:
+        yield BoundingBoxSet.from_bounding_boxes(pending)
+
+
+def _text_file2bb(file_path, bb_type, bb_format, type_coordinates, img_dir, validate=True):
+    if not validate:
+        if not validations.is_text(file_path):
+            return []
+        with _loading(file_path, FileFormat.ABSOLUTE_TEXT, validate):
+            return _load_text_file(file_path, bb_type, bb_format, type_coordinates, img_dir)
+    ret = []
+    if type_coordinates == CoordinatesType.ABSOLUTE:
+        if bb_type == BBType.GROUND_TRUTH and not validations.is_absolute_text_format(
+                file_path, num_blocks=[5], blocks_abs_values=[4]):
+            return ret
+        if bb_type == BBType.DETECTED and not validations.is_absolute_text_format(
+                file_path, num_blocks=[6], blocks_abs_values=[4]):
+            return ret
+    elif type_coordinates == CoordinatesType.RELATIVE:
+        if bb_type == BBType.GROUND_TRUTH and not validations.is_relative_text_format(
+                file_path, num_blocks=[5], blocks_rel_values=[4]):
+            return ret
+        if bb_type == BBType.DETECTED and not validations.is_relative_text_format(
+                file_path, num_blocks=[6], blocks_rel_values=[4]):
+            return ret
+    return _load_text_file(file_path, bb_type, bb_format, type_coordinates, img_dir)
+
+
+def _load_text_file(file_path, bb_type, bb_format, type_coordinates, img_dir):
+    ret = []
+    # Loop through lines
+    with open(file_path, "r") as f:
+
+        img_filename = os.path.basename(file_path)
+        img_filename = os.path.splitext(img_filename)[0]
+
+        img_size = None
+        # If coordinates are relative, image size must be obtained in the img_dir
+        if type_coordinates == CoordinatesType.RELATIVE:
+            img_path = general_utils.find_file(img_dir, img_filename, match_extension=False)
+            if img_path is None or os.path.isfile(img_path) is False:
+                print(
+                    f'Warning: Image not found in the directory {img_path}. It is required to get its dimensions'
+                )
+                raise _StopParsing()
+            resolution = general_utils.get_image_resolution(img_path)
+            img_size = (resolution['width'], resolution['height'])
+        for line in f:
+            if line.replace(' ', '') == '\n':
                 continue
-            if bb_type == BBType.DETECTED and not validations.is_relative_text_format(
-                    file_path, num_blocks=[6], blocks_rel_values=[4]):
+            splitted_line = line.split(' ')
+            class_id = splitted_line[0]
+            if bb_type == BBType.GROUND_TRUTH:
+                confidence = None
+                x1 = float(splitted_line[1])
+                y1 = float(splitted_line[2])
+                w = float(splitted_line[3])
+                h = float(splitted_line[4])
+            elif bb_type == BBType.DETECTED:
+                confidence = float(splitted_line[1])
+                x1 = float(splitted_line[2])
+                y1 = float(splitted_line[3])
+                w = float(splitted_line[4])
+                h = float(splitted_line[5])
+            bb = BoundingBox(image_name=img_filename,
+                             class_id=class_id,
+                             coordinates=(x1, y1, w, h),
+                             img_size=img_size,
+                             confidence=confidence,
+                             type_coordinates=type_coordinates,
+                             bb_type=bb_type,
+                             format=bb_format)
+            # If the format is correct, x,y,w,h,x2,y2 must be positive
+            x, y, w, h = bb.get_absolute_bounding_box(format=BBFormat.XYWH)
+            _, _, x2, y2 = bb.get_absolute_bounding_box(format=BBFormat.XYX2Y2)
+            if x < 0 or y < 0 or w < 0 or h < 0 or x2 < 0 or y2 < 0:
                 continue
-        # Loop through lines
-        with open(file_path, "r") as f:
-
-            img_filename = os.path.basename(file_path)
-            img_filename = os.path.splitext(img_filename)[0]
-
-            img_size = None
-            # If coordinates are relative, image size must be obtained in the img_dir
-            if type_coordinates == CoordinatesType.RELATIVE:
-                img_path = general_utils.find_file(img_dir, img_filename, match_extension=False)
-                if img_path is None or os.path.isfile(img_path) is False:
-                    print(
-                        f'Warning: Image not found in the directory {img_path}. It is required to get its dimensions'
-                    )
-                    return ret
-                resolution = general_utils.get_image_resolution(img_path)
-                img_size = (resolution['width'], resolution['height'])
-            for line in f:
-                if line.replace(' ', '') == '\n':
-                    continue
-                splitted_line = line.split(' ')
-                class_id = splitted_line[0]
-                if bb_type == BBType.GROUND_TRUTH:
-                    confidence = None
-                    x1 = float(splitted_line[1])
-                    y1 = float(splitted_line[2])
-                    w = float(splitted_line[3])
-                    h = float(splitted_line[4])
-                elif bb_type == BBType.DETECTED:
-                    confidence = float(splitted_line[1])
-                    x1 = float(splitted_line[2])
-                    y1 = float(splitted_line[3])
-                    w = float(splitted_line[4])
-                    h = float(splitted_line[5])
-                bb = BoundingBox(image_name=img_filename,
-                                 class_id=class_id,
-                                 coordinates=(x1, y1, w, h),
-                                 img_size=img_size,
-                                 confidence=confidence,
-                                 type_coordinates=type_coordinates,
-                                 bb_type=bb_type,
-                                 format=bb_format)
-                # If the format is correct, x,y,w,h,x2,y2 must be positive
-                x, y, w, h = bb.get_absolute_bounding_box(format=BBFormat.XYWH)
-                _, _, x2, y2 = bb.get_absolute_bounding_box(format=BBFormat.XYX2Y2)
-                if x < 0 or y < 0 or w < 0 or h < 0 or x2 < 0 or y2 < 0:
-                    continue
-                ret.append(bb)
+            ret.append(bb)
     return ret
 
 
-def yolo2bb(annotations_path, images_dir, file_obj_names, bb_type=BBType.GROUND_TRUTH):
+def yolo2bb(annotations_path,
+            images_dir,
+            file_obj_names,
+            bb_type=BBType.GROUND_TRUTH,
+            workers=None,
+            executor=None,
+            validation=None):
     ret = []
     if not os.path.isfile(file_obj_names):
         print(f'Warning: File with names of classes {file_obj_names} not found.')
@@ -317,57 +779,72 @@ def yolo2bb(annotations_path, images_dir, file_obj_names, bb_type=BBType.GROUND_
     all_classes = []
     with open(file_obj_names, "r") as f:
         all_classes = [line.replace('\n', '') for line in f]
+    general_utils.refresh_image_index(images_dir)
     # Get annotation files in the path
     annotation_files = _get_annotation_files(annotations_path)
-    # Loop through each file
-    for file_path in annotation_files:
-        if not validations.is_yolo_format(file_path, bb_types=[bb_type]):
-            continue
-        img_name = os.path.basename(file_path)
-        img_file = general_utils.find_file(images_dir, img_name, match_extension=False)
-        img_resolution = general_utils.get_image_resolution(img_file)
-        if img_resolution is None:
-            print(f'Warning: It was not possible to find the resolution of image {img_name}')
-            continue
-        img_size = (img_resolution['width'], img_resolution['height'])
-        # Loop through lines
-        with open(file_path, "r") as f:
-            for line in f:
-                if line.replace(' ', '') == '\n':
-                    continue
-                splitted_line = line.split(' ')
-                class_id = splitted_line[0]
-                if not general_utils.is_str_int(class_id):
-                    print(
-                        f'Warning: Class id represented in the {file_path} is not a valid integer.')
-                    return []
-                class_id = int(class_id)
-                if class_id not in range(len(all_classes)):
-                    print(
-                        f'Warning: Class id represented in the {file_path} is not in the range of classes specified in the file {file_obj_names}.'
-                    )
-                    return []
-                if bb_type == BBType.GROUND_TRUTH:
-                    confidence = None
-                    x1 = float(splitted_line[1])
-                    y1 = float(splitted_line[2])
-                    w = float(splitted_line[3])
-                    h = float(splitted_line[4])
-                elif bb_type == BBType.DETECTED:
-                    confidence = float(splitted_line[1])
-                    x1 = float(splitted_line[2])
-                    y1 = float(splitted_line[3])
-                    w = float(splitted_line[4])
-                    h = float(splitted_line[5])
-                bb = BoundingBox(image_name=general_utils.get_file_name_only(img_file),
-                                 class_id=all_classes[class_id],
-                                 coordinates=(x1, y1, w, h),
-                                 img_size=img_size,
-                                 confidence=confidence,
-                                 type_coordinates=CoordinatesType.RELATIVE,
-                                 bb_type=bb_type,
-                                 format=BBFormat.YOLO)
-                ret.append(bb)
+    parse_file = partial(_yolo_file2bb,
+                         images_dir=images_dir,
+                         file_obj_names=file_obj_names,
+                         all_classes=all_classes,
+                         bb_type=bb_type)
+    return _parse_files(parse_file, annotation_files, workers, executor, validation)
+
+
+def _yolo_file2bb(file_path, images_dir, file_obj_names, all_classes, bb_type, validate=True):
+    if validate and not validations.is_yolo_format(file_path, bb_types=[bb_type]):
+        return []
+    if not validate and not validations.is_text(file_path):
+        return []
+    with _loading(file_path, FileFormat.YOLO, validate):
+        return _load_yolo_file(file_path, images_dir, file_obj_names, all_classes, bb_type)
+
+
+def _load_yolo_file(file_path, images_dir, file_obj_names, all_classes, bb_type):
+    ret = []
+    img_name = os.path.basename(file_path)
+    img_file = general_utils.find_file(images_dir, img_name, match_extension=False)
+    img_resolution = general_utils.get_image_resolution(img_file)
+    if img_resolution is None:
+        print(f'Warning: It was not possible to find the resolution of image {img_name}')
+        return ret
+    img_size = (img_resolution['width'], img_resolution['height'])
+    # Loop through lines
+    with open(file_path, "r") as f:
+        for line in f:
+            if line.replace(' ', '') == '\n':
+                continue
+            splitted_line = line.split(' ')
+            class_id = splitted_line[0]
+            if not general_utils.is_str_int(class_id):
+                print(f'Warning: Class id represented in the {file_path} is not a valid integer.')
+                raise _StopParsing(discard=True)
+            class_id = int(class_id)
+            if class_id not in range(len(all_classes)):
+                print(
+                    f'Warning: Class id represented in the {file_path} is not in the range of classes specified in the file {file_obj_names}.'
+                )
+                raise _StopParsing(discard=True)
+            if bb_type == BBType.GROUND_TRUTH:
+                confidence = None
+                x1 = float(splitted_line[1])
+                y1 = float(splitted_line[2])
+                w = float(splitted_line[3])
+                h = float(splitted_line[4])
+            elif bb_type == BBType.DETECTED:
+                confidence = float(splitted_line[1])
+                x1 = float(splitted_line[2])
+                y1 = float(splitted_line[3])
+                w = float(splitted_line[4])
+                h = float(splitted_line[5])
+            bb = BoundingBox(image_name=general_utils.get_file_name_only(img_file),
+                             class_id=all_classes[class_id],
+                             coordinates=(x1, y1, w, h),
+                             img_size=img_size,
+                             confidence=confidence,
+                             type_coordinates=CoordinatesType.RELATIVE,
+                             bb_type=bb_type,
+                             format=BBFormat.YOLO)
+            ret.append(bb)
     return ret
 
 
@@ -6,6 +6,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 from PyQt5 import QtCore, QtGui
 from src.utils.enumerators import BBFormat
+from src.utils.image_index import get_image_index
+from src.utils.image_size import ImageSizeCache, get_image_size_from_header
+
+# sizes of the images already resolved by get_image_resolution
+image_size_cache = ImageSizeCache()
 
 
 def get_classes_from_txt_file(filepath_classes_det):
@@ -183,30 +188,41 @@ def get_file_name_only(file_path):
     return os.path.splitext(os.path.basename(file_path))[0]
 
 
+def refresh_image_index(directory):
+    """ Rebuild the index of a directory used by find_file if files were added to or removed from
+    it since the index was built. Called once per conversion, not at each lookup. """
+    if directory is not None and os.path.isdir(directory):
+        get_image_index(directory, refresh=True)
+
+
 def find_file(directory, file_name, match_extension=True):
     if os.path.isdir(directory) is False:
         return None
-    for dirpath, dirnames, files in os.walk(directory):
-        for f in files:
-            f1 = os.path.basename(f)
-            f2 = file_name
-            if not match_extension:
-                f1 = os.path.splitext(f1)[0]
-                f2 = os.path.splitext(f2)[0]
-            if f1 == f2:
-                return os.path.join(dirpath, os.path.basename(f))
-    return None
-
-
-def get_image_resolution(image_file):
+    # the directory is traversed once and its index is reused by the following lookups
+    index = get_image_index(directory)
+    warning = index.pop_warning()
+    if warning is not None:
+        print(f'Warning: {warning}')
+    return index.find(file_name, match_extension)
+
+
+def get_image_resolution(image_file, cache=None):
     if image_file is None or not os.path.isfile(image_file):
         print(f'Warning: Path {image_file} not found.')
         return None
-    img = cv2.imread(image_file)
-    if img is None:
-        print(f'Warning: Error loading the image {image_file}.')
-        return None
-    h, w, _ = img.shape
+    # sizes are memoized and read from the file headers, decoding only unsupported formats
+    cache = image_size_cache if cache is None else cache
+    size = cache.get(image_file)
+    if size is None:
+        size = get_image_size_from_header(image_file)
+        if size is None:
+            img = cv2.imread(image_file)
+            if img is None:
+                print(f'Warning: Error loading the image {image_file}.')
+                return None
+            size = (img.shape[1], img.shape[0])
+        cache.set(image_file, size)
+    w, h = size
     return {'height': h, 'width': w}
 
 
@@ -0,0 +1,145 @@
+""" Index of the files of an image directory, built with a single traversal of the directory. """
+
+import os
+
+
+class ImageIndex:
+    """ Maps the names of the files of a directory (and its subdirectories), with or without their
+    extensions, to their paths.
+
+    Files are visited in the same order as os.walk, so a lookup returns the same file as a walk
+    through the directory stopping at the first match. Names shared by several files are
+    reported (see pop_warning), as only the first file with that name can be found.
+    """
+    def __init__(self, directory):
+        """ Constructor.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to be indexed.
+        """
+        self.directory = directory
+        # paths of the files, in the order of os.walk
+        self.files = []
+        # modification time of each indexed directory, used to detect changes
+        self._dir_mtimes = {}
+        self._scan(directory)
+        self._by_name = {}
+        self._by_stem = {}
+        for path in self.files:
+            name = os.path.basename(path)
+            self._by_name.setdefault(name, []).append(path)
+            self._by_stem.setdefault(os.path.splitext(name)[0], []).append(path)
+        # names (stems) shared by more than one file
+        self.duplicate_names = {k: v for k, v in self._by_name.items() if len(v) > 1}
+        self.duplicate_stems = {k: v for k, v in self._by_stem.items() if len(v) > 1}
+        self._warning = None
+        if len(self.duplicate_stems) > 0:
+            stem, paths = next(iter(self.duplicate_stems.items()))
+            self._warning = (f'{len(self.duplicate_stems)} file names (without extension) in '
+                             f'{directory} are shared by more than one file (e.g. \'{stem}\': '
+                             f'{paths}). The first file found is used.')
+
+    def __len__(self):
+        return len(self.files)
+
+    def _scan(self, directory):
+        """ visit files top-down, as os.walk does: first the files of a directory, then its
+        subdirectories """
+        try:
+            self._dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                subdirs.append(entry.path)
+            else:
+                self.files.append(entry.path)
+        for subdir in subdirs:
+            if not os.path.islink(subdir):
+                self._scan(subdir)
+
+    def pop_warning(self):
+        """ Get the warning about the names shared by several files, if any and if not already
+        taken, so that it is reported once for the index. """
+        warning, self._warning = self._warning, None
+        return warning
+
+    def find(self, file_name, match_extension=True):
+        """ Get the path of the first file with a given name.
+
+        Parameters
+        ----------
+        file_name : str
+            Name of the file.
+        match_extension : bool (optional)
+            If False, the extensions of file_name and of the indexed files are ignored.
+
+        Returns
+        -------
+        str
+            Path of the file, or None if not found.
+        """
+        if match_extension:
+            paths = self._by_name.get(file_name)
+        else:
+            paths = self._by_stem.get(os.path.splitext(file_name)[0])
+        return None if paths is None else paths[0]
+
+    def get_files(self, extensions=None):
+        """ Get the paths, relative to the directory, of the files with the given extensions
+        (all files by default). """
+        files = self.files
+        if extensions is not None:
+            extensions = tuple(e if e.startswith('.') else f'.{e}' for e in extensions)
+            files = [f for f in files if f.endswith(extensions)]
+        return [os.path.relpath(f, self.directory) for f in files]
+
+    def is_up_to_date(self):
+        """ Verify if no file was added to or removed from the indexed directories. """
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+
+_indexes = {}
+
+
+def get_image_index(directory, refresh=False):
+    """ Get the index of a directory, reusing the index built by a previous call.
+
+    Verifying that an index is up to date requires a stat of each indexed directory, so it is
+    only done when requested, e.g. once at the beginning of each conversion or evaluation,
+    rather than at each lookup.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to be indexed.
+    refresh : bool (optional)
+        If True, the index is rebuilt if files were added to or removed from the directory since
+        it was built.
+
+    Returns
+    -------
+    ImageIndex
+        The index of the directory.
+    """
+    key = os.path.abspath(directory)
+    index = _indexes.get(key)
+    if index is None or (refresh and not index.is_up_to_date()):
+        index = ImageIndex(directory)
+        _indexes[key] = index
+    return index
@@ -0,0 +1,198 @@
+""" Image sizes read from the headers of the files, without decoding the images.
+
+Supports JPEG (SOF markers, taking the EXIF orientation into account as cv2.imread does), PNG
+(IHDR chunk), BMP and WebP (VP8, VP8L and VP8X chunks). The sizes can be memoized in an
+ImageSizeCache, which can be saved to and loaded from a json file.
+"""
+
+import json
+import os
+import struct
+
+# JPEG start of frame markers (differential and hierarchical included), which contain the size
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without length
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+# EXIF orientations in which the image is rotated by 90 or 270 degrees
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def get_image_size_from_header(file_path):
+    """ Read the size of an image from the header of its file.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the image.
+
+    Returns
+    -------
+    tuple
+        (width, height) of the image, or None if the format is not supported or the header could
+        not be read.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(32)
+            if head[:8] == b'\x89PNG\r\n\x1a\n':
+                return _get_png_size(head)
+            if head[:2] == b'\xff\xd8':
+                f.seek(2)
+                return _get_jpeg_size(f)
+            if head[:2] == b'BM':
+                return _get_bmp_size(head)
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                return _get_webp_size(head)
+    except (OSError, struct.error, ValueError):
+        return None
+    return None
+
+
+def _get_png_size(head):
+    if head[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', head[16:24])
+
+
+def _get_bmp_size(head):
+    header_size = struct.unpack('<I', head[14:18])[0]
+    if header_size == 12:
+        width, height = struct.unpack('<HH', head[18:22])
+    else:
+        width, height = struct.unpack('<ii', head[18:26])
+    # negative heights represent top-down bitmaps
+    return width, abs(height)
+
+
+def _get_webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        if head[23:26] != b'\x9d\x01\x2a':
+            return None
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        if head[20] != 0x2F:
+            return None
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height
+    return None
+
+
+def _get_jpeg_size(f):
+    """ walk through the segments until a start of frame, reading the orientation on the way """
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if byte == b'':
+            return None
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        # fill bytes
+        while marker == b'\xff':
+            marker = f.read(1)
+        if marker == b'':
+            return None
+        marker = marker[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:  # end of image
+            return None
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            if orientation in _TRANSPOSED_ORIENTATIONS:
+                return height, width
+            return width, height
+        if marker == 0xE1:  # APP1, possibly with exif data
+            data = f.read(length - 2)
+            if data[:6] == b'Exif\x00\x00':
+                orientation = _get_exif_orientation(data[6:]) or orientation
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _get_exif_orientation(tiff):
+    """ orientation tag (0x0112) of the first IFD of the exif data, None if not found """
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    n_entries = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+    for i in range(n_entries):
+        entry = tiff[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        tag, type_, count = struct.unpack(endian + 'HHI', entry[:8])
+        if tag == 0x0112 and type_ == 3:
+            return struct.unpack(endian + 'H', entry[8:10])[0]
+    return None
+
+
+class ImageSizeCache:
+    """ Memo of image sizes, keyed by the absolute paths of the images.
+
+    A size is reused while its file keeps the same size (in bytes) and modification time. The
+    memo can be saved to a json file and loaded again in another session.
+    """
+    def __init__(self, file_path=None):
+        """ Constructor.
+
+        Parameters
+        ----------
+        file_path : str (optional)
+            Json file where the cache is saved. If it exists, its entries are loaded.
+        """
+        self.file_path = file_path
+        self._sizes = {}
+        # True if entries were set since the cache was saved
+        self.modified = False
+        if file_path is not None and os.path.isfile(file_path):
+            self.load(file_path)
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def get(self, image_file):
+        """ Get the memoized (width, height) of an image, None if unknown or if it changed. """
+        path = os.path.abspath(image_file)
+        entry = self._sizes.get(path)
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            return None
+        return entry[2], entry[3]
+
+    def set(self, image_file, size):
+        """ Memoize the (width, height) of an image. """
+        path = os.path.abspath(image_file)
+        stat = os.stat(path)
+        self._sizes[path] = (stat.st_size, stat.st_mtime_ns, int(size[0]), int(size[1]))
+        self.modified = True
+
+    def clear(self):
+        self._sizes = {}
+
+    def load(self, file_path):
+        """ Add the entries saved in a json file. """
+        with open(file_path, 'r') as f:
+            self._sizes.update({k: tuple(v) for k, v in json.load(f).items()})
+
+    def save(self, file_path=None):
+        """ Save the entries to a json file (by default, the one given in the constructor). """
+        file_path = file_path or self.file_path
+        if file_path is None:
+            raise ValueError('A file path is required to save the cache.')
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        tmp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._sizes, f)
+        os.replace(tmp_path, file_path)
+        self.modified = False
@@ -0,0 +1,126 @@
+""" Incremental parsing of json files.
+
+The file is read in chunks and decoded value by value with json.JSONDecoder.raw_decode, so the
+elements of a large array (e.g. the annotations of a coco file or a coco results file) can be
+processed one at a time, without loading the whole file in memory.
+"""
+
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# characters that may start a number and that may follow a value
+_NUMBER_START = '-0123456789'
+_DELIMITERS = ',]} \t\n\r'
+
+
+class _Reader:
+    """ Buffer over a text file, from which json values are decoded one at a time. """
+    def __init__(self, f, buffer_size):
+        self._f = f
+        self._buffer_size = buffer_size
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read(self, size):
+        """ append `size` characters to the buffer, dropping those already consumed """
+        chunk = self._f.read(size)
+        if chunk == '':
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """ next character after the whitespaces, '' at the end of the file """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read(self._buffer_size):
+                return ''
+
+    def consume(self, chars):
+        """ consume the next character, which must be one of `chars` """
+        char = self.peek()
+        if char == '' or char not in chars:
+            raise ValueError(f'Invalid json: expected one of {chars!r}, found {char!r}.')
+        self._pos += 1
+        return char
+
+    def decode(self):
+        """ decode the next value """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # a number is complete only if followed by a delimiter, otherwise it may continue
+                # in the next chunk (e.g. '1.' + '5' is decoded as 1 from the first chunk)
+                if self._eof or (end < len(self._buffer) and
+                                 (self._buffer[self._pos] not in _NUMBER_START
+                                  or self._buffer[end] in _DELIMITERS)):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # the buffer grows geometrically, so large values are decoded in linear time
+            self._read(max(self._buffer_size, len(self._buffer) - self._pos))
+
+
+def _iter_array(reader):
+    reader.consume('[')
+    if reader.peek() == ']':
+        reader.consume(']')
+        return
+    while True:
+        yield reader.decode()
+        if reader.consume(',]') == ']':
+            return
+
+
+def iter_json(file_path, stream_keys=(), buffer_size=1 << 20):
+    """ Parse a json file incrementally.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the json file.
+    stream_keys : sequence (optional)
+        Keys of the top-level object whose arrays are yielded element by element.
+    buffer_size : int (optional)
+        Number of characters read from the file at a time.
+
+    Yields
+    ------
+    tuple
+        If the top-level value is an array, (None, element) for each of its elements. If it is an
+        object, (key, value) for each of its members, except for the arrays of `stream_keys`, for
+        which (key, element) is yielded for each of their elements.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f, buffer_size)
+        char = reader.peek()
+        if char == '[':
+            for value in _iter_array(reader):
+                yield None, value
+            return
+        if char != '{':
+            yield None, reader.decode()
+            return
+        reader.consume('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.consume(':')
+            if key in stream_keys and reader.peek() == '[':
+                for value in _iter_array(reader):
+                    yield key, value
+            else:
+                yield key, reader.decode()
+            if reader.consume(',}') == '}':
+                return
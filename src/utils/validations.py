@@ -1,5 +1,7 @@
+import io
 import json
 import os
+import random
 import xml.etree.ElementTree as ET
 
 import pandas as pd
@@ -8,6 +10,12 @@ from src.utils.general_utils import get_files_recursively
 
 from .enumerators import BBFormat, BBType, FileFormat
 
+# optional faster xml parser
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 
 def validate_formats(arg_format, arg_name, errors):
     """ Verify if string format that represents the bounding box format is valid.
@@ -59,11 +67,47 @@ def xml_contains_tags(file_path, tags):
     bool
         True if XML file contains all tags, False otherwise.
     """
+    return xml_root_contains_tags(parse_xml(file_path), tags)
+
+
+def parse_xml(file_path):
+    """ Parse a xml file once, using lxml if it is installed.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file.
+
+    Returns
+    -------
+    Element
+        Root element of the file.
+    """
+    if lxml_etree is not None:
+        return lxml_etree.parse(file_path).getroot()
+    return ET.parse(file_path).getroot()
+
+
+def xml_root_contains_tags(root, tags):
+    """ Verify if an already parsed xml contains specific tags (see xml_contains_tags).
+
+    Parameters
+    ----------
+    root : Element
+        Root element of the xml.
+    tags : list
+        List containing strings representing the tags to be found.
+
+    Returns
+    -------
+    bool
+        True if the xml contains all tags, False otherwise.
+    """
     total_match = 0
     for tag in tags:
-        if ET.parse(file_path)._root.tag == tag:
+        if root.tag == tag:
             total_match += 1
-        elif ET.parse(file_path).find(tag) not in [[], None]:
+        elif root.find(tag) not in [[], None]:
             total_match += 1
     return total_match == len(tags)
 
@@ -111,6 +155,26 @@ def json_contains_tags(file_path, tags):
     """
     with open(file_path, "r") as f:
         json_object = json.load(f)
+    return json_object_contains_tags(json_object, tags)
+
+
+def json_object_contains_tags(json_object, tags):
+    """ Verify if an already parsed JSON contains all tags in a list (see json_contains_tags).
+
+    Parameters
+    ----------
+    json_object : dict
+        Parsed JSON.
+    tags : list
+        List containing strings representing the tags to be found.
+
+    Returns
+    -------
+    bool
+        True if the JSON contains all tags, False otherwise.
+    """
+    if not isinstance(json_object, dict):
+        return False
     all_keys = []
     for key, item in json_object.items():
         keys = get_all_keys(item)
@@ -143,7 +207,8 @@ def csv_contains_columns(file_path, columns, sep=','):
     bool
         True if the csv file contains all columns, False otherwise.
     """
-    csv = pd.read_csv(file_path, sep=sep)
+    # only the header is needed
+    csv = pd.read_csv(file_path, sep=sep, nrows=0)
     cols_1 = [col.lower() for col in list(csv.columns)]
     cols_2 = [col.lower() for col in columns]
     cols_1.sort()
@@ -216,6 +281,13 @@ def is_csv(file_path):
     return os.path.splitext(file_path)[-1].lower() == '.csv'
 
 
+# tags that the files of each format must contain
+PASCAL_TAGS = ['annotation', './size/width', './size/height']
+CVAT_TAGS = ['annotations', './image/box']
+LABELME_TAGS = ['imagePath', 'imageWidth', 'imageHeight']
+COCO_TAGS = ['annotations/bbox', 'annotations/image_id']
+
+
 def is_pascal_format(file_path):
     """ Verify if a given file path represents a file with annotations in pascal format.
 
@@ -229,8 +301,7 @@ def is_pascal_format(file_path):
     bool
         True if the file contains annotations in pascal format, False otherwise.
     """
-    return is_xml(file_path) and xml_contains_tags(file_path,
-                                                   ['annotation', './size/width', './size/height'])
+    return is_xml(file_path) and xml_contains_tags(file_path, PASCAL_TAGS)
 
 
 def is_imagenet_format(file_path):
@@ -263,7 +334,7 @@ def is_labelme_format(file_path, allow_empty_detections=True):
     bool
         True if the file contains annotations in labelme format, False otherwise.
     """
-    tags = ['imagePath', 'imageWidth', 'imageHeight']
+    tags = list(LABELME_TAGS)
     if not allow_empty_detections:
         tags.append('shapes/label')
         tags.append('shapes/points')
@@ -299,10 +370,7 @@ def is_coco_format(file_path):
     bool
         True if the file contains annotations in coco format, False otherwise.
     """
-    return is_json(file_path) and json_contains_tags(file_path, [
-        'annotations/bbox',
-        'annotations/image_id',
-    ])
+    return is_json(file_path) and json_contains_tags(file_path, COCO_TAGS)
 
 
 def is_cvat_format(file_path):
@@ -318,7 +386,7 @@ def is_cvat_format(file_path):
     bool
         True if the file contains annotations in cvat format, False otherwise.
     """
-    return is_xml(file_path) and xml_contains_tags(file_path, ['annotations', './image/box'])
+    return is_xml(file_path) and xml_contains_tags(file_path, CVAT_TAGS)
 
 
 def is_specific_text_format(file_path,
@@ -356,21 +424,15 @@ def is_absolute_text_format(file_path, num_blocks=[6, 5], blocks_abs_values=[4])
     """
     if not is_text(file_path):
         return False
-    if not is_empty_file(file_path):
-        return all_lines_have_blocks(file_path,
-                                     num_blocks=num_blocks) and all_blocks_have_absolute_values(
-                                         file_path, blocks_abs_values=blocks_abs_values)
-    return True
+    empty, have_blocks, absolute, _ = verify_text_lines(file_path, num_blocks, blocks_abs_values)
+    return empty or (have_blocks and absolute)
 
 
 def is_relative_text_format(file_path, num_blocks=[6, 5], blocks_rel_values=[4]):
     if not is_text(file_path):
         return False
-    if not is_empty_file(file_path):
-        return all_lines_have_blocks(file_path,
-                                     num_blocks=num_blocks) and all_blocks_have_relative_values(
-                                         file_path, blocks_rel_values=blocks_rel_values)
-    return True
+    empty, have_blocks, _, relative = verify_text_lines(file_path, num_blocks, blocks_rel_values)
+    return empty or (have_blocks and relative)
 
 
 def is_yolo_format(file_path, bb_types=[BBType.GROUND_TRUTH, BBType.DETECTED]):
@@ -396,9 +458,10 @@ def is_yolo_format(file_path, bb_types=[BBType.GROUND_TRUTH, BBType.DETECTED]):
             num_blocks.append(5)
         elif bb_type == BBType.DETECTED:
             num_blocks.append(6)
-    return is_text(file_path) and all_lines_have_blocks(
-        file_path, num_blocks=num_blocks) and all_blocks_have_relative_values(file_path,
-                                                                              blocks_rel_values=[4])
+    if not is_text(file_path):
+        return False
+    _, have_blocks, _, relative = verify_text_lines(file_path, num_blocks, [4])
+    return have_blocks and relative
 
 
 def is_openimage_format(file_path):
@@ -524,6 +587,69 @@ def all_blocks_have_relative_values(file_path, blocks_rel_values=[]):
     return True
 
 
+def verify_text_lines(file_path, num_blocks=[6, 5], blocks_values=[4]):
+    """ Read a text file once, verifying its lines as is_empty_file, all_lines_have_blocks,
+    all_blocks_have_absolute_values and all_blocks_have_relative_values do.
+
+    Reading stops as soon as the lines can not be in any text format (have_blocks is False or
+    both absolute and relative are False), so the other flags are only complete if they are not.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file.
+    num_blocks : list
+        List containing possible amounts of blocks.
+    blocks_values : list
+        List containing the blocks with absolute or relative values.
+
+    Returns
+    -------
+    tuple
+        Flags (empty, have_blocks, absolute, relative), indicating if the file has no
+        annotations, if all annotations have one of the amounts of blocks, and if all of them have
+        absolute or relative values in the blocks.
+    """
+    with open(file_path, 'r') as f:
+        return _verify_lines(f, num_blocks, blocks_values)
+
+
+def _verify_lines(lines, num_blocks=[6, 5], blocks_values=[4]):
+    empty, have_blocks, absolute, relative = True, True, True, True
+    for line in lines:
+        line = line.replace('\n', '').strip()
+        if line == '':
+            continue
+        empty = False
+        splitted = line.split(' ')
+        if len(splitted) not in num_blocks:
+            have_blocks = False
+        # as in the original verifications, the last block decides
+        line_absolute, line_relative = False, False
+        for block in blocks_values:
+            if len(splitted) < block:
+                line_absolute, line_relative = False, False
+                break
+            line_absolute, line_relative = _get_value_types(splitted, block)
+        absolute = absolute and line_absolute
+        relative = relative and line_relative
+        if not have_blocks or not (absolute or relative):
+            break
+    return empty, have_blocks, absolute, relative
+
+
+def _get_value_types(splitted, block):
+    """ if the value of a block is absolute (integer) and if it is relative (any number) """
+    try:
+        value = float(splitted[block])
+    except (IndexError, ValueError):
+        return False, False
+    try:
+        return value == int(value), True
+    except (OverflowError, ValueError):
+        return False, True
+
+
 def is_empty_file(file_path):
     """ Verify if an annotation file is not empty.
 
@@ -545,6 +671,103 @@ def is_empty_file(file_path):
     return True
 
 
+class ValidationPolicy:
+    """ Policy deciding which annotation files are validated by the converters before being
+    loaded.
+
+    - full: every file is validated and files not in the expected format are ignored.
+    - sample(n): only n files, chosen at random, are validated.
+    - none: no file is validated.
+
+    Files that are not validated are only checked by their extensions. If one of them can not be
+    loaded, the converter raises an AnnotationFileError instead of ignoring it. This suits trusted
+    pipelines, in which the validation would only read every file one more time.
+    """
+    def __init__(self, mode='full', n=None, seed=None):
+        """ Constructor.
+
+        Parameters
+        ----------
+        mode : str (optional)
+            'full', 'sample' or 'none'.
+        n : int (optional)
+            Number of files validated by the 'sample' mode.
+        seed : int (optional)
+            Seed of the random choice of the files validated by the 'sample' mode.
+        """
+        if mode not in ['full', 'sample', 'none']:
+            raise ValueError(f'Invalid validation mode {mode!r}: it must be either \'full\', '
+                             '\'sample\' or \'none\'.')
+        if mode == 'sample' and (n is None or n < 0):
+            raise ValueError('The number of files validated by the \'sample\' mode must be '
+                             'informed.')
+        self.mode = mode
+        self.n = n
+        self.seed = seed
+
+    @classmethod
+    def full(cls):
+        return cls('full')
+
+    @classmethod
+    def sample(cls, n, seed=None):
+        return cls('sample', n, seed)
+
+    @classmethod
+    def none(cls):
+        return cls('none')
+
+    def __repr__(self):
+        if self.mode == 'sample':
+            return f'ValidationPolicy.sample({self.n})'
+        return f'ValidationPolicy.{self.mode}()'
+
+    def select(self, files):
+        """ Choose the files to be validated.
+
+        Parameters
+        ----------
+        files : list
+            Paths of the annotation files.
+
+        Returns
+        -------
+        list
+            A flag for each file, True if the file must be validated.
+        """
+        if self.mode == 'full':
+            return [True] * len(files)
+        if self.mode == 'none':
+            return [False] * len(files)
+        chosen = set(random.Random(self.seed).sample(range(len(files)), min(self.n, len(files))))
+        return [i in chosen for i in range(len(files))]
+
+
+class AnnotationFileError(ValueError):
+    """ Raised by the converters when an annotation file can not be loaded. """
+    def __init__(self, file_path, file_format, reason):
+        """ Constructor.
+
+        Parameters
+        ----------
+        file_path : str
+            Path of the file.
+        file_format : enum (FileFormat)
+            Format in which the file was being loaded.
+        reason : Exception
+            Error raised while loading the file.
+        """
+        super().__init__(f'The file {file_path} could not be loaded in the {file_format.name} '
+                         f'format: {type(reason).__name__}: {reason}')
+        self.file_path = file_path
+        self.file_format = file_format
+        self.reason = reason
+
+    def __reduce__(self):
+        # allows the error to be sent back by the worker processes of the parallel converters
+        return (type(self), (self.file_path, self.file_format, self.reason))
+
+
 def verify_format(file_path, verification_format):
     """ Verify if a file contains annotations in a specific format.
 
@@ -591,9 +814,52 @@ def verify_format(file_path, verification_format):
     return False
 
 
+# number of bytes read to sniff the content of a file
+_SNIFF_SIZE = 8192
+
+
+def sniff_content(file_path):
+    """ Guess the type of content of a file from its first bytes.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file.
+
+    Returns
+    -------
+    str
+        'xml' or 'json' if the content starts as a xml or json document, 'binary' if it has null
+        bytes (images, archives, ...) and 'text' otherwise.
+    """
+    with open(file_path, 'rb') as f:
+        return _sniff_prefix(f.read(_SNIFF_SIZE))
+
+
+def _sniff_prefix(prefix):
+    # utf-16 texts have null bytes, but start with a byte order mark
+    if prefix[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        text = prefix.decode('utf-16', errors='ignore')
+    elif b'\x00' in prefix:
+        return 'binary'
+    else:
+        text = prefix.decode('utf-8', errors='ignore')
+    start = text.lstrip('\ufeff \t\r\n')[:1]
+    if start == '<':
+        return 'xml'
+    if start in ('{', '['):
+        return 'json'
+    return 'text'
+
+
 def get_format(file_path):
     """ Tries to anticipate the format of an annotation file.
 
+    The beginning of the file is sniffed first (see sniff_content), so files whose content does
+    not match their extension are discarded without being parsed. The file is then read only
+    once (not at all if it is smaller than the sniffed prefix), verifying the formats possible
+    for its extension.
+
     Parameters
     ----------
     file_path : str
@@ -607,29 +873,53 @@ def get_format(file_path):
     # Given a file path with annotations, get the format of the annotations
     if os.path.isfile(file_path) is False:
         return FileFormat.UNKNOWN
-
-    # PASCAL
-    if is_pascal_format(file_path):
-        return FileFormat.PASCAL
-
-    # Text file
-    if is_absolute_text_format(file_path):
-        return FileFormat.ABSOLUTE_TEXT
-
-    # Labelme format
-    if is_labelme_format(file_path):
-        return FileFormat.LABEL_ME
-
-    # COCO format
-    if is_coco_format(file_path):
-        return FileFormat.COCO
-
-    # CVAT format
-    if is_cvat_format(file_path):
-        return FileFormat.CVAT
-
-    # YOLO format
-    if is_yolo_format(file_path):
-        return FileFormat.YOLO
+    extension = os.path.splitext(file_path)[-1].lower()
+    if extension not in ['.xml', '.json', '.txt', '']:
+        return FileFormat.UNKNOWN
+    with open(file_path, 'rb') as f:
+        prefix = f.read(_SNIFF_SIZE)
+        # small files are verified from the prefix
+        source = io.BytesIO(prefix) if len(f.read(1)) == 0 else None
+    content = _sniff_prefix(prefix)
+
+    # PASCAL and CVAT formats
+    if extension == '.xml' and content == 'xml':
+        try:
+            root = parse_xml(source or file_path)
+        except SyntaxError:
+            return FileFormat.UNKNOWN
+        if xml_root_contains_tags(root, PASCAL_TAGS):
+            return FileFormat.PASCAL
+        if xml_root_contains_tags(root, CVAT_TAGS):
+            return FileFormat.CVAT
+
+    # Text files (absolute values or YOLO format)
+    elif extension in ['.txt', ''] and content != 'binary':
+        try:
+            if source is None:
+                empty, have_blocks, absolute, relative = verify_text_lines(file_path)
+            else:
+                empty, have_blocks, absolute, relative = _verify_lines(io.TextIOWrapper(source))
+        except UnicodeDecodeError:
+            return FileFormat.UNKNOWN
+        if empty or (have_blocks and absolute):
+            return FileFormat.ABSOLUTE_TEXT
+        if have_blocks and relative:
+            return FileFormat.YOLO
+
+    # Labelme and COCO formats
+    elif extension == '.json' and content == 'json':
+        try:
+            if source is None:
+                with open(file_path, 'r') as f:
+                    json_object = json.load(f)
+            else:
+                json_object = json.load(io.TextIOWrapper(source))
+        except ValueError:
+            return FileFormat.UNKNOWN
+        if json_object_contains_tags(json_object, LABELME_TAGS):
+            return FileFormat.LABEL_ME
+        if json_object_contains_tags(json_object, COCO_TAGS):
+            return FileFormat.COCO
 
     return FileFormat.UNKNOWN
@@ -0,0 +1,54 @@
+from math import isclose
+
+import src.utils.converter as converter
+from src.bounding_box_set import BoundingBoxSet
+from src.evaluators.coco_evaluator import get_coco_summary
+from src.evaluators.pascal_voc_evaluator import get_pascalvoc_metrics
+from src.utils.enumerators import BBFormat, BBType, CoordinatesType
+
+
+def test_round_trip():
+    gts = converter.vocpascal2bb('toyexample/gts_vocpascal_format')
+    dets = converter.text2bb('toyexample/dets_classname_rel_xcycwh',
+                             bb_type=BBType.DETECTED,
+                             bb_format=BBFormat.YOLO,
+                             type_coordinates=CoordinatesType.RELATIVE,
+                             img_dir='toyexample/images')
+    for bbs in [gts, dets]:
+        bb_set = BoundingBoxSet.from_bounding_boxes(bbs)
+        assert len(bb_set) == len(bbs)
+        for a, b in zip(bbs, bb_set.to_bounding_boxes()):
+            assert a == b
+            assert a.get_confidence() == b.get_confidence()
+            assert a.get_image_size() == b.get_image_size()
+            assert a.get_coordinates_type() == b.get_coordinates_type()
+            assert a.get_format() == b.get_format()
+
+
+def test_subsets_and_concatenation():
+    gts = converter.vocpascal2bb('toyexample/gts_vocpascal_format')
+    bb_set = BoundingBoxSet.from_bounding_boxes(gts)
+    cats = bb_set.filter_class('cat')
+    assert cats.get_classes() is bb_set.get_classes()
+    assert [bb for bb in gts if bb.get_class_id() == 'cat'] == list(cats)
+    merged = BoundingBoxSet.concatenate([bb_set[:5], bb_set[5:]])
+    assert list(merged) == gts
+    groups = bb_set.group_by_image_and_class()
+    assert sum(len(idx) for idx in groups.values()) == len(gts)
+
+
+def test_evaluators_accept_sets():
+    gts = converter.coco2bb('tests/test_coco_eval/gts', BBType.GROUND_TRUTH)
+    dets = converter.coco2bb('tests/test_coco_eval/dets', BBType.DETECTED)
+    gt_set = BoundingBoxSet.from_bounding_boxes(gts)
+    det_set = BoundingBoxSet.from_bounding_boxes(dets)
+
+    res_list = get_coco_summary(gts, dets)
+    res_set = get_coco_summary(gt_set, det_set)
+    assert res_list.keys() == res_set.keys()
+    for k in res_list:
+        assert isclose(res_list[k], res_set[k])
+
+    res_list = get_pascalvoc_metrics(gts, dets, iou_threshold=0.5)
+    res_set = get_pascalvoc_metrics(gt_set, det_set, iou_threshold=0.5)
+    assert res_list['mAP'] == res_set['mAP']
@@ -1,9 +1,18 @@
+import json
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
+import cv2
+import numpy as np
+import pytest
 import src.utils.converter as converter
 import src.utils.general_utils as general_utils
+import src.utils.json_stream as json_stream
 import src.utils.validations as validations
+from src.utils.annotation_cache import AnnotationCache
 from src.utils.enumerators import BBFormat, BBType, CoordinatesType
+from src.utils.image_index import get_image_index
 
 
 def test_converters_gts():
@@ -220,3 +229,225 @@ def test_toy_example_gts():
 
     for coco_bb, pascal_bb in zip(coco_bbs, pascal_bbs):
         assert coco_bb == pascal_bb
+
+
+def test_coco2bbset():
+    for path, bb_type in [('data/database/gts/coco_format_v1', BBType.GROUND_TRUTH),
+                          ('data/database/gts/coco_format_v2', BBType.GROUND_TRUTH),
+                          ('tests/test_coco_eval/dets', BBType.DETECTED)]:
+        bbs = converter.coco2bb(path, bb_type)
+        bb_set = converter.coco2bbset(path, bb_type)
+        assert len(bb_set) == len(bbs)
+        for a, b in zip(bbs, bb_set):
+            assert a == b
+            assert a.get_confidence() == b.get_confidence()
+            assert a.get_image_size() == b.get_image_size()
+
+
+def test_openimage2bbset(tmp_path):
+    cv2.imwrite(str(tmp_path / 'a.jpg'), np.zeros((200, 100, 3), dtype=np.uint8))
+    csv_file = str(tmp_path / 'dets.csv')
+    with open(csv_file, 'w') as f:
+        f.write('ImageID,Source,LabelName,Confidence,XMin,XMax,YMin,YMax,IsOccluded,IsTruncated,'
+                'IsGroupOf,IsDepiction,IsInside\n'
+                'a.jpg,,cat,"0,9","0,1",0.5,"0,2","0,25",,,,,\n'
+                'missing.jpg,,cat,0.8,0.1,0.5,0.2,0.25,,,,,\n'
+                'a.jpg,,,0.7,0.1,0.5,0.2,0.25,,,,,\n'
+                'a.jpg,,dog,0.6,"0,0",1,0.5,1,,,,,\n'
+                'a.jpg,,dog,,0.1,0.5,0.2,0.25,,,,,\n'
+                'a.jpg,,dog,0.4,0.1,0.5,0.2,0.25,,,,,\n')
+    bb_set = converter.openimage2bbset(csv_file, str(tmp_path), BBType.DETECTED)
+    # rows without image or class are ignored, and detections are loaded until the first
+    # detection without confidence
+    assert bb_set.get_class_ids().tolist() == ['cat', 'dog']
+    assert bb_set.get_image_names().tolist() == ['a', 'a']
+    assert bb_set.get_confidences().tolist() == [0.9, 0.6]
+    assert bb_set.get_boxes().tolist() == [[10, 40, 50, 50], [0, 100, 100, 200]]
+    assert bb_set.get_img_sizes().tolist() == [[100, 200], [100, 200]]
+    bbs = converter.openimage2bb(csv_file, str(tmp_path), BBType.DETECTED)
+    assert [bb.get_coordinates_type() for bb in bbs] == [CoordinatesType.RELATIVE] * 2
+
+
+def test_annotation_cache(tmp_path):
+    gts_dir = str(tmp_path / 'gts')
+    shutil.copytree('toyexample/gts_vocpascal_format', gts_dir)
+    calls = []
+
+    def parse(path):
+        calls.append(path)
+        return converter.vocpascal2bb(path)
+
+    cache = AnnotationCache(str(tmp_path / 'cache'))
+    expected = converter.vocpascal2bb(gts_dir)
+    assert cache.load(parse, gts_dir).to_bounding_boxes() == expected
+    # unchanged and touched files are read from the cache
+    assert cache.load(parse, gts_dir).to_bounding_boxes() == expected
+    xml_file = os.path.join(gts_dir, sorted(os.listdir(gts_dir))[0])
+    os.utime(xml_file, ns=(0, 0))
+    assert cache.load(parse, gts_dir).to_bounding_boxes() == expected
+    assert len(calls) == 1
+    # modified files are parsed again
+    with open(xml_file, 'a') as f:
+        f.write('\n')
+    assert cache.load(parse, gts_dir).to_bounding_boxes() == expected
+    assert len(calls) == 2
+    # corrupt entries are parsed again
+    for entry in os.listdir(tmp_path / 'cache'):
+        with open(tmp_path / 'cache' / entry, 'r+b') as f:
+            f.truncate(10)
+    assert cache.load(parse, gts_dir).to_bounding_boxes() == expected
+    assert len(calls) == 3
+    # the contents of other directories passed to the converter are not read
+    images_dir = tmp_path / 'images'
+    images_dir.mkdir()
+    (images_dir / 'image.jpg').write_bytes(b'')
+    cache.load(lambda path, images_dir: parse(path), gts_dir, str(images_dir))
+    os.utime(images_dir / 'image.jpg', ns=(0, 0))
+    cache.load(lambda path, images_dir: parse(path), gts_dir, str(images_dir))
+    assert len(calls) == 4
+    # least recently used entries are removed
+    cache.max_size = 0
+    cache.load(parse, os.path.join(gts_dir, sorted(os.listdir(gts_dir))[1]))
+    assert len(os.listdir(tmp_path / 'cache')) == 0
+
+
+def test_parallel_converters():
+    gts_dir = 'data/database/gts/imagenet_format/Annotations'
+    gts = converter.imagenet2bb(gts_dir)
+    assert converter.imagenet2bb(gts_dir, workers=2) == gts
+    dets_dir = 'toyexample/dets_classname_rel_xcycwh'
+    kwargs = dict(bb_type=BBType.DETECTED,
+                  bb_format=BBFormat.YOLO,
+                  type_coordinates=CoordinatesType.RELATIVE,
+                  img_dir='toyexample/images')
+    with ThreadPoolExecutor(2) as executor:
+        assert converter.text2bb(dets_dir, **kwargs,
+                                 executor=executor) == converter.text2bb(dets_dir, **kwargs)
+
+
+def test_validation_policy(tmp_path):
+    files = [f'{i}.txt' for i in range(10)]
+    assert validations.ValidationPolicy.full().select(files) == [True] * 10
+    assert validations.ValidationPolicy.none().select(files) == [False] * 10
+    assert sum(validations.ValidationPolicy.sample(3, seed=0).select(files)) == 3
+    with pytest.raises(ValueError):
+        validations.ValidationPolicy('partial')
+
+    # Files in the expected format are loaded in the same way, validated or not
+    gts_dir = 'data/database/gts'
+    images_dir = 'data/database/images'
+    for policy in [validations.ValidationPolicy.none(), validations.ValidationPolicy.sample(2)]:
+        for load in [
+                lambda v: converter.coco2bb(os.path.join(gts_dir, 'coco_format_v1'), validation=v),
+                lambda v: converter.cvat2bb(os.path.join(gts_dir, 'cvat_format'), validation=v),
+                lambda v: converter.labelme2bb(os.path.join(gts_dir, 'labelme_format'),
+                                               validation=v),
+                lambda v: converter.openimage2bb(os.path.join(gts_dir, 'openimages_format'),
+                                                 images_dir,
+                                                 validation=v),
+                lambda v: converter.yolo2bb(os.path.join(gts_dir, 'yolo_format/obj_train_data'),
+                                            images_dir,
+                                            os.path.join(gts_dir, 'yolo_format/obj.names'),
+                                            validation=v),
+                lambda v: converter.text2bb('toyexample/dets_classname_abs_xywh',
+                                            bb_type=BBType.DETECTED,
+                                            validation=v),
+        ]:
+            assert load(policy) == load(None)
+
+    # A file in another format is ignored if validated, and reported if not
+    shutil.copy('toyexample/dets_classname_abs_xywh/2007_000549.txt', tmp_path)
+    with open(tmp_path / 'bad.txt', 'w') as f:
+        f.write('person 0.9 10 20\n')
+    kwargs = dict(bb_type=BBType.DETECTED, workers=2)
+    assert converter.text2bb(str(tmp_path), **kwargs) == converter.text2bb(
+        'toyexample/dets_classname_abs_xywh/2007_000549.txt', **kwargs)
+    with pytest.raises(validations.AnnotationFileError) as e:
+        converter.text2bb(str(tmp_path), **kwargs, validation=validations.ValidationPolicy.none())
+    assert e.value.file_path == str(tmp_path / 'bad.txt')
+    assert isinstance(e.value.reason, IndexError)
+
+
+def test_image_index(tmp_path, capsys):
+    for f in ['a.jpg', 'b.png', 'sub/a.png', 'sub/c.jpg', 'sub/deeper/b.png', 'other/d.bmp']:
+        os.makedirs(os.path.dirname(tmp_path / f), exist_ok=True)
+        open(tmp_path / f, 'w').close()
+    directory = str(tmp_path)
+    index = get_image_index(directory)
+    assert len(index) == 6
+    assert get_image_index(directory) is index
+    # lookups return the first file found by os.walk
+    for file_name in ['a.jpg', 'a.png', 'b.png', 'c.jpg', 'c.png', 'd.bmp', 'e.jpg']:
+        for match_extension in [True, False]:
+            expected = None
+            for dirpath, _, files in os.walk(directory):
+                name = file_name if match_extension else os.path.splitext(file_name)[0]
+                found = [
+                    f for f in files
+                    if (f if match_extension else os.path.splitext(f)[0]) == name
+                ]
+                if len(found) > 0:
+                    expected = os.path.join(dirpath, found[0])
+                    break
+            assert index.find(file_name, match_extension) == expected
+            assert general_utils.find_file(directory, file_name, match_extension) == expected
+    assert sorted(index.duplicate_stems) == ['a', 'b']
+    assert list(index.duplicate_names) == ['b.png']
+    assert sorted(index.get_files(['jpg'])) == ['a.jpg', os.path.join('sub', 'c.jpg')]
+    # the duplicates were reported by the first lookup of find_file, and only then
+    assert capsys.readouterr().out.count('Warning:') == 1
+    assert index.pop_warning() is None
+    # the index is only verified, and rebuilt if files were added, when refreshed
+    open(tmp_path / 'sub' / 'e.jpg', 'w').close()
+    assert get_image_index(directory) is index
+    assert get_image_index(directory, refresh=True) is not index
+    assert general_utils.find_file(directory, 'e.jpg') == os.path.join(directory, 'sub', 'e.jpg')
+    index = get_image_index(directory)
+    assert get_image_index(directory, refresh=True) is index
+
+
+def test_streaming_readers(tmp_path):
+    # incremental parsing, with chunks smaller than the values
+    json_file = 'tests/test_coco_eval/dets/sampled_bbox_results.json'
+    with open(json_file) as f:
+        json_object = json.load(f)
+    items = list(json_stream.iter_json(json_file, stream_keys=['annotations'], buffer_size=7))
+    assert [v for k, v in items if k == 'annotations'] == json_object['annotations']
+    assert {k: v for k, v in items if k != 'annotations'} == {
+        k: v
+        for k, v in json_object.items() if k != 'annotations'
+    }
+
+    for path, bb_type in [('tests/test_coco_eval/dets', BBType.DETECTED),
+                          ('data/database/gts/coco_format_v1', BBType.GROUND_TRUTH),
+                          ('toyexample/dets_coco_format', BBType.DETECTED)]:
+        bbs = converter.coco2bb(path, bb_type)
+        for chunk_size in [None, 50]:
+            bb_sets = list(converter.iter_coco2bbset(path, bb_type, chunk_size=chunk_size))
+            if chunk_size is None:
+                # one set per image
+                assert all(len(bb_set.get_images()) == 1 for bb_set in bb_sets)
+            assert [bb for bb_set in bb_sets for bb in bb_set] == bbs
+    # numbers split at every position between two chunks
+    for text in ['[1.5e-3, -20, 0.125]', '{"a": 12.5, "b": [-7e+2]}', '12.5']:
+        json_file = tmp_path / 'numbers.json'
+        json_file.write_text(text)
+        value = json.loads(text)
+        if isinstance(value, dict):
+            expected = [('a', 12.5), ('b', -700.0)]
+            stream_keys = ['b']
+        else:
+            expected = [(None, v) for v in value] if isinstance(value, list) else [(None, value)]
+            stream_keys = ()
+        for buffer_size in range(1, len(text) + 1):
+            assert list(json_stream.iter_json(json_file, stream_keys,
+                                              buffer_size=buffer_size)) == expected
+    # the annotations of an image must be contiguous
+    with pytest.raises(ValueError):
+        list(converter.iter_coco2bbset('tests/test_coco_eval/gts'))
+
+    path = 'toyexample/dets_classname_abs_xywh'
+    bbs = converter.text2bb(path, bb_type=BBType.DETECTED)
+    bb_sets = list(converter.iter_text2bbset(path, bb_type=BBType.DETECTED, chunk_size=10))
+    assert all(len(bb_set) >= 10 for bb_set in bb_sets[:-1])
+    assert [bb for bb_set in bb_sets for bb in bb_set] == bbs
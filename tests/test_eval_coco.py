@@ -1,9 +1,11 @@
 import json
 from math import isclose
 
+import numpy as np
 from src.bounding_box import BBFormat, BBType, BoundingBox
-from src.evaluators.coco_evaluator import get_coco_summary
-from src.utils.converter import coco2bb
+from src.evaluators.coco_evaluator import (CocoAccumulator, _jaccard, get_coco_state,
+                                         get_coco_summary, merge_coco_states, pairwise_iou)
+from src.utils.converter import coco2bb, iter_coco2bbset
 
 # Load coco samples
 gts = coco2bb('tests/test_coco_eval/gts', BBType.GROUND_TRUTH)
@@ -26,3 +28,73 @@ assert abs(res["AR100"] - 0.595353) < tol
 assert abs(res["ARsmall"] - 0.654764) < tol
 assert abs(res["ARmedium"] - 0.603130) < tol
 assert abs(res["ARlarge"] - 0.553744) < tol
+
+
+def test_pairwise_iou():
+    rng = np.random.RandomState(0)
+    xy = rng.uniform(0, 100, size=(60, 2))
+    boxes = np.concatenate([xy, xy + rng.uniform(0.5, 50, size=(60, 2))], axis=1)
+    dt, gt = boxes[:40], boxes[20:]
+
+    ious = pairwise_iou(dt, gt)
+    assert ious.shape == (len(dt), len(gt))
+    for d_idx, d in enumerate(dt.tolist()):
+        for g_idx, g in enumerate(gt.tolist()):
+            assert ious[d_idx, g_idx] == _jaccard(d, g)
+
+
+def test_parallel_summary():
+    res_parallel = get_coco_summary(gts, dts, workers=2)
+    for k in res:
+        assert np.array_equal(res[k], res_parallel[k], equal_nan=True)
+
+
+def test_accumulator():
+    # add the images in the order they appear in the detections
+    images = list(dict.fromkeys([bb.get_image_name() for bb in dts + gts]))
+    accumulator = CocoAccumulator()
+    for img in images:
+        accumulator.add_image(img, [bb for bb in gts if bb.get_image_name() == img],
+                              [bb for bb in dts if bb.get_image_name() == img])
+    assert len(accumulator) == len(images)
+    res_accumulated = accumulator.summarize()
+    for k in res:
+        assert np.array_equal(res[k], res_accumulated[k], equal_nan=True)
+
+
+def test_merge_states():
+    # split the images in contiguous shards, in the order they appear in the detections
+    images = list(dict.fromkeys([bb.get_image_name() for bb in dts + gts]))
+    states = []
+    for shard in np.array_split(np.arange(len(images)), 3):
+        shard_images = {images[i] for i in shard}
+        states.append(
+            get_coco_state([bb for bb in gts if bb.get_image_name() in shard_images],
+                           [bb for bb in dts if bb.get_image_name() in shard_images]))
+    res_merged = merge_coco_states(states)
+    for k in res:
+        assert np.array_equal(res[k], res_merged[k], equal_nan=True)
+
+
+def test_streamed_detections(tmp_path):
+    # detections read in chunks of whole images, evaluated with the ground truths of their images
+    dets_file = 'tests/test_coco_eval/dets/sampled_bbox_results.json'
+    with open(dets_file) as f:
+        results = json.load(f)['annotations']
+    results_file = str(tmp_path / 'results.json')
+    with open(results_file, 'w') as f:
+        json.dump(results, f)
+    for path, gt_path in [(dets_file, None), (results_file, dets_file)]:
+        states = []
+        streamed_images = set()
+        for dets in iter_coco2bbset(path, BBType.DETECTED, gt_path=gt_path, chunk_size=100):
+            chunk_images = set(dets.get_images())
+            streamed_images.update(chunk_images)
+            states.append(
+                get_coco_state([bb for bb in gts if bb.get_image_name() in chunk_images], dets))
+        # images without detections
+        states.append(
+            get_coco_state([bb for bb in gts if bb.get_image_name() not in streamed_images], []))
+        res_streamed = merge_coco_states(states)
+        for k in res:
+            assert np.array_equal(res[k], res_streamed[k], equal_nan=True)
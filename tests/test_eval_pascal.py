@@ -4,8 +4,13 @@
 
 from math import isclose
 
+import numpy as np
+import pandas as pd
+import pytest
 import src.utils.converter as converter
-from src.evaluators.pascal_voc_evaluator import get_pascalvoc_metrics
+from src.evaluators.pascal_voc_evaluator import (calculate_ap_11_point_interp,
+                                                 calculate_ap_every_point, get_pascalvoc_metrics,
+                                                 get_pascalvoc_state, merge_pascalvoc_states)
 from src.utils.enumerators import BBType, MethodAveragePrecision
 
 
@@ -38,3 +43,96 @@ def test_case_1():
         results = results_dict['per_class']
         for c, res in results.items():
             assert isclose(expected_APs[c][iou], res['AP'])
+
+
+def test_ap_interpolations():
+    rec = np.array([0.2, 0.2, 0.5, 0.5, 1.0])
+    prec = np.array([1, 0.5, 0.66, 0.5, 0.6])
+    ap, mpre, mrec, ii = calculate_ap_every_point(rec, prec)
+    assert isclose(ap, 0.698)
+    assert mpre == [1.0, 1.0, 0.66, 0.66, 0.6, 0.6]
+    assert mrec == [0, 0.2, 0.2, 0.5, 0.5, 1.0]
+    assert ii == [1, 3, 5]
+    ap, mpre, mrec, _ = calculate_ap_11_point_interp(rec, prec)
+    assert isclose(ap, (5 * 0.6 + 3 * 0.66 + 3 * 1.0) / 11)
+    assert calculate_ap_every_point(np.zeros(0), np.zeros(0))[0] == 0
+    assert calculate_ap_11_point_interp(np.zeros(0), np.zeros(0))[0] == 0
+
+
+def test_merge_states():
+    gts = converter.text2bb('tests/test_case_1/gts', BBType.GROUND_TRUTH)
+    dets = converter.text2bb('tests/test_case_1/dets', BBType.DETECTED)
+    images = list(dict.fromkeys([bb.get_image_name() for bb in dets + gts]))
+    shards = [set(images[:len(images) // 2]), set(images[len(images) // 2:])]
+    states = [
+        get_pascalvoc_state([bb for bb in gts if bb.get_image_name() in shard],
+                            [bb for bb in dets if bb.get_image_name() in shard],
+                            iou_threshold=0.3) for shard in shards
+    ]
+    merged = merge_pascalvoc_states(states)
+    expected = get_pascalvoc_metrics(gts, dets, iou_threshold=0.3)
+    assert merged['mAP'] == expected['mAP']
+    for c, res in expected['per_class'].items():
+        assert (merged['per_class'][c]['precision'] == res['precision']).all()
+        assert merged['per_class'][c]['total positives'] == res['total positives']
+
+
+def test_multiple_thresholds():
+    gts = converter.text2bb('tests/test_case_1/gts', BBType.GROUND_TRUTH)
+    dets = converter.text2bb('tests/test_case_1/dets', BBType.DETECTED)
+    testing_ious = [0.1, 0.3, 0.5, 0.75]
+    results = get_pascalvoc_metrics(gts, dets, iou_threshold=testing_ious)
+    assert list(results) == testing_ious
+    for iou in testing_ious:
+        expected = get_pascalvoc_metrics(gts, dets, iou_threshold=iou)
+        assert results[iou]['mAP'] == expected['mAP']
+        for c, res in expected['per_class'].items():
+            assert results[iou]['per_class'][c]['AP'] == res['AP']
+            assert results[iou]['per_class'][c]['iou'] == iou
+
+
+def test_detection_table(tmp_path):
+    gts = converter.text2bb('tests/test_case_1/gts', BBType.GROUND_TRUTH)
+    dets = converter.text2bb('tests/test_case_1/dets', BBType.DETECTED)
+    res = get_pascalvoc_metrics(gts, dets, iou_threshold=0.3, generate_detection_table=True)
+    assert res['per_class']['object']['table'] is None
+    table = res['per_class']['object']['detection table']
+    assert len(table) == len(dets)
+    df = table.to_dataframe()
+    assert df['TP'].dtype == np.int64 and df['confidence'].dtype == np.float64
+    assert (df['precision'].values == res['per_class']['object']['precision']).all()
+    assert df['TP'].sum() == res['per_class']['object']['total TP']
+    pages = list(table.iter_pages(page_size=4))
+    assert len(pages) == int(np.ceil(len(df) / 4))
+    assert pd.concat(pages, ignore_index=True).equals(df)
+    table.to_csv(tmp_path / 'table.csv', page_size=4)
+    assert np.allclose(pd.read_csv(tmp_path / 'table.csv')['recall'], df['recall'])
+    pytest.importorskip('pyarrow')
+    table.to_parquet(tmp_path / 'table.parquet', page_size=4)
+    assert pd.read_parquet(tmp_path / 'table.parquet').equals(df)
+
+
+def test_table():
+    gts = converter.text2bb('tests/test_case_1/gts', BBType.GROUND_TRUTH)
+    dets = converter.text2bb('tests/test_case_1/dets', BBType.DETECTED)
+    res = get_pascalvoc_metrics(gts, dets, iou_threshold=0.3, generate_table=True)
+    assert res['per_class']['object']['detection table'] is None
+    table = res['per_class']['object']['table']
+    assert isinstance(table, pd.DataFrame)
+    assert list(table.columns) == [
+        'image', 'confidence', 'TP', 'FP', 'acc TP', 'acc FP', 'precision', 'recall'
+    ]
+    assert len(table) == len(dets)
+    # confidences are percentages with two decimals, sorted in decreasing order
+    confidences = sorted((bb.get_confidence() for bb in dets), reverse=True)
+    assert table['confidence'].tolist() == [f'{100*conf:.2f}%' for conf in confidences]
+    assert table['TP'].sum() == res['per_class']['object']['total TP']
+    assert table['acc FP'].iloc[-1] == res['per_class']['object']['total FP']
+
+
+def test_invalid_method():
+    gts = converter.text2bb('tests/test_case_1/gts', BBType.GROUND_TRUTH)
+    dets = converter.text2bb('tests/test_case_1/dets', BBType.DETECTED)
+    state = get_pascalvoc_state(gts, dets, iou_threshold=0.3)
+    with pytest.raises(ValueError):
+        merge_pascalvoc_states([state], method='invalid')
@@ -79,3 +79,39 @@ def test_validation_formats():
     assert len(bb_files) > 0
     for file_path in bb_files:
         assert validations.verify_format(file_path, FileFormat.YOLO)
+
+
+def test_get_format(tmp_path):
+    expected_formats = {
+        'data/database/gts/pascalvoc_format': FileFormat.PASCAL,
+        'data/database/gts/cvat_format': FileFormat.CVAT,
+        'data/database/gts/labelme_format': FileFormat.LABEL_ME,
+        'data/database/gts/coco_format_v1': FileFormat.COCO,
+        'data/database/dets/abs_xywh': FileFormat.ABSOLUTE_TEXT,
+        'data/database/gts/yolo_format/obj_train_data': FileFormat.YOLO,
+    }
+    for folder_annotations, expected_format in expected_formats.items():
+        bb_files = utils.get_files_recursively(folder_annotations)
+        assert len(bb_files) > 0
+        for file_path in bb_files:
+            assert validations.get_format(file_path) == expected_format
+    # files whose contents do not match their extensions are not parsed
+    contents = {
+        'empty.txt': b'',
+        'image': b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR',
+        'not_xml.xml': b'person 0 0 10 10',
+        'not_json.json': b'<annotation></annotation>',
+        'results.json': b'[{"image_id": 1, "bbox": [0, 0, 1, 1]}]',
+    }
+    formats = {}
+    for name, content in contents.items():
+        with open(tmp_path / name, 'wb') as f:
+            f.write(content)
+        formats[name] = validations.get_format(str(tmp_path / name))
+    assert formats == {
+        'empty.txt': FileFormat.ABSOLUTE_TEXT,
+        'image': FileFormat.UNKNOWN,
+        'not_xml.xml': FileFormat.UNKNOWN,
+        'not_json.json': FileFormat.UNKNOWN,
+        'results.json': FileFormat.UNKNOWN,
+    }
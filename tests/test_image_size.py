@@ -0,0 +1,35 @@
+import os
+
+import cv2
+import numpy as np
+import src.utils.general_utils as general_utils
+from src.utils.image_size import ImageSizeCache, get_image_size_from_header
+
+
+def test_image_size_from_header(tmp_path):
+    img = np.zeros((17, 33, 3), dtype=np.uint8)
+    for ext in ['jpg', 'png', 'bmp', 'webp']:
+        file_path = str(tmp_path / f'image.{ext}')
+        cv2.imwrite(file_path, img)
+        assert get_image_size_from_header(file_path) == (33, 17)
+    # unsupported formats are decoded
+    file_path = str(tmp_path / 'image.tif')
+    cv2.imwrite(file_path, img)
+    assert get_image_size_from_header(file_path) is None
+    assert general_utils.get_image_resolution(file_path) == {'height': 17, 'width': 33}
+
+
+def test_image_size_cache(tmp_path):
+    file_path = str(tmp_path / 'image.png')
+    cv2.imwrite(file_path, np.zeros((5, 7, 3), dtype=np.uint8))
+    cache = ImageSizeCache(str(tmp_path / 'sizes.json'))
+    assert general_utils.get_image_resolution(file_path, cache) == {'height': 5, 'width': 7}
+    assert cache.modified
+    cache.save()
+    assert not cache.modified
+    loaded = ImageSizeCache(str(tmp_path / 'sizes.json'))
+    assert loaded.get(file_path) == (7, 5)
+    # entries of modified files are not reused
+    cv2.imwrite(file_path, np.zeros((6, 8, 3), dtype=np.uint8))
+    os.utime(file_path, ns=(0, 0))
+    assert loaded.get(file_path) is None
@@ -1,6 +1,12 @@
+import json
 import os
+import pickle
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from src.evaluators.tube_evaluator import TubeEvaluator
+from src.tube import DenseTubes, Tube
 
 
 # TODO: More tests!!!
@@ -13,3 +19,90 @@ def test_tube_eval():
     res, mAP = tube_evaluator.evaluate(thr=0.5)
 
     assert mAP == 1.0
+    # the totals of each class are summed over the videos
+    for r in res.values():
+        assert r['total TP'] + r['total FP'] == len(r['precision'])
+        assert r['total TP'] == r['recall'][-1] * (r['total TP'] + r['total FN'])
+
+
+def test_dense_tubes_inter():
+    rng = np.random.default_rng(0)
+    tubes = []
+    for _ in range(12):
+        frames = np.sort(rng.choice(40, size=rng.integers(1, 20), replace=False))
+        boxes = np.column_stack([rng.uniform(0, 50, (len(frames), 2)),
+                                 rng.uniform(5, 30, (len(frames), 2))])
+        track = [{'frame': f, 'bbox': b} for f, b in zip(frames, boxes)]
+        tubes.append(Tube(category_id=0, video_id=0, track=track))
+    tubes1, tubes2 = tubes[:5], tubes[5:]
+
+    evaluator = TubeEvaluator('anno.json', 'preds.json')
+    expected = np.array([[np.sum(evaluator._tubes_inter(t1, t2)) for t2 in tubes2]
+                         for t1 in tubes1])
+    frames = DenseTubes.get_frames([tubes1, tubes2])
+    dense1, dense2 = DenseTubes(tubes1, frames), DenseTubes(tubes2, frames)
+    assert dense1.mask.sum() == sum(len(t.get_frames()) for t in tubes1)
+    # computing all frames at once or in blocks gives the same volumes
+    for max_elements in [1, 100, 1 << 22]:
+        assert np.allclose(dense1.pairwise_inter(dense2, max_elements), expected)
+
+
+def test_tube_eval_thresholds(tmp_path):
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    example_anno = os.path.join(this_dir, 'example_anno.json')
+    example_preds = str(tmp_path / 'example_preds.json')
+    shutil.copy(os.path.join(this_dir, 'example_preds.json'), example_preds)
+
+    thrs = [0.5, 0.75, 0.95]
+    tube_evaluator = TubeEvaluator(example_anno, example_preds)
+    res, mAP = tube_evaluator.evaluate(thr=thrs)
+    assert list(res.keys()) == thrs
+    for thr in thrs:
+        res_thr, mAP_thr = TubeEvaluator(example_anno, example_preds).evaluate(thr=thr)
+        assert res[thr][1] == mAP_thr
+        assert res[thr][0].keys() == res_thr.keys()
+    assert mAP == np.mean([res[thr][1] for thr in thrs])
+
+    # the predictions are read again if the file is modified
+    with open(example_preds, 'w') as f:
+        json.dump([], f)
+    assert tube_evaluator.evaluate(thr=0.5)[1] == 0.0
+
+
+def test_tube_eval_parallel():
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    example_anno = os.path.join(this_dir, 'example_anno.json')
+    example_preds = os.path.join(this_dir, 'example_preds.json')
+
+    thrs = [0.5, 0.75, 0.95]
+    res, mAP = TubeEvaluator(example_anno, example_preds).evaluate(thr=thrs)
+    with ThreadPoolExecutor(2) as executor:
+        for tube_evaluator in [
+                TubeEvaluator(example_anno, example_preds, workers=2),
+                TubeEvaluator(example_anno, example_preds, executor=executor)
+        ]:
+            res_parallel, mAP_parallel = tube_evaluator.evaluate(thr=thrs)
+            assert mAP_parallel == mAP
+            for thr in thrs:
+                for c, r in res[thr][0].items():
+                    assert np.array_equal(res_parallel[thr][0][c]['precision'], r['precision'])
+                    assert res_parallel[thr][0][c]['total FN'] == r['total FN']
+
+
+def test_tube_frame_index():
+    track = [{'frame': f, 'bbox': [f, 0, 10, 10], 'confidence': 0.5} for f in [3, 1, 3, 2]]
+    tube = Tube(category_id=0, video_id=0, track=track, id=7)
+    assert tube.id == 7
+    assert not hasattr(tube, '__dict__')
+    assert len(tube) == 4
+    assert tube.get_frames().tolist() == [1, 2, 3, 3]
+    assert not tube.has_unique_frames()
+    # boxes of a frame keep the order of the track
+    assert tube.get_frame_boxes(3).tolist() == [[3, 0, 13, 10], [3, 0, 13, 10]]
+    assert tube.get_frame_boxes(1).tolist() == [[1, 0, 11, 10]]
+    assert len(tube.get_frame_boxes(0)) == len(tube.get_frame_boxes(4)) == 0
+    assert tube.get_tube_volume() == 400
+
+    copy = pickle.loads(pickle.dumps(tube))
+    assert copy.id == 7
+    assert np.array_equal(copy.get_frame_boxes(3), tube.get_frame_boxes(3))